@@ -161,6 +161,7 @@ def hotkey_removed(app_service, item):
 
 def path_created_or_modified(configManager, configWindow, path):
     time.sleep(0.5)
+    configManager.app.service.path_changed(path)
     changed = configManager.path_created_or_modified(path)
     set_file_watched(configManager.app.monitor, path, True)
     if changed and configWindow is not None:
@@ -177,6 +178,7 @@ def set_file_watched(appmonitor, path, watch):
 
 def path_removed(configManager, configWindow, path):
     time.sleep(0.5)
+    configManager.app.service.path_changed(path)
     changed = configManager.path_removed(path)
     set_file_watched(configManager.app.monitor, path, False)
     if changed and configWindow is not None:
@@ -0,0 +1,330 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Lookup structures used to find the folders and items whose abbreviations can trigger on the current input buffer.
+
+An abbreviation can only trigger, if it ends directly at the end of the typed input ("trigger immediately") or one
+character before it (followed by a single trigger character). All abbreviations are stored in a trie. The
+AbbreviationMatcher advances a set of live trie states by one character per keystroke, so the candidates at the end
+of the input are known without re-scanning the buffer. The cost of a keystroke only depends on the number of
+currently live abbreviation prefixes, not on the buffer length or the number of configured phrases.
+
+An index is never modified once built. with_changes() returns a new index that shares all trie nodes not affected by
+the change with the original, so published indexes can be read without locking.
+"""
+
+import collections
+import itertools
+import time
+import typing
+
+from autokey.model.helpers import TriggerMode
+
+if typing.TYPE_CHECKING:
+    from autokey.model.folder import Folder
+    from autokey.model.phrase import Phrase
+    from autokey.model.script import Script
+    Item = typing.Union[Phrase, Script]
+
+Candidates = typing.Tuple[typing.List["Folder"], typing.List["Item"]]
+
+
+class _Entry(typing.NamedTuple):
+    """An abbreviation registered in the index. The ordinal keeps the configuration order of the owners."""
+    ordinal: typing.Any
+    owner: typing.Union["Folder", "Item"]
+    abbreviation: str
+    is_folder: bool
+    folded: bool
+    immediate: bool
+
+    @property
+    def key(self) -> str:
+        return self.abbreviation.casefold() if self.folded else self.abbreviation
+
+
+class _Node:
+
+    __slots__ = ("prefix", "children", "immediate", "delayed")
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.children = {}  # type: typing.Dict[str, _Node]
+        # Entries ending at this node, split by the trigger immediately setting of the owner
+        self.immediate = []  # type: typing.List[_Entry]
+        self.delayed = []  # type: typing.List[_Entry]
+
+    def copy(self) -> "_Node":
+        node = _Node(self.prefix)
+        node.children = dict(self.children)
+        node.immediate = list(self.immediate)
+        node.delayed = list(self.delayed)
+        return node
+
+
+class _Frame(typing.NamedTuple):
+    """Trie nodes reached after reading one input character, one tuple per trie, and the case-folded character."""
+    nodes: typing.Tuple[_Node, ...]
+    folded_nodes: typing.Tuple[_Node, ...]
+    folded_char: str
+
+
+_EMPTY_FRAME = _Frame((), (), "")
+
+
+class AbbreviationIndex:
+    """
+    Trie over the abbreviations of all folders and items.
+
+    Case sensitive abbreviations are stored verbatim, abbreviations of owners using the ignoreCase option are stored
+    case-folded in a separate trie. The index only pre-selects candidates based on the abbreviation position.
+    The remaining conditions (word characters, triggerInside, window filter) are checked by the owner's check_input().
+
+    Candidates are returned sorted by their ordinal. If no ordinals are given, the configuration order is the order of
+    the given folders, followed by the given items.
+    """
+
+    def __init__(self, folders: typing.Iterable["Folder"], items: typing.Iterable["Item"],
+                 ordinals: typing.Mapping[typing.Any, typing.Any]=None):
+        self.root = _Node("")
+        self.folded_root = _Node("")
+        # Upper bound of the abbreviation lengths, it is not lowered when abbreviations are removed.
+        self.max_length = 0
+        self._entries = {}  # type: typing.Dict[typing.Any, typing.List[_Entry]]
+        self._fresh = None  # type: typing.Optional[typing.Set[int]]
+        counter = itertools.count()
+        for is_folder, owners in ((True, folders), (False, items)):
+            for owner in owners:
+                self._add(next(counter) if ordinals is None else ordinals[owner], owner, is_folder)
+
+    def with_changes(self, removed: typing.Iterable=(),
+                     added: typing.Iterable[typing.Tuple[typing.Any, typing.Any, bool]]=()) -> "AbbreviationIndex":
+        """
+        Return a new index with the abbreviations of the removed folders and items dropped and those of the added ones
+        inserted. added contains (ordinal, owner, is_folder) tuples. This index is left unchanged.
+        Only the trie nodes on the paths of changed abbreviations are copied.
+        """
+        index = AbbreviationIndex.__new__(AbbreviationIndex)
+        index.max_length = self.max_length
+        index._entries = dict(self._entries)
+        index.root = self.root.copy()
+        index.folded_root = self.folded_root.copy()
+        # Nodes created during this change. Those can be modified in place.
+        index._fresh = {id(index.root), id(index.folded_root)}
+        for owner in removed:
+            for entry in index._entries.pop(owner, ()):
+                node = index._writable_node(entry)
+                (node.immediate if entry.immediate else node.delayed).remove(entry)
+        for ordinal, owner, is_folder in added:
+            index._add(ordinal, owner, is_folder)
+        index._fresh = None
+        return index
+
+    def entries(self) -> typing.List[typing.Tuple[typing.Any, str]]:
+        """Return all indexed (owner, abbreviation) pairs, in configuration order."""
+        found = []
+        nodes = [self.root, self.folded_root]
+        while nodes:
+            node = nodes.pop()
+            found += node.immediate
+            found += node.delayed
+            nodes += node.children.values()
+        found.sort(key=lambda e: (e.ordinal, e.abbreviation))
+        return [(entry.owner, entry.abbreviation) for entry in found]
+
+    def owners(self, abbreviation: str) -> typing.List:
+        """Return the folders and items using exactly the given abbreviation, in configuration order."""
+        found = []
+        for root, key in ((self.root, abbreviation), (self.folded_root, abbreviation.casefold())):
+            node = root
+            for char in key:
+                node = node.children.get(char)
+                if node is None:
+                    break
+            else:
+                found += (entry for entry in itertools.chain(node.immediate, node.delayed)
+                          if entry.abbreviation == abbreviation)
+        found.sort(key=lambda e: e.ordinal)
+        return [entry.owner for entry in found]
+
+    def _add(self, ordinal, owner, is_folder: bool):
+        if TriggerMode.ABBREVIATION not in owner.modes:
+            return
+        entries = []
+        for abbreviation in owner.abbreviations:
+            if not abbreviation:
+                continue
+            entry = _Entry(ordinal, owner, abbreviation, is_folder, owner.ignoreCase, owner.immediate)
+            node = self._writable_node(entry)
+            (node.immediate if entry.immediate else node.delayed).append(entry)
+            self.max_length = max(self.max_length, len(entry.key))
+            entries.append(entry)
+        if entries:
+            self._entries[owner] = entries
+
+    def _writable_node(self, entry: _Entry) -> _Node:
+        """
+        Return the node of the given entry, creating missing nodes. While applying changes, shared nodes on the path are
+        replaced by copies first.
+        """
+        fresh = self._fresh
+        node = self.folded_root if entry.folded else self.root
+        for char in entry.key:
+            child = node.children.get(char)
+            if child is None:
+                child = _Node(node.prefix + char)
+                if fresh is not None:
+                    fresh.add(id(child))
+                node.children[char] = child
+            elif fresh is not None and id(child) not in fresh:
+                child = child.copy()
+                fresh.add(id(child))
+                node.children[char] = child
+            node = child
+        return node
+
+    def find_candidates(self, buffer: str) -> Candidates:
+        """
+        Return the folders and items that may trigger on the given input buffer, each in configuration order.
+        """
+        matcher = AbbreviationMatcher(self)
+        # Longer abbreviations than max_length can not end at one of the two trigger positions.
+        for char in buffer[-(self.max_length + 1):]:
+            matcher.push(char)
+        return matcher.candidates()
+
+
+class AbbreviationMatcher:
+    """
+    Streaming matcher that follows the typed input one character at a time.
+
+    For every input character a frame of live trie states is kept. A state is the trie node reached by an input
+    suffix that is a prefix of at least one abbreviation. Reading a character advances each live state and starts a new
+    match at the trie root. A backspace simply drops the last frame, so the input stack kept by the Service and the
+    frames stay in lockstep. Each frame also holds the case-folded input character, so the case-folded input is
+    available without folding the whole buffer again, see folded_chars().
+
+    The time spent in push() is recorded, see last_step_ns, max_step_ns, total_step_ns and step_count.
+    """
+
+    def __init__(self, index: AbbreviationIndex=None, maxlen: int=None):
+        self.index = index
+        self._frames = collections.deque(maxlen=maxlen)  # type: typing.Deque[_Frame]
+        self.last_step_ns = 0
+        self.max_step_ns = 0
+        self.total_step_ns = 0
+        self.step_count = 0
+
+    def set_index(self, index: AbbreviationIndex, buffer: typing.Iterable[str]=()):
+        """
+        Use the given index for matching. If the index changed, the live states are rebuilt by replaying the
+        characters of the current input buffer.
+        """
+        if index is self.index:
+            return
+        self.index = index
+        self._frames.clear()
+        for char in buffer:
+            self._frames.append(self._advance(char))
+
+    def push(self, char: str):
+        """Advance all live states by the typed character."""
+        start = time.perf_counter_ns()
+        self._frames.append(self._advance(char))
+        elapsed = time.perf_counter_ns() - start
+        self.last_step_ns = elapsed
+        self.total_step_ns += elapsed
+        self.step_count += 1
+        if elapsed > self.max_step_ns:
+            self.max_step_ns = elapsed
+
+    def pop(self):
+        """Undo the last push(), used when the user presses backspace."""
+        if self._frames:
+            self._frames.pop()
+
+    def clear(self):
+        self._frames.clear()
+
+    def reset_statistics(self):
+        self.last_step_ns = self.max_step_ns = self.total_step_ns = self.step_count = 0
+
+    @property
+    def live_prefixes(self) -> typing.FrozenSet[str]:
+        """
+        The abbreviation prefixes currently matched by a suffix of the input.
+        Prefixes of abbreviations using ignoreCase are reported case-folded.
+        """
+        if not self._frames:
+            return frozenset()
+        frame = self._frames[-1]
+        return frozenset(node.prefix for node in itertools.chain(frame.nodes, frame.folded_nodes))
+
+    def folded_chars(self) -> typing.List[str]:
+        """Return the case-folded input characters, one string per input character."""
+        return [frame.folded_char for frame in self._frames]
+
+    def candidates(self) -> Candidates:
+        """
+        Return the folders and items that may trigger on the current input, each in configuration order.
+        """
+        found = []  # type: typing.List[_Entry]
+        if self._frames:
+            frame = self._frames[-1]
+            for node in itertools.chain(frame.nodes, frame.folded_nodes):
+                found += node.immediate
+        if len(self._frames) > 1:
+            frame = self._frames[-2]
+            for node in itertools.chain(frame.nodes, frame.folded_nodes):
+                found += node.delayed
+        if not found:
+            return [], []
+
+        folders = []
+        items = []
+        seen = set()
+        for entry in sorted(found, key=lambda e: e.ordinal):
+            if id(entry.owner) in seen:
+                continue
+            seen.add(id(entry.owner))
+            if entry.is_folder:
+                folders.append(entry.owner)
+            else:
+                items.append(entry.owner)
+        return folders, items
+
+    def _advance(self, char: str) -> _Frame:
+        # Case folding may produce more than one character, the folded trie is walked over all of them.
+        folded = char.casefold()
+        index = self.index
+        if index is None:
+            return _Frame((), (), folded)
+        previous = self._frames[-1] if self._frames else _EMPTY_FRAME
+
+        nodes = []
+        for node in itertools.chain(previous.nodes, (index.root,)):
+            child = node.children.get(char)
+            if child is not None:
+                nodes.append(child)
+
+        folded_nodes = []
+        for node in itertools.chain(previous.folded_nodes, (index.folded_root,)):
+            for folded_char in folded:
+                node = node.children.get(folded_char)
+                if node is None:
+                    break
+            else:
+                folded_nodes.append(node)
+
+        return _Frame(tuple(nodes), tuple(folded_nodes), folded)
@@ -0,0 +1,39 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Immutable view of the lookup structures used while processing key presses.
+
+The ConfigManager builds a complete new snapshot on every configuration rebuild and publishes it with a single
+attribute assignment. The key press handling reads ConfigManager.snapshot once per key and uses that object
+throughout, so it never has to take the configuration lock and never sees a half-built configuration.
+"""
+
+import typing
+
+from autokey.configmanager.abbreviation_index import AbbreviationIndex
+from autokey.configmanager.hotkey_index import HotkeyIndex
+from autokey.configmanager.window_filter_cache import WindowFilterCache
+
+
+class ConfigSnapshot(typing.NamedTuple):
+    version: int
+    abbreviation_index: AbbreviationIndex
+    hotkey_index: HotkeyIndex
+    window_filters: WindowFilterCache
+    global_hotkeys: typing.Tuple
+
+    @classmethod
+    def empty(cls) -> "ConfigSnapshot":
+        """Snapshot used before the configuration is loaded. Nothing can trigger."""
+        return cls(0, AbbreviationIndex([], []), HotkeyIndex([], [], []), WindowFilterCache(()), ())
@@ -20,11 +20,13 @@ import os
 import os.path
 import shutil
 import glob
+import sys
 import threading
 import typing
 import re
 import json
 import itertools
+import logging
 
 import autokey.model.abstract_hotkey
 import autokey.model.folder
@@ -37,14 +39,39 @@ from autokey.configmanager.configmanager_constants import CONFIG_FILE, CONFIG_DE
     RECENT_ENTRIES_FOLDER, IS_FIRST_RUN, SERVICE_RUNNING, MENU_TAKES_FOCUS, SHOW_TRAY_ICON, SORT_BY_USAGE_COUNT, \
     PROMPT_TO_SAVE, ENABLE_QT4_WORKAROUND, UNDO_USING_BACKSPACE, WINDOW_DEFAULT_SIZE, HPANE_POSITION, COLUMN_WIDTHS, \
     SHOW_TOOLBAR, NOTIFICATION_ICON, WORKAROUND_APP_REGEX, TRIGGER_BY_INITIAL, SCRIPT_GLOBALS, INTERFACE_TYPE, \
-    DISABLED_MODIFIERS, GTK_THEME, GTK_TREE_VIEW_EXPANDED_ROWS, PATH_LAST_OPEN
+    DISABLED_MODIFIERS, GTK_THEME, GTK_TREE_VIEW_EXPANDED_ROWS, PATH_LAST_OPEN, KEYBOARD_BACKEND, \
+    CLIPBOARD_RESTORE_TIMEOUT, WORKER_POOL_SIZE, PERSIST_COMPILED_SCRIPTS, SCRIPT_PROCESS_POOL_SIZE, \
+    SCRIPT_PROCESS_TIMEOUT
 import autokey.configmanager.version_upgrading as version_upgrade
 import autokey.configmanager.predefined_user_files
-from autokey.iomediator.constants import X_RECORD_INTERFACE
+from autokey.configmanager.abbreviation_index import AbbreviationIndex
+from autokey.configmanager.window_filter_cache import WindowFilterCache
+from autokey.configmanager.hotkey_index import HotkeyIndex
+from autokey.configmanager.config_snapshot import ConfigSnapshot
+from autokey.iomediator.constants import X_RECORD_INTERFACE, SEND_EVENT_BACKEND
 from autokey.model.key import MODIFIERS
 
 logger = __import__("autokey.logger").logger.get_logger(__name__)
 
+# Ordinal component placing the items of a folder after all its sub folders, see ConfigManager.__processFolder()
+_ITEM_POSITION = sys.maxsize
+# apply_changes() removes up to this many changed objects from the lists one by one, more are filtered in one pass.
+_MAX_SINGLE_REMOVALS = 16
+
+
+def _is_folder(owner) -> bool:
+    return isinstance(owner, autokey.model.folder.Folder)
+
+
+class _ConfigLists(typing.NamedTuple):
+    hotKeyFolders: list
+    hotKeys: list
+    abbreviations: list
+    allFolders: list
+    allItems: list
+    # Sort key of each folder and item, reproducing the order of the lists
+    ordinals: dict
+
 
 def create_config_manager_instance(auto_key_app, had_error=False):
     if not os.path.exists(CONFIG_DEFAULT_FOLDER):
@@ -170,6 +197,17 @@ class ConfigManager:
                 #PREDICTIVE_LENGTH: 5,
                 ENABLE_QT4_WORKAROUND: False,
                 INTERFACE_TYPE: X_RECORD_INTERFACE,
+                KEYBOARD_BACKEND: SEND_EVENT_BACKEND,
+                # Seconds after which the clipboard is restored, if the application did not fetch the pasted text
+                CLIPBOARD_RESTORE_TIMEOUT: 1.0,
+                # Maximum number of scripts running at the same time. Phrases are expanded on a worker of their own.
+                WORKER_POOL_SIZE: 8,
+                # Store compiled scripts in the data directory, so they need not be compiled again after a restart
+                PERSIST_COMPILED_SCRIPTS: False,
+                # Number of worker processes for scripts using the runInProcess option
+                SCRIPT_PROCESS_POOL_SIZE: 2,
+                # Seconds after which a script running in a worker process is killed, 0 for no limit
+                SCRIPT_PROCESS_TIMEOUT: 60.0,
                 UNDO_USING_BACKSPACE: True,
                 WINDOW_DEFAULT_SIZE: (600, 400),
                 HPANE_POSITION: 150,
@@ -196,6 +234,10 @@ class ConfigManager:
         """
         self.VERSION = self.__class__.CLASS_VERSION
         self.lock = threading.Lock()
+        # Lookup structures used by the key press handling, replaced as a whole by config_altered()
+        self.snapshot = ConfigSnapshot.empty()
+        self.__ordinals = {}
+        self.__nextPosition = itertools.count()
 
         self.app = app
         self.folders = []
@@ -319,6 +361,8 @@ class ConfigManager:
     def path_created_or_modified(self, path):
         directory, baseName = os.path.split(path)
         loaded = False
+        added = []
+        updated = []
 
         if path == CONFIG_FILE:
             self.reload_global_config()
@@ -333,12 +377,14 @@ class ConfigManager:
                 if directory == CONFIG_DEFAULT_FOLDER:
                     self.folders.append(f)
                     f.load()
+                    added.append(f)
                     loaded = True
                 else:
                     folder = self.__checkExistingFolder(directory)
                     if folder is not None:
                         f.load(folder)
                         folder.add_folder(f)
+                        added.append(f)
                         loaded = True
 
             # -- handle txt or py files added or modified
@@ -358,7 +404,11 @@ class ConfigManager:
                     folder = self.__checkExistingFolder(directory)
                     if folder is not None:
                         i.load(folder)
-                        if isNew: folder.add_item(i)
+                        if isNew:
+                            folder.add_item(i)
+                            added.append(i)
+                        else:
+                            updated.append(i)
                         loaded = True
 
                 # --- handle changes to folder settings
@@ -367,6 +417,7 @@ class ConfigManager:
                     folder = self.__checkExistingFolder(directory)
                     if folder is not None:
                         folder.load_from_serialized()
+                        updated.append(folder)
                         loaded = True
 
                 # --- handle changes to item settings
@@ -375,12 +426,13 @@ class ConfigManager:
                     for item in self.allItems:
                         if item.get_json_path() == path:
                             item.load_from_serialized()
+                            updated.append(item)
                             loaded = True
 
             if not loaded:
                 logger.warning("No action taken for create/update event at %s", path)
             else:
-                self.config_altered(False)
+                self.apply_changes(added=added, updated=updated)
             return loaded
 
     def path_removed(self, path):
@@ -408,7 +460,7 @@ class ConfigManager:
         if not deleted:
             logger.warning("No action taken for delete event at %s", path)
         else:
-            self.config_altered(False)
+            self.apply_changes(removed=[folder if folder is not None else item])
         return deleted
 
 
@@ -509,7 +561,9 @@ class ConfigManager:
     def config_altered(self, persistGlobal):
         """
         Called when some element of configuration has been altered, to update
-        the lists of phrases/folders.
+        the lists of phrases/folders. This rebuilds all in-memory structures, use
+        apply_changes() if only a few folders or items were added, removed or
+        updated.
 
         @param persistGlobal: save the global configuration at the end of the process
         """
@@ -522,23 +576,18 @@ class ConfigManager:
         #for folder in rootFolders:
         #    self.folders.append(folder)
 
-        self.hotKeyFolders = []
-        self.hotKeys = []
-
-        self.abbreviations = []
-
-        self.allFolders = []
-        self.allItems = []
-
-        for folder in self.folders:
-            if autokey.model.helpers.TriggerMode.HOTKEY in folder.modes:
-                self.hotKeyFolders.append(folder)
-            self.allFolders.append(folder)
-
-            if not self.app.monitor.has_watch(folder.path):
-                self.app.monitor.add_watch(folder.path)
+        lists = self.__collect()
+        self.hotKeyFolders = lists.hotKeyFolders
+        self.hotKeys = lists.hotKeys
+        self.abbreviations = lists.abbreviations
+        self.allFolders = lists.allFolders
+        self.allItems = lists.allItems
+        self.__ordinals = lists.ordinals
+        # Positions handed out to folders and items added by apply_changes(). Larger than all positions used so far.
+        self.__nextPosition = itertools.count(len(self.allFolders) + len(self.allItems))
 
-            self.__processFolder(folder)
+        for folder in self.allFolders:
+            self.__addWatch(folder.path)
 
         self.globalHotkeys = []
         self.globalHotkeys.append(self.configHotkey)
@@ -551,31 +600,231 @@ class ConfigManager:
         #_logger.debug("All folders: %s", self.allFolders)
         #_logger.debug("All phrases: %s", self.allItems)
 
+        self.__publishSnapshot(
+            AbbreviationIndex(self.allFolders, self.allItems, self.__ordinals),
+            HotkeyIndex(self.allFolders, self.allItems, self.globalHotkeys, self.__ordinals),
+            WindowFilterCache(itertools.chain(self.allFolders, self.allItems))
+        )
+
         if persistGlobal:
             save_config(self)
 
         self.lock.release()
 
-    def __processFolder(self, parentFolder):
-        if not self.app.monitor.has_watch(parentFolder.path):
-            self.app.monitor.add_watch(parentFolder.path)
-
-        for folder in parentFolder.folders:
+    def __collect(self) -> "_ConfigLists":
+        lists = _ConfigLists([], [], [], [], [], {})
+        for position, folder in enumerate(self.folders):
             if autokey.model.helpers.TriggerMode.HOTKEY in folder.modes:
-                self.hotKeyFolders.append(folder)
-            self.allFolders.append(folder)
+                lists.hotKeyFolders.append(folder)
+            lists.allFolders.append(folder)
+            lists.ordinals[folder] = (position,)
+
+            self.__processFolder(folder, lists)
+        return lists
+
+    def __processFolder(self, parentFolder, lists: "_ConfigLists"):
+        """
+        Add the sub folders and items of the given folder to the lists. The ordinals assigned to them sort in the
+        order of the lists: A folder comes before its sub folders, the items of a folder come after all items of
+        its sub folders.
+        """
+        parentOrdinal = lists.ordinals[parentFolder]
 
-            if not self.app.monitor.has_watch(folder.path):
-                self.app.monitor.add_watch(folder.path)
+        for position, folder in enumerate(parentFolder.folders):
+            if autokey.model.helpers.TriggerMode.HOTKEY in folder.modes:
+                lists.hotKeyFolders.append(folder)
+            lists.allFolders.append(folder)
+            lists.ordinals[folder] = parentOrdinal + (position,)
 
-            self.__processFolder(folder)
+            self.__processFolder(folder, lists)
 
-        for item in parentFolder.items:
+        for position, item in enumerate(parentFolder.items):
             if autokey.model.helpers.TriggerMode.HOTKEY in item.modes:
-                self.hotKeys.append(item)
+                lists.hotKeys.append(item)
             if autokey.model.helpers.TriggerMode.ABBREVIATION in item.modes:
-                self.abbreviations.append(item)
-            self.allItems.append(item)
+                lists.abbreviations.append(item)
+            lists.allItems.append(item)
+            lists.ordinals[item] = parentOrdinal + (_ITEM_POSITION, position)
+
+    def __addWatch(self, path):
+        if not self.app.monitor.has_watch(path):
+            self.app.monitor.add_watch(path)
+
+    def __publishSnapshot(self, abbreviationIndex, hotkeyIndex, windowFilterCache):
+        self.abbreviationIndex = abbreviationIndex
+        self.hotkeyIndex = hotkeyIndex
+        # Replacing the cache discards all per-window results computed for the previous configuration.
+        self.windowFilterCache = windowFilterCache
+        # Publish the new lookup structures with a single assignment. Readers of the previous snapshot are unaffected.
+        self.snapshot = ConfigSnapshot(
+            self.snapshot.version + 1, abbreviationIndex, hotkeyIndex, windowFilterCache, tuple(self.globalHotkeys))
+
+    def apply_changes(self, added: typing.Iterable=(), removed: typing.Iterable=(), updated: typing.Iterable=(),
+                      persistGlobal=False):
+        """
+        Update the in-memory structures after single folders or items were added, removed or updated, without
+        rebuilding everything. Changes to a folder include all its sub folders and items. Added folders and items
+        must already be attached to their parent, removed ones must already be detached.
+
+        Falls back to config_altered(), if a change can not be applied incrementally, for example because the parent
+        of an added item is not known.
+
+        @param added: new folders and items
+        @param removed: folders and items no longer part of the configuration
+        @param updated: folders and items whose abbreviations, hotkey, modes or window filter changed
+        @param persistGlobal: save the global configuration at the end of the process
+        """
+        self.lock.acquire()
+        try:
+            # Before the first rebuild there is nothing to patch.
+            applied = self.snapshot.version and self.__tryApplyChanges(added, removed, updated)
+            if applied and persistGlobal:
+                save_config(self)
+        finally:
+            self.lock.release()
+        if not applied:
+            self.config_altered(persistGlobal)
+        elif logger.isEnabledFor(logging.DEBUG):
+            # Comparing with a full rebuild is too slow for normal use, but catches changes reported incompletely.
+            self.check_index_consistency()
+
+    def __tryApplyChanges(self, added, removed, updated) -> bool:
+        removedOwners = self.__expand(removed)
+        updatedOwners = self.__expand(updated)
+        addedOwners = self.__expand(added)
+        for owner in removedOwners:
+            self.__ordinals.pop(owner, None)
+        # Parents come before their children, so the parent ordinals are known when reaching the children.
+        for owner in itertools.chain(updatedOwners, addedOwners):
+            if owner not in self.__ordinals:
+                ordinal = self.__newOrdinal(owner)
+                if ordinal is None:
+                    logger.debug("Cannot apply the change to %s incrementally, rebuilding instead", owner)
+                    return False
+                self.__ordinals[owner] = ordinal
+
+        self.__applyChanges(removedOwners + updatedOwners, updatedOwners + addedOwners)
+        return True
+
+    def __applyChanges(self, changedOwners: list, presentOwners: list):
+        snapshot = self.snapshot
+        indexed = [(self.__ordinals[owner], owner, _is_folder(owner)) for owner in presentOwners]
+
+        changedSet = set(changedOwners)
+        changedSet.update(presentOwners)
+        changed = list(changedSet)
+        hotkeyMode = autokey.model.helpers.TriggerMode.HOTKEY
+        abbreviationMode = autokey.model.helpers.TriggerMode.ABBREVIATION
+        presentFolders = [owner for owner in presentOwners if _is_folder(owner)]
+        presentItems = [owner for owner in presentOwners if not _is_folder(owner)]
+        self.allFolders = self.__patchList(self.allFolders, changed, changedSet, presentFolders)
+        self.hotKeyFolders = self.__patchList(
+            self.hotKeyFolders, changed, changedSet, [f for f in presentFolders if hotkeyMode in f.modes])
+        self.allItems = self.__patchList(self.allItems, changed, changedSet, presentItems)
+        self.hotKeys = self.__patchList(
+            self.hotKeys, changed, changedSet, [i for i in presentItems if hotkeyMode in i.modes])
+        self.abbreviations = self.__patchList(
+            self.abbreviations, changed, changedSet, [i for i in presentItems if abbreviationMode in i.modes])
+
+        for folder in presentFolders:
+            self.__addWatch(folder.path)
+
+        self.__publishSnapshot(
+            snapshot.abbreviation_index.with_changes(changedOwners, indexed),
+            snapshot.hotkey_index.with_changes(changedOwners, indexed),
+            snapshot.window_filters.with_changes(changedOwners, presentOwners)
+        )
+
+    @staticmethod
+    def __expand(owners: typing.Iterable) -> list:
+        """Return the given folders and items, and all sub folders and items of the given folders. Parents first."""
+        result = {}
+        pending = list(owners)
+        pending.reverse()
+        while pending:
+            owner = pending.pop()
+            result[owner] = None
+            if _is_folder(owner):
+                pending.extend(reversed(owner.items))
+                pending.extend(reversed(owner.folders))
+        return list(result)
+
+    def __newOrdinal(self, owner):
+        """Return the ordinal for a folder or item added after the last rebuild, placing it last in its parent."""
+        isFolder = _is_folder(owner)
+        if owner.parent is None:
+            if isFolder and owner in self.folders:
+                return next(self.__nextPosition),
+            return None
+        parentOrdinal = self.__ordinals.get(owner.parent)
+        if parentOrdinal is None:
+            return None
+        elif isFolder:
+            return parentOrdinal + (next(self.__nextPosition),)
+        else:
+            return parentOrdinal + (_ITEM_POSITION, next(self.__nextPosition))
+
+    def __patchList(self, owners: list, changed: list, changedSet: set, wanted: list) -> list:
+        """
+        Return a copy of the given list without the changed folders or items, and with the wanted ones inserted at
+        their position in configuration order.
+        """
+        if len(changed) > _MAX_SINGLE_REMOVALS:
+            result = [owner for owner in owners if owner not in changedSet]
+        else:
+            result = list(owners)
+            for owner in changed:
+                try:
+                    result.remove(owner)
+                except ValueError:
+                    pass
+
+        # Folders appended directly to allFolders by scripts have no ordinal. Keep them at the end.
+        sortKey = lambda owner: (0, self.__ordinals[owner]) if owner in self.__ordinals else (1,)
+        for owner in wanted:
+            key = sortKey(owner)
+            low, high = 0, len(result)
+            while low < high:
+                middle = (low + high) // 2
+                if sortKey(result[middle]) < key:
+                    low = middle + 1
+                else:
+                    high = middle
+            result.insert(low, owner)
+        return result
+
+    def check_index_consistency(self) -> bool:
+        """
+        Compare the incrementally maintained in-memory structures with freshly built ones. If they differ, the
+        differences are logged and the structures are rebuilt using config_altered().
+
+        @return: True, if the structures were consistent
+        """
+        self.lock.acquire()
+        try:
+            lists = self.__collect()
+            snapshot = self.snapshot
+            mismatches = [
+                name for name in ("hotKeyFolders", "hotKeys", "abbreviations", "allFolders", "allItems")
+                if getattr(self, name) != getattr(lists, name)
+            ]
+            if snapshot.abbreviation_index.entries() != \
+                    AbbreviationIndex(lists.allFolders, lists.allItems, lists.ordinals).entries():
+                mismatches.append("abbreviation index")
+            if snapshot.hotkey_index.contents() != \
+                    HotkeyIndex(lists.allFolders, lists.allItems, self.globalHotkeys, lists.ordinals).contents():
+                mismatches.append("hotkey index")
+            if snapshot.window_filters.filters() != \
+                    WindowFilterCache(itertools.chain(lists.allFolders, lists.allItems)).filters():
+                mismatches.append("window filters")
+        finally:
+            self.lock.release()
+
+        if mismatches:
+            logger.error("In-memory configuration out of sync, rebuilding. Differences in: %s", ", ".join(mismatches))
+            self.config_altered(False)
+            return False
+        return True
 
     # TODO Future functionality
     def add_recent_entry(self, entry):
@@ -617,7 +866,7 @@ class ConfigManager:
         @param filterPattern: The filter pattern associated with the abbreviation
         @param targetItem: the phrase for which the abbreviation to be used
         """
-        for item in itertools.chain(self.allFolders, self.allItems):
+        for item in self.abbreviationIndex.owners(abbreviation):
             if ConfigManager.item_has_abbreviation(item, abbreviation) and \
                     item.filter_matches(filterPattern):
                     return item is targetItem, item
@@ -686,7 +935,8 @@ class ConfigManager:
         @param hotKey: the hotkey to check
         @param newFilterPattern:
         """
-        for item in itertools.chain(self.allFolders, self.allItems):
+        folders, items, globalHotkeys = self.hotkeyIndex.registered(modifiers, hotKey)
+        for item in itertools.chain(folders, items):
             if autokey.model.helpers.TriggerMode.HOTKEY in item.modes and \
                     ConfigManager.item_has_same_hotkey(item,
                                               modifiers,
@@ -694,7 +944,7 @@ class ConfigManager:
                                               newFilterPattern):
                 return item
 
-        for item in self.globalHotkeys:
+        for item in globalHotkeys:
             if item.enabled and ConfigManager.item_has_same_hotkey(item,
                                              modifiers,
                                              hotKey,
@@ -712,6 +962,16 @@ class ConfigManager:
         Removes all temporary folders and phrases, as well as any within temporary folders.
         Useful for rc-style scripts that want to change a set of keys.
         """
+        hotkeyFolders = self.hotKeyFolders
+        removed = []
+        self.__removeTemporary(folder, in_temp_parent, removed)
+        # Removing temporary entries also unsets the hotkeys of the visited folders.
+        removedSet = set(removed)
+        unsetFolders = [f for f in hotkeyFolders
+                        if f not in removedSet and autokey.model.helpers.TriggerMode.HOTKEY not in f.modes]
+        self.apply_changes(removed=removed, updated=unsetFolders)
+
+    def __removeTemporary(self, folder, in_temp_parent, removed: list):
         if folder is None:
             searchFolders = self.allFolders
             searchItems = self.allItems
@@ -719,37 +979,48 @@ class ConfigManager:
             searchFolders = folder.folders
             searchItems = folder.items
 
-        for item in searchItems:
+        # Iterate over copies, as the lists are modified on the way.
+        for item in list(searchItems):
             try:
                 if item.temporary or in_temp_parent:
                     self.__deleteHotkeys(item)
                     searchItems.remove(item)
+                    if folder is None and item in item.parent.items:
+                        # Also detach it from the folder tree, which apply_changes() expects of removed items.
+                        item.parent.remove_item(item)
+                    removed.append(item)
             # Items created before this update don't have a 'temporary' field.
             except AttributeError:
                 pass
 
-        for subfolder in searchFolders:
+        for subfolder in list(searchFolders):
             self.__deleteHotkeys(subfolder)
+            temporary = in_temp_parent
             try:
                 if subfolder.temporary or in_temp_parent:
-                    in_temp_parent = True
+                    temporary = True
                     if folder is not None:
                         folder.remove_folder(subfolder)
                     else:
                         searchFolders.remove(subfolder)
+                        siblings = self.folders if subfolder.parent is None else subfolder.parent.folders
+                        if subfolder in siblings:
+                            siblings.remove(subfolder)
+                    removed.append(subfolder)
             # Items created before this update don't have a 'temporary' field.
             except AttributeError:
                 pass
-            self.remove_all_temporary(subfolder, in_temp_parent)
+            self.__removeTemporary(subfolder, temporary, removed)
 
     def delete_hotkeys(self, removed_item):
         return self.__deleteHotkeys(removed_item)
 
     def __deleteHotkeys(self, removed_item):
-        removed_item.unset_hotkey()
         app = self.app
+        # Report the removal first, the interface releases the grab of the hotkey the item had.
         if autokey.model.helpers.TriggerMode.HOTKEY in removed_item.modes:
             app.hotkey_removed(removed_item)
+        removed_item.unset_hotkey()
 
         if isinstance(removed_item, autokey.model.folder.Folder):
             for subFolder in removed_item.folders:
@@ -30,6 +30,12 @@ RECENT_ENTRIES_FOLDER = "Recently Typed"
 
 # JSON Key names used in the configuration file
 INTERFACE_TYPE = "interfaceType"
+KEYBOARD_BACKEND = "keyboardBackend"
+CLIPBOARD_RESTORE_TIMEOUT = "clipboardRestoreTimeout"
+WORKER_POOL_SIZE = "workerPoolSize"
+PERSIST_COMPILED_SCRIPTS = "persistCompiledScripts"
+SCRIPT_PROCESS_POOL_SIZE = "scriptProcessPoolSize"
+SCRIPT_PROCESS_TIMEOUT = "scriptProcessTimeout"
 IS_FIRST_RUN = "isFirstRun"
 SERVICE_RUNNING = "serviceRunning"
 MENU_TAKES_FOCUS = "menuTakesFocus"
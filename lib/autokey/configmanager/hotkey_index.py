@@ -0,0 +1,182 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Hotkey dispatch table, mapping (modifiers, key) to the folders and items using that hotkey.
+
+Hotkey resolution is a single dictionary lookup, followed by a window filter check on the few items sharing the
+hotkey. The table is built by ConfigManager.config_altered() and updated with with_changes(), which returns a new
+table and leaves the original untouched. Because an item's hotkey can be unset without a configuration change
+being reported, every lookup re-checks the current hotkey of the returned folders and items.
+"""
+
+import itertools
+import typing
+
+from autokey.model.helpers import TriggerMode
+
+HotkeyKey = typing.Tuple[typing.Tuple[str, ...], str]
+
+FILTER_OWN = 0
+FILTER_INHERITED = 1
+FILTER_NONE = 2
+
+
+def make_key(modifiers: typing.Iterable[str], key: str) -> HotkeyKey:
+    return tuple(sorted(modifiers)), key
+
+
+def filter_specificity(item) -> int:
+    """
+    Rank the window filter of the given folder or item. Lower values are more specific: An own window filter is more
+    specific than one inherited from a parent folder, which in turn is more specific than no filter at all.
+    """
+    if item.windowInfoRegex is not None:
+        return FILTER_OWN
+    elif item.get_applicable_regex() is not None:
+        return FILTER_INHERITED
+    else:
+        return FILTER_NONE
+
+
+class _Registration(typing.NamedTuple):
+    """The table position of an indexed folder or item, as recorded when it was added."""
+    key: HotkeyKey
+    is_folder: bool
+    ordinal: typing.Any
+    specificity: int
+
+
+class HotkeyIndex:
+    """
+    If no ordinals are given, the configuration order is the order of the given folders, followed by the given items.
+    """
+
+    def __init__(self, folders: typing.Iterable, items: typing.Iterable, global_hotkeys: typing.Iterable,
+                 ordinals: typing.Mapping[typing.Any, typing.Any]=None):
+        # Buckets in configuration order, used to find conflicting hotkeys.
+        self._folders = {}  # type: typing.Dict[HotkeyKey, typing.List]
+        self._items = {}  # type: typing.Dict[HotkeyKey, typing.List]
+        self._globals = {}  # type: typing.Dict[HotkeyKey, typing.List]
+        # Buckets ordered by filter specificity, used to dispatch key presses. Items with equally specific filters keep
+        # their configuration order.
+        self._dispatch_folders = {}  # type: typing.Dict[HotkeyKey, typing.List]
+        self._dispatch_items = {}  # type: typing.Dict[HotkeyKey, typing.List]
+        self._registrations = {}  # type: typing.Dict[typing.Any, _Registration]
+
+        counter = itertools.count()
+        changed = set()
+        for is_folder, owners in ((True, folders), (False, items)):
+            for owner in owners:
+                ordinal = next(counter) if ordinals is None else ordinals[owner]
+                key = self._register(owner, ordinal, is_folder)
+                if key is not None:
+                    changed.add((key, is_folder))
+        self._sort_buckets(changed)
+
+        for owner in global_hotkeys:
+            if owner.hotKey is not None:
+                self._globals.setdefault(make_key(owner.modifiers, owner.hotKey), []).append(owner)
+
+    def with_changes(self, removed: typing.Iterable=(),
+                     added: typing.Iterable[typing.Tuple[typing.Any, typing.Any, bool]]=()) -> "HotkeyIndex":
+        """
+        Return a new table without the removed folders and items and with the added ones. added contains
+        (ordinal, owner, is_folder) tuples. This table is left unchanged, only the affected buckets are copied.
+        """
+        index = HotkeyIndex.__new__(HotkeyIndex)
+        index._folders = dict(self._folders)
+        index._items = dict(self._items)
+        index._globals = self._globals
+        index._dispatch_folders = dict(self._dispatch_folders)
+        index._dispatch_items = dict(self._dispatch_items)
+        index._registrations = dict(self._registrations)
+
+        changed = set()
+        for owner in removed:
+            registration = index._registrations.pop(owner, None)
+            if registration is not None:
+                buckets = index._folders if registration.is_folder else index._items
+                bucket = [other for other in buckets[registration.key] if other is not owner]
+                if bucket:
+                    buckets[registration.key] = bucket
+                else:
+                    del buckets[registration.key]
+                changed.add((registration.key, registration.is_folder))
+        for ordinal, owner, is_folder in added:
+            key = index._register(owner, ordinal, is_folder, copy=True)
+            if key is not None:
+                changed.add((key, is_folder))
+        index._sort_buckets(changed)
+        return index
+
+    def _register(self, owner, ordinal, is_folder: bool, copy: bool=False) -> typing.Optional[HotkeyKey]:
+        if owner.hotKey is None or TriggerMode.HOTKEY not in owner.modes:
+            return None
+        key = make_key(owner.modifiers, owner.hotKey)
+        self._registrations[owner] = _Registration(key, is_folder, ordinal, filter_specificity(owner))
+        buckets = self._folders if is_folder else self._items
+        bucket = buckets.get(key)
+        if bucket is None or copy:
+            # Buckets may be shared with the table this one was derived from, so never modify them in place.
+            bucket = buckets[key] = list(bucket or ())
+        bucket.append(owner)
+        return key
+
+    def _sort_buckets(self, changed: typing.Iterable[typing.Tuple[HotkeyKey, bool]]):
+        registrations = self._registrations
+        for key, is_folder in changed:
+            buckets = self._folders if is_folder else self._items
+            dispatch = self._dispatch_folders if is_folder else self._dispatch_items
+            if key not in buckets:
+                dispatch.pop(key, None)
+                continue
+            buckets[key].sort(key=lambda owner: registrations[owner].ordinal)
+            dispatch[key] = sorted(
+                buckets[key], key=lambda owner: (registrations[owner].specificity, registrations[owner].ordinal))
+
+    @staticmethod
+    def _has_hotkey(owner, modifiers, key) -> bool:
+        return owner.modifiers == modifiers and owner.hotKey == key
+
+    def dispatch_items(self, modifiers: typing.List[str], key: str) -> typing.List:
+        """Items using the given hotkey, the most specific window filter first."""
+        bucket = self._dispatch_items.get(make_key(modifiers, key), ())
+        return [item for item in bucket if self._has_hotkey(item, modifiers, key)]
+
+    def dispatch_folders(self, modifiers: typing.List[str], key: str) -> typing.List:
+        """Folders using the given hotkey, the most specific window filter first."""
+        bucket = self._dispatch_folders.get(make_key(modifiers, key), ())
+        return [folder for folder in bucket if self._has_hotkey(folder, modifiers, key)]
+
+    def global_hotkeys(self, modifiers: typing.List[str], key: str) -> typing.List:
+        return self._globals.get(make_key(modifiers, key), [])
+
+    def registered(self, modifiers: typing.List[str], key: str) -> typing.Tuple[typing.List, typing.List, typing.List]:
+        """
+        Return the folders, items and global hotkeys registered for the given hotkey, each in configuration order.
+        Callers have to verify the returned objects, see ConfigManager.item_has_same_hotkey().
+        """
+        hotkey = make_key(modifiers, key)
+        return self._folders.get(hotkey, []), self._items.get(hotkey, []), self._globals.get(hotkey, [])
+
+    def contents(self) -> typing.Dict[HotkeyKey, typing.Tuple[typing.List, typing.List, typing.List, typing.List]]:
+        """
+        Return the whole table as {hotkey: (folders, items, dispatch folders, dispatch items)}.
+        Used to compare tables, for example an incrementally updated one with a rebuilt one.
+        """
+        return {
+            key: (self._folders.get(key, []), self._items.get(key, []),
+                  self._dispatch_folders.get(key, []), self._dispatch_items.get(key, []))
+            for key in itertools.chain(self._folders, self._items)
+        }
@@ -0,0 +1,112 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Per-window view of the configured hotkeys and abbreviations.
+
+The effective window filter of an item may be inherited from one of its parent folders. Resolving it on every
+keystroke means walking up the folder chain and running the filter regex for every item. Instead, the effective
+filters are resolved once when the folders and items are added. For each window, every distinct filter regex is
+evaluated once and the result is kept in a small LRU cache. ConfigManager creates a new WindowFilterCache whenever
+the configuration changes, which invalidates all cached results.
+"""
+
+import collections
+import typing
+
+if typing.TYPE_CHECKING:
+    from autokey.interface import WindowInfo
+
+DEFAULT_CACHE_SIZE = 64
+_NOT_INDEXED = object()
+
+
+class WindowItems:
+    """
+    The folders and items that may trigger in a specific window. Supports membership tests only.
+    """
+
+    __slots__ = ("_filters", "_matching")
+
+    def __init__(self, filters: typing.Dict[typing.Any, typing.Optional[typing.Pattern]],
+                 matching: typing.FrozenSet[typing.Optional[typing.Pattern]]):
+        self._filters = filters
+        self._matching = matching
+
+    def __contains__(self, owner) -> bool:
+        return self._filters.get(owner, _NOT_INDEXED) in self._matching
+
+
+class WindowFilterCache:
+
+    def __init__(self, owners: typing.Iterable, maxsize: int=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._cache = collections.OrderedDict()  # type: typing.OrderedDict[WindowInfo, WindowItems]
+        self.hits = 0
+        self.misses = 0
+        # Effective filter of each folder and item, and the number of owners using each regular expression.
+        self._filters = {}  # type: typing.Dict[typing.Any, typing.Optional[typing.Pattern]]
+        self._patterns = collections.Counter()  # type: typing.Counter[typing.Pattern]
+        for owner in owners:
+            self._add(owner)
+
+    def with_changes(self, removed: typing.Iterable=(), added: typing.Iterable=()) -> "WindowFilterCache":
+        """
+        Return a new cache without the removed folders and items and with the added ones, resolving the filters of
+        the added ones. The filters of unchanged folders and items are reused. The new cache starts empty.
+        """
+        cache = WindowFilterCache((), self.maxsize)
+        cache._filters = dict(self._filters)
+        cache._patterns = self._patterns.copy()
+        for owner in removed:
+            regex = cache._filters.pop(owner, None)
+            if regex is not None:
+                cache._patterns[regex] -= 1
+                if not cache._patterns[regex]:
+                    del cache._patterns[regex]
+        for owner in added:
+            cache._add(owner)
+        return cache
+
+    def _add(self, owner):
+        if owner in self._filters:
+            return
+        regex = owner.get_applicable_regex()
+        self._filters[owner] = regex
+        if regex is not None:
+            self._patterns[regex] += 1
+
+    def filters(self) -> typing.Dict[typing.Any, typing.Optional[typing.Pattern]]:
+        """Return the effective filter of every known folder and item."""
+        return dict(self._filters)
+
+    def get(self, window_info: "WindowInfo") -> WindowItems:
+        """Return the hotkeys, hotkey folders and abbreviation owners whose window filter matches the given window."""
+        try:
+            result = self._cache[window_info]
+        except KeyError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._cache.move_to_end(window_info)
+            return result
+
+        matching = {None}
+        for regex in self._patterns:
+            if regex.match(window_info.wm_title) or regex.match(window_info.wm_class):
+                matching.add(regex)
+        result = WindowItems(self._filters, frozenset(matching))
+        self._cache[window_info] = result
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return result
@@ -892,7 +892,7 @@ class ConfigWindow:
 
     def save_completed(self, persistGlobal):
         self.uiManager.get_action("/MenuBar/File/save").set_sensitive(False)
-        self.app.config_altered(persistGlobal)
+        self.app.items_altered(updated=self.__getTreeSelection(), persistGlobal=persistGlobal)
 
     def set_dirty(self, dirty):
         self.dirty = dirty
@@ -1011,7 +1011,8 @@ class ConfigWindow:
             self.hide()
             self.destroy()
             self.app.configWindow = None
-            self.app.config_altered(True)
+            # Only saves the settings, the configuration is up to date.
+            self.app.items_altered(persistGlobal=True)
 
     def on_quit(self, widget, data=None):
         #if not self.queryClose():
@@ -1032,15 +1033,15 @@ class ConfigWindow:
         response = dlg.run()
         if response == Gtk.ResponseType.OK:
             path = dlg.get_filename()
-            self.__createFolder(os.path.basename(path), None, path)
+            folder = self.__createFolder(os.path.basename(path), None, path)
             self.app.monitor.add_watch(path)
             dlg.destroy()
-            self.app.config_altered(True)
+            self.app.items_altered(added=[folder], persistGlobal=True)
         elif response == Gtk.ResponseType.NONE:
             dlg.destroy()
             name = self.__getNewItemName("Folder")
-            self.__createFolder(name, None)
-            self.app.config_altered(True)
+            folder = self.__createFolder(name, None)
+            self.app.items_altered(added=[folder], persistGlobal=True)
         else:
             dlg.destroy()
 
@@ -1057,8 +1058,8 @@ class ConfigWindow:
         if name is not None:
             theModel, selectedPaths = self.treeView.get_selection().get_selected_rows()
             parentIter = self.__getRealParent(theModel[selectedPaths[0]].iter)
-            self.__createFolder(name, parentIter)
-            self.app.config_altered(False)
+            folder = self.__createFolder(name, parentIter)
+            self.app.items_altered(added=[folder])
 
     def __createFolder(self, title, parentIter, path=None):
         self.app.monitor.suspend()
@@ -1073,6 +1074,7 @@ class ConfigWindow:
         self.treeView.get_selection().unselect_all()
         self.treeView.get_selection().select_iter(newIter)
         self.on_tree_selection_changed(self.treeView)
+        return newFolder
 
     def __getNewItemName(self, itemType):
         dlg = RenameDialog(self.ui, "New %s" % itemType, True, _("Create New %s") % itemType)
@@ -1142,7 +1144,7 @@ class ConfigWindow:
             self.treeView.get_selection().select_iter(model.get_iter_first())
             self.on_tree_selection_changed(self.treeView)
 
-        self.app.config_altered(True)
+        self.app.items_altered(removed=self.cutCopiedItems, persistGlobal=True)
 
     def on_copy_item(self, widget, data=None):
         sourceObjects = self.__getTreeSelection()
@@ -1174,11 +1176,12 @@ class ConfigWindow:
         self.treeView.expand_to_path(theModel.get_path(newIters[-1]))
         self.treeView.get_selection().unselect_all()
         self.treeView.get_selection().select_iter(newIters[0])
+        pasted = self.cutCopiedItems
         self.cutCopiedItems = []
         self.on_tree_selection_changed(self.treeView)
         for iterator in newIters:
             self.treeView.get_selection().select_iter(iterator)
-        self.app.config_altered(True)
+        self.app.items_altered(added=pasted, persistGlobal=True)
 
     def on_clone_item(self, widget, data=None):
         source = self.__getTreeSelection()[0]
@@ -1196,7 +1199,7 @@ class ConfigWindow:
 
         self.app.monitor.unsuspend()
         newIter = theModel.append_item(newObj, parentIter)
-        self.app.config_altered(False)
+        self.app.items_altered(added=[newObj])
 
     def on_delete_item(self, widget, data=None):
         selection = self.treeView.get_selection()
@@ -1205,7 +1208,7 @@ class ConfigWindow:
         for path in selectedPaths:
             refs.append(Gtk.TreeRowReference.new(theModel, path))
 
-        modified = False
+        removed = []
 
         if len(refs) == 1:
             item = theModel[refs[0].get_path()].iter
@@ -1226,18 +1229,18 @@ class ConfigWindow:
                     item = theModel[ref.get_path()].iter
                     modelItem = theModel.get_value(item, AkTreeModel.OBJECT_COLUMN)
                     self.__removeItem(theModel, item)
-                    modified = True
+                    removed.append(modelItem)
             self.app.monitor.unsuspend()
 
         dlg.destroy()
 
-        if modified:
+        if removed:
             if len(selectedPaths) > 1:
                 self.treeView.get_selection().unselect_all()
                 self.treeView.get_selection().select_iter(theModel.get_iter_first())
                 self.on_tree_selection_changed(self.treeView)
 
-            self.app.config_altered(True)
+            self.app.items_altered(removed=removed, persistGlobal=True)
 
     def __removeItem(self, model, item):
         #selection = self.treeView.get_selection()
@@ -1363,7 +1366,7 @@ class ConfigWindow:
                 persistGlobal = self.__getCurrentPage().save()
                 self.refresh_tree()
                 self.app.monitor.unsuspend()
-                self.app.config_altered(persistGlobal)
+                self.app.items_altered(updated=[selectedObject], persistGlobal=persistGlobal)
 
         dlg.destroy()
 
@@ -1490,7 +1493,8 @@ class ConfigWindow:
         for iterator in newIters:
             selection.select_iter(iterator)
         self.on_tree_selection_changed(self.treeView)
-        self.app.config_altered(True)
+        # Moved items get the position of their new parent.
+        self.app.items_altered(added=self.__sourceObjects, removed=self.__sourceObjects, persistGlobal=True)
 
     def __dropRecurseUpdate(self, folder):
         folder.path = None
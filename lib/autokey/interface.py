@@ -19,8 +19,12 @@ __all__ = ["XRecordInterface", "AtSpiInterface", "WindowInfo"]
 
 from abc import abstractmethod
 import logging
+import os
 import typing
 import threading
+import collections
+import itertools
+import math
 import select
 import queue
 import subprocess
@@ -31,6 +35,7 @@ import autokey.model.phrase
 if typing.TYPE_CHECKING:
     from autokey.iomediator.iomediator import IoMediator
 import autokey.configmanager.configmanager_constants as cm_constants
+from autokey.iomediator.constants import XTEST_BACKEND
 
 
 # Imported to enable threading in Xlib. See module description. Not an unused import statement.
@@ -66,7 +71,7 @@ else:
     except SyntaxError:  # pyatspi 2.26 fails when used with Python 3.7
         HAS_ATSPI = False
 
-from Xlib import X, XK, display, error
+from Xlib import X, XK, Xatom, display, error
 try:
     from Xlib.ext import record, xtest
     HAS_RECORD = True
@@ -91,6 +96,23 @@ MASK_INDEXES = [
 CAPSLOCK_LEDMASK = 1<<0
 NUMLOCK_LEDMASK = 1<<1
 
+# Seconds after which a key event injected using XTEST is no longer expected to be reported back by the input listener
+INJECTED_EVENT_TIMEOUT = 2.0
+# Seconds after which a keyboard mapping change done by AutoKey is no longer expected to be reported by the X server
+OWN_MAPPING_CHANGE_TIMEOUT = 5.0
+# Keyboard mapping changes are handled once no further change was reported for this many seconds
+MAPPING_CHANGE_DEBOUNCE = 0.2
+# Number of windows whose window information is cached
+WINDOW_INFO_CACHE_SIZE = 64
+# Priorities of queued work, lower values run first. Within a priority, the work runs in the order it was queued.
+PRIORITY_INPUT = 0
+PRIORITY_OUTPUT = 1
+PRIORITY_BACKGROUND = 2
+# Seconds to wait for the current selection owner, when reading the selection content to restore after pasting
+SELECTION_READ_TIMEOUT = 1.0
+# Largest selection content, that fits into a single ChangeProperty request without the BIG-REQUESTS extension
+SELECTION_DATA_LIMIT = 0xffff * 4 - 32
+
 
 def str_or_bytes_to_bytes(x: typing.Union[str, bytes, memoryview]) -> bytes:
     if type(x) == bytes:
@@ -109,6 +131,177 @@ def str_or_bytes_to_bytes(x: typing.Union[str, bytes, memoryview]) -> bytes:
 WindowInfo = typing.NamedTuple("WindowInfo", [("wm_title", str), ("wm_class", str)])
 
 
+class KeyBinding(typing.NamedTuple):
+    """Describes how to type a character: the key code, the offset of the key symbol and the modifier mask to use."""
+    key_code: int
+    offset: int
+    mask: int
+
+
+class HotkeyGrab(typing.NamedTuple):
+    """
+    A passive grab of a hotkey on the root window, including the variants with NumLock and CapsLock active.
+    Synchronous grabs freeze the keyboard until the window filter of the hotkey is checked against the focused window.
+    """
+    key: str
+    modifiers: typing.Tuple[str, ...]
+    key_code: int
+    mask: int
+    sync: bool
+
+
+class _WorkItem:
+
+    __slots__ = ("method", "args", "queued", "key", "cancelled")
+
+    def __init__(self, method, args, key):
+        self.method = method
+        self.args = args
+        self.queued = time.perf_counter_ns()
+        self.key = key
+        self.cancelled = False
+
+
+class WorkQueue:
+    """
+    Runs the queued methods one after the other on a dedicated thread, those with the lowest priority value first.
+    Methods of the same priority run in the order they were queued.
+
+    Work queued with a key replaces work with the same key that did not start yet. This drops repeated requests for
+    the same thing, like updating the hotkey grabs, and is used to cancel work that became obsolete.
+
+    The number of waiting items and the time the items spent waiting in the queue and running are recorded, see
+    statistics().
+
+    If given, on_idle is called on the thread of the queue whenever it ran out of work, before join() returns.
+    """
+
+    def __init__(self, name: str, on_idle: typing.Callable[[], typing.Any]=None):
+        self.name = name
+        self.on_idle = on_idle
+        self.thread = threading.Thread(target=self.__run, name=name, daemon=True)
+        self.__queue = queue.PriorityQueue()
+        self.__sequence = itertools.count()
+        # Work queued with a key that did not start yet, keyed by the key
+        self.__pending = {}  # type: typing.Dict[typing.Hashable, _WorkItem]
+        self.__lock = threading.Lock()
+        self.item_count = 0
+        self.cancelled_count = 0
+        self.max_depth = 0
+        self.last_wait_ns = self.max_wait_ns = self.total_wait_ns = 0
+        self.last_run_ns = self.max_run_ns = self.total_run_ns = 0
+
+    def start(self):
+        self.thread.start()
+
+    def put(self, method: typing.Callable, *args, priority: int=PRIORITY_OUTPUT, key: typing.Hashable=None):
+        item = _WorkItem(method, args, key)
+        if key is not None:
+            with self.__lock:
+                replaced = self.__pending.get(key)
+                if replaced is not None:
+                    replaced.cancelled = True
+                self.__pending[key] = item
+        self.__queue.put_nowait((priority, next(self.__sequence), item))
+        depth = self.__queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def cancel(self, key: typing.Hashable):
+        """Cancel the work queued with the given key, unless it already started."""
+        with self.__lock:
+            item = self.__pending.pop(key, None)
+            if item is not None:
+                item.cancelled = True
+
+    def stop(self):
+        """Let the thread exit, once the items queued before are done."""
+        self.__queue.put_nowait((math.inf, next(self.__sequence), None))
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def join(self):
+        """Wait until all queued items are done."""
+        self.__queue.join()
+
+    @property
+    def depth(self) -> int:
+        return self.__queue.qsize()
+
+    def statistics(self) -> typing.Dict[str, int]:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "items": self.item_count,
+            "cancelled": self.cancelled_count,
+            "last_wait_ns": self.last_wait_ns,
+            "max_wait_ns": self.max_wait_ns,
+            "total_wait_ns": self.total_wait_ns,
+            "last_run_ns": self.last_run_ns,
+            "max_run_ns": self.max_run_ns,
+            "total_run_ns": self.total_run_ns,
+        }
+
+    def reset_statistics(self):
+        self.item_count = self.cancelled_count = self.max_depth = 0
+        self.last_wait_ns = self.max_wait_ns = self.total_wait_ns = 0
+        self.last_run_ns = self.max_run_ns = self.total_run_ns = 0
+
+    def __run(self):
+        while True:
+            priority, sequence, item = self.__queue.get()
+
+            if item is None:
+                self.__queue.task_done()
+                break
+            if item.key is not None:
+                with self.__lock:
+                    if self.__pending.get(item.key) is item:
+                        del self.__pending[item.key]
+            if item.cancelled:
+                self.cancelled_count += 1
+            else:
+                started = time.perf_counter_ns()
+                try:
+                    item.method(*item.args)
+                except Exception:
+                    logger.exception("Error in X %s thread", self.name)
+                finished = time.perf_counter_ns()
+                self.__account(started - item.queued, finished - started)
+            if self.on_idle is not None and self.__queue.empty():
+                try:
+                    self.on_idle()
+                except Exception:
+                    logger.exception("Error in X %s thread", self.name)
+            self.__queue.task_done()
+
+    def __account(self, waited: int, ran: int):
+        self.item_count += 1
+        self.last_wait_ns = waited
+        self.total_wait_ns += waited
+        if waited > self.max_wait_ns:
+            self.max_wait_ns = waited
+        self.last_run_ns = ran
+        self.total_run_ns += ran
+        if ran > self.max_run_ns:
+            self.max_run_ns = ran
+
+
+# Key symbols in this range are the Unicode code point plus this offset
+UNICODE_KEYSYM_OFFSET = 0x01000000
+
+
+def char_to_keysym(char: str) -> int:
+    """
+    Returns the key symbol of the given character. Printable Latin-1 characters have their own key symbols, all other
+    characters use the Unicode key symbols.
+    """
+    code_point = ord(char)
+    if 0x20 <= code_point <= 0x7e or 0xa0 <= code_point <= 0xff:
+        return code_point
+    return UNICODE_KEYSYM_OFFSET + code_point
+
+
 class AbstractClipboard:
     """
     Abstract interface for clipboard interactions.
@@ -190,6 +383,211 @@ else:
                 Gdk.threads_leave()
 
 
+class SelectionOwner:
+    """
+    Owns an X selection, CLIPBOARD or PRIMARY, and hands its text to the applications requesting it.
+
+    Used to paste phrases. As the owner sees the SelectionRequest of the receiving application, the previous content
+    can be restored as soon as the pasted text was fetched, instead of after a fixed delay. The selection is served on
+    a connection and thread of its own, so the output queue is not blocked while applications request the data.
+    The previous content is handed back to the toolkit clipboard, see restore(), and the ownership given up. So the
+    owner only holds the selection while a paste is in progress.
+
+    Texts larger than a single ChangeProperty request are refused, the INCR protocol for large transfers is not
+    supported. The restore then happens after the fallback timeout.
+    """
+
+    def __init__(self, selection: str):
+        self.name = selection
+        self.display = display.Display()
+        self.window = self.display.screen().root.create_window(0, 0, 1, 1, 0, X.CopyFromParent)
+        self.selection = self.display.intern_atom(selection)
+        self.__targetsAtom = self.display.intern_atom("TARGETS")
+        self.__textAtoms = (self.display.intern_atom("UTF8_STRING"), self.display.intern_atom("TEXT"))
+        self.__incrAtom = self.display.intern_atom("INCR")
+        # Property of the own window, that receives the content read from other owners
+        self.__readAtom = self.display.intern_atom("AUTOKEY_SELECTION")
+        self.__lock = threading.Lock()
+        self.__content = None  # type: typing.Optional[str]
+        self.__requested = threading.Event()
+        self.__converted = threading.Event()
+        self.__convertedText = None  # type: typing.Optional[str]
+        # Serializes paste() and restore(). The generation counts the pastes, so a restore can tell, whether a newer
+        # paste happened in the meantime.
+        self.__pasteLock = threading.Lock()
+        self.__generation = 0
+        self.__restorePending = False
+        self.__backup = None  # type: typing.Optional[str]
+        self.__shutdown = False
+        self.__wakeupReader, self.__wakeupWriter = os.pipe()
+        self.display.flush()
+        self.thread = threading.Thread(target=self.__run, name="selection-" + selection, daemon=True)
+        self.thread.start()
+
+    @property
+    def owned(self) -> bool:
+        return self.__content is not None
+
+    def read(self, timeout: float=SELECTION_READ_TIMEOUT) -> typing.Optional[str]:
+        """
+        Return the text of the selection. Returns None if the selection is empty, the owner does not offer text or
+        does not answer within the timeout.
+        """
+        content = self.__content
+        if content is not None:
+            return content
+        self.__converted.clear()
+        self.__convertedText = None
+        self.window.convert_selection(self.selection, self.__textAtoms[0], self.__readAtom, X.CurrentTime)
+        self.display.flush()
+        if not self.__converted.wait(timeout):
+            logger.warning("The owner of the %s selection did not answer within %s seconds.", self.name, timeout)
+            return None
+        return self.__convertedText
+
+    def own(self, text: str) -> bool:
+        """Offer the given text as the selection content. Returns False if the X server did not grant the ownership."""
+        with self.__lock:
+            self.__content = text
+            self.__requested.clear()
+        self.window.set_selection_owner(self.selection, X.CurrentTime)
+        # The reply also ensures that the ownership is set before the caller goes on, e.g. sends the paste keys.
+        owner = self.display.get_selection_owner(self.selection)
+        if getattr(owner, "id", X.NONE) != self.window.id:
+            logger.warning("Could not acquire the %s selection.", self.name)
+            with self.__lock:
+                self.__content = None
+            return False
+        return True
+
+    def wait_requested(self, timeout: float) -> bool:
+        """Wait until an application fetched the content set by the last own(). Returns False on timeout."""
+        return self.__requested.wait(timeout)
+
+    def paste(self, text: str) -> int:
+        """
+        Offer the text for pasting. The current content is kept as the backup to restore, unless a restore of an
+        earlier paste is still pending. Then that earlier backup is kept. Returns the generation to pass to restore().
+        """
+        with self.__pasteLock:
+            if not self.__restorePending:
+                self.__backup = self.read()
+                if self.__backup is None:
+                    logger.debug("The %s selection has no text content to restore after pasting.", self.name)
+                self.__restorePending = True
+            self.__generation += 1
+            self.own(text)
+            return self.__generation
+
+    def restore(self, generation: int, timeout: float, hand_back: typing.Callable[[str], None]) -> bool:
+        """
+        Wait until the pasted text was requested or the timeout passed, then restore the backup. The backup is passed
+        to hand_back, which sets it as the content of the toolkit clipboard, then the selection is released. Nothing is
+        restored, if another paste happened in the meantime, as that paste restores the backup later.
+        Returns True if restored.
+        """
+        if not self.wait_requested(timeout):
+            logger.debug("The pasted text was not requested within %s seconds, restoring the %s selection anyway.",
+                         timeout, self.name)
+        with self.__pasteLock:
+            if generation != self.__generation:
+                return False
+            backup, self.__backup = self.__backup, None
+            self.__restorePending = False
+            try:
+                if backup is not None:
+                    hand_back(backup)
+            finally:
+                self.release()
+            return True
+
+    def release(self):
+        """
+        Give up the selection, unless another application took it over already, e.g. the toolkit clipboard the
+        backup was handed back to. The selection is empty afterwards, until another application sets it.
+        """
+        with self.__lock:
+            self.__content = None
+        owner = self.display.get_selection_owner(self.selection)
+        if getattr(owner, "id", X.NONE) == self.window.id:
+            # SetSelectionOwner with None as the window clears the selection.
+            self.display.create_resource_object("window", X.NONE).set_selection_owner(self.selection, X.CurrentTime)
+            self.display.flush()
+
+    def close(self):
+        self.__shutdown = True
+        os.write(self.__wakeupWriter, b"\0")
+        self.thread.join()
+        os.close(self.__wakeupReader)
+        os.close(self.__wakeupWriter)
+        self.display.close()
+
+    def __run(self):
+        while not self.__shutdown:
+            try:
+                if not self.display.pending_events():
+                    readable, w, e = select.select([self.display, self.__wakeupReader], [], [])
+                    if self.__wakeupReader in readable:
+                        os.read(self.__wakeupReader, 64)
+                for x in range(self.display.pending_events()):
+                    self.__handleEvent(self.display.next_event())
+            except ConnectionClosedError:
+                break
+            except Exception:
+                logger.exception("Error while serving the %s selection", self.name)
+
+    def __handleEvent(self, xEvent):
+        if xEvent.type == X.SelectionRequest:
+            self.__serve(xEvent)
+        elif xEvent.type == X.SelectionClear:
+            # Another application took over the selection.
+            with self.__lock:
+                self.__content = None
+        elif xEvent.type == X.SelectionNotify:
+            self.__receive(xEvent)
+
+    def __serve(self, request):
+        # Obsolete clients do not name a property, then the target is used as the property.
+        target, prop = request.target, request.property or request.target
+        content = self.__content
+        served = False
+        if content is None:
+            prop = X.NONE
+        elif target == self.__targetsAtom:
+            targets = [self.__targetsAtom, *self.__textAtoms, Xatom.STRING]
+            request.requestor.change_property(prop, Xatom.ATOM, 32, targets)
+        elif target in self.__textAtoms or target == Xatom.STRING:
+            if target == Xatom.STRING:
+                data, dataType = content.encode("latin-1", "replace"), Xatom.STRING
+            else:
+                data, dataType = content.encode("utf-8"), self.__textAtoms[0]
+            if len(data) > SELECTION_DATA_LIMIT:
+                logger.warning("The %s selection content is too large to be transferred.", self.name)
+                prop = X.NONE
+            else:
+                request.requestor.change_property(prop, dataType, 8, data)
+                served = True
+        else:
+            prop = X.NONE
+        notify = event.SelectionNotify(
+            time=request.time, requestor=request.requestor, selection=request.selection, target=target, property=prop)
+        request.requestor.send_event(notify)
+        self.display.flush()
+        if served and content is self.__content:
+            self.__requested.set()
+
+    def __receive(self, notify):
+        text = None
+        if notify.property != X.NONE:
+            value = self.window.get_full_property(self.__readAtom, X.AnyPropertyType)
+            self.window.delete_property(self.__readAtom)
+            self.display.flush()
+            if value is not None and value.property_type != self.__incrAtom and value.format == 8:
+                text = str_or_bytes_to_bytes(value.value).decode("utf-8", "replace")
+        self.__convertedText = text
+        self.__converted.set()
+
+
 class XInterfaceBase(threading.Thread):
     """
     Encapsulates the common functionality for the two X interface classes.
@@ -203,17 +601,56 @@ class XInterfaceBase(threading.Thread):
         self.app = app
         self.lastChars = [] # QT4 Workaround
         self.__enableQT4Workaround = False # QT4 Workaround
+        # (event type, key code, deadline) of key events injected using XTEST, that the listener has not reported yet
+        self.__injectedEvents = collections.deque()
+        # (first key code, count, deadline) of keyboard mapping changes done by AutoKey, not yet reported by the X server
+        self.__ownMappingChanges = collections.deque()
+        # Characters bound to spare key codes, ordered from the least to the most recently used one
+        self.remappedChars = collections.OrderedDict()  # type: typing.MutableMapping[str, typing.Tuple[int, int]]
+        # Number of folders and items using a hotkey, keyed by (key, modifiers, has window filter)
+        self.__hotkeyUsers = collections.Counter()  # type: typing.Counter[typing.Tuple[str, tuple, bool]]
+        # Hotkeys currently grabbed on the root window, keyed by (key, modifiers)
+        self.__hotkeyGrabs = {}  # type: typing.Dict[typing.Tuple[str, typing.Tuple[str, ...]], HotkeyGrab]
+        # Synchronous grabs, keyed by (key code, modifier mask). Replaced as a whole, as the listener thread reads it.
+        self.__syncGrabs = {}  # type: typing.Dict[typing.Tuple[int, int], HotkeyGrab]
+        self.__mutterWorkaround = None  # type: typing.Optional[bool]
+        # Hotkeys whose grab has to be updated, because the folders and items using them changed
+        self.__staleHotkeys = set()  # type: typing.Set[typing.Tuple[str, typing.Tuple[str, ...]]]
+        # Windows created since the hotkeys were last grabbed in new windows, keyed by window id
+        self.__createdWindows = {}  # type: typing.Dict[int, typing.Any]
+        self.__createdWindowsLock = threading.Lock()
+        # Window information of recently focused windows and the ids of the windows it was read from, keyed by window
+        # id. Entries are dropped, when the title or class of one of those windows changes, see get_window_info().
+        self.__windowInfoCache = collections.OrderedDict()  # type: typing.MutableMapping[int, tuple]
+        # Ids of the windows selected for property and structure events
+        self.__watchedWindows = set()  # type: typing.Set[int]
+        # The focused window, as long as the active window did not change
+        self.__focusWindow = None
+        # Incremented on every invalidation, so lookups running concurrently do not store outdated information
+        self.__windowInfoGeneration = 0
+        self.__windowInfoLock = threading.Lock()
         self.shutdown = False
         
-        # Event loop
-        self.eventThread = threading.Thread(target=self.__eventLoop)
-        self.queue = queue.Queue()
-        
-        # Event listener
+        # Key presses, hotkey grabs and keyboard mapping changes are handled by the input queue on the connection the
+        # listener uses. Keys, mouse events and clipboard contents are sent by the output queue on its own connection.
+        # So a long phrase or a clipboard paste does not delay recognizing the next keys typed by the user. Requests of
+        # different connections are not ordered, so everything that has to happen in order stays on one side.
+        self.inputQueue = WorkQueue("input")
+        # Requests not flushed by the sending method, like the single key events of the scripting API, are sent
+        # once there is nothing more to send.
+        self.outputQueue = WorkQueue("output", on_idle=self.__flushOutput)
+        self.outputDisplay = None
+        # Restores the clipboard contents after pasting, see SelectionOwner
+        self.clipboardQueue = WorkQueue("clipboard")
+        self.clipboard = None  # type: typing.Optional[AbstractClipboard]
+        self.__selectionOwners = {}  # type: typing.Dict[str, SelectionOwner]
+
+        # Event listener. It is woken up by writing to the pipe, e.g. to shut down.
         self.listenerThread = threading.Thread(target=self.__flushEvents)
-        self.clipboard = Clipboard()
+        self.__wakeupReader, self.__wakeupWriter = os.pipe()
 
         self.__initMappings()
+        self.__initOutputMappings()
 
         # Set initial lock state
         ledMask = self.localDisplay.get_keyboard_control().led_mask
@@ -223,6 +660,9 @@ class XInterfaceBase(threading.Thread):
         # Window name atoms
         self.__NameAtom = self.localDisplay.intern_atom("_NET_WM_NAME", True)
         self.__VisibleNameAtom = self.localDisplay.intern_atom("_NET_WM_VISIBLE_NAME", True)
+        self.__ActiveWindowAtom = self.localDisplay.intern_atom("_NET_ACTIVE_WINDOW", True)
+        # Changes of these properties invalidate the cached window information
+        self.__windowInfoAtoms = {atom for atom in (self.__NameAtom, self.__VisibleNameAtom, Xatom.WM_CLASS) if atom}
         
         #move detection of key map changes to X event thread in order to have QT and GTK detection
         # if not common.USING_QT:
@@ -231,53 +671,49 @@ class XInterfaceBase(threading.Thread):
         
         self.__ignoreRemap = False
         
-        self.eventThread.start()
+        self.inputQueue.start()
+        self.outputQueue.start()
+        self.clipboardQueue.start()
         self.listenerThread.start()
-        
-    def __eventLoop(self):
-        while True:
-            method, args = self.queue.get()
-            
-            if method is None and args is None:
-                break
-            elif method is not None and args is None:
-                logger.debug("__eventLoop: Got method {} with None arguments!".format(method))
-            try:
-                method(*args)
-            except Exception as e:
-                logger.exception("Error in X event loop thread")
 
-            self.queue.task_done()
+    def queue_statistics(self) -> typing.Dict[str, typing.Dict[str, int]]:
+        """Return the queue depth and the waiting and running times of the input, output and clipboard queues."""
+        return {workQueue.name: workQueue.statistics()
+                for workQueue in (self.inputQueue, self.outputQueue, self.clipboardQueue)}
 
-    def __enqueue(self, method: typing.Callable, *args):
-        self.queue.put_nowait((method, args))
+    def wait_for_queues(self):
+        """Wait until the items queued on the input, output and clipboard queues are done."""
+        self.inputQueue.join()
+        self.outputQueue.join()
+        self.clipboardQueue.join()
 
     def on_keys_changed(self, data=None):
         if not self.__ignoreRemap:
             logger.debug("Recorded keymap change event")
             self.__ignoreRemap = True
-            time.sleep(0.2)
-            self.__enqueue(self.__ungrabAllHotkeys)
-            self.__enqueue(self.__delayedInitMappings)
+            self.inputQueue.put(self.__ungrabAllHotkeys, priority=PRIORITY_BACKGROUND)
+            self.inputQueue.put(self.__delayedInitMappings, priority=PRIORITY_BACKGROUND)
         else:
             logger.debug("Ignored keymap change event")
 
-    def __delayedInitMappings(self):        
+    def __delayedInitMappings(self):
         self.__initMappings()
+        # The key table is used while sending, so it is rebuilt in order with the queued output.
+        self.outputQueue.put(self.__initOutputMappings)
         self.__ignoreRemap = False
+        # The listener still waits for events of the replaced display connection.
+        self.__wakeListener()
+
+    def __wakeListener(self):
+        os.write(self.__wakeupWriter, b"\0")
 
     def __initMappings(self):
         self.localDisplay = display.Display()
         self.rootWindow = self.localDisplay.screen().root
-        self.rootWindow.change_attributes(event_mask=X.SubstructureNotifyMask|X.StructureNotifyMask)
-        
-        altList = self.localDisplay.keysym_to_keycodes(XK.XK_ISO_Level3_Shift)
-        self.__usableOffsets = (0, 1)
-        for code, offset in altList:
-            if code == 108 and offset == 0:
-                self.__usableOffsets += (4, 5)
-                logger.debug("Enabling sending using Alt-Grid")
-                break
+        self.rootWindow.change_attributes(
+            event_mask=X.SubstructureNotifyMask|X.StructureNotifyMask|X.PropertyChangeMask)
+        # Cached windows belong to the previous connection, which also selected the window events.
+        self.__invalidateWindowInfo(None)
 
         # Build modifier mask mapping
         self.modMasks = {}
@@ -302,16 +738,43 @@ class XInterfaceBase(threading.Thread):
         self.__grabHotkeys()
         self.localDisplay.flush()
 
+    def __initOutputMappings(self):
+        """
+        Opens the connection used to send keys and builds the key table. Runs on the output thread after keymap
+        changes, so it never changes the key table while a string is sent.
+        """
+        if self.outputDisplay is not None:
+            self.outputDisplay.close()
+        self.outputDisplay = display.Display()
+        self.outputRoot = self.outputDisplay.screen().root
+
+        altList = self.outputDisplay.keysym_to_keycodes(XK.XK_ISO_Level3_Shift)
+        self.__usableOffsets = (0, 1)
+        for code, offset in altList:
+            if code == 108 and offset == 0:
+                self.__usableOffsets += (4, 5)
+                logger.debug("Enabling sending using Alt-Grid")
+                break
+
         # --- get list of keycodes that are unused in the current keyboard mapping
 
         keyCode = 8
         avail = []
-        for keyCodeMapping in self.localDisplay.get_keyboard_mapping(keyCode, 200):
-            codeAvail = True
-            for offset in keyCodeMapping:
-                if offset != 0:
-                    codeAvail = False
-                    break
+        keyboardMapping = self.outputDisplay.get_keyboard_mapping(keyCode, 200)
+        # Keep the characters bound to spare key codes before, as long as their key codes still hold them
+        remappedChars = collections.OrderedDict(
+            (char, binding) for char, binding in self.remappedChars.items()
+            if tuple(keyboardMapping[binding[0] - keyCode][:2]) == (char_to_keysym(char),) * 2
+        )
+        remappedCodes = {code for code, offset in remappedChars.values()}
+        for keyCodeMapping in keyboardMapping:
+            codeAvail = keyCode in remappedCodes
+            if not codeAvail:
+                codeAvail = True
+                for offset in keyCodeMapping:
+                    if offset != 0:
+                        codeAvail = False
+                        break
 
             if codeAvail:
                 avail.append(keyCode)
@@ -319,13 +782,47 @@ class XInterfaceBase(threading.Thread):
             keyCode += 1
 
         self.__availableKeycodes = avail
-        self.remappedChars = {}
+        self.__freeKeycodes = [code for code in avail if code not in remappedCodes]
+        self.remappedChars = remappedChars
+        self.__buildKeyTable(8, keyboardMapping, frozenset(avail))
 
         if logger.getEffectiveLevel() == logging.DEBUG:
             self.keymap_test()
 
+    def __buildKeyTable(self, firstCode, keyboardMapping, spareCodes=frozenset()):
+        """
+        Builds the table used to look up the key code and modifiers for each character that can be typed using the
+        given keyboard mapping. If a character is bound to several keys, the lowest usable offset is used, and among
+        those the lowest key code, like Display.keysym_to_keycodes() orders them. The spare key codes used to bind
+        other characters on demand are left out, see __remapChars().
+        The table is rebuilt together with the other mappings when the keyboard mapping changes.
+        """
+        shiftMask = self.modMasks.get(Key.SHIFT, 0)
+        altGrMask = self.modMasks.get(Key.ALT_GR, 0)
+        masks = {0: 0, 1: shiftMask, 4: altGrMask, 5: altGrMask | shiftMask}
+        keyTable = {}  # type: typing.Dict[str, KeyBinding]
+        unicodeInputChars = set()
+        for offset in self.__usableOffsets:
+            for keyCode, keySyms in enumerate(keyboardMapping, firstCode):
+                if offset >= len(keySyms) or keyCode in spareCodes:
+                    continue
+                keySym = keySyms[offset]
+                if 0 < keySym < 0x100:
+                    char = chr(keySym)
+                    if offset == 0 and char not in keyTable and self.outputDisplay.lookup_string(keySym) is None:
+                        # No reasonable translation of the key to a string, typed as a Unicode code point instead
+                        unicodeInputChars.add(char)
+                elif keySym > UNICODE_KEYSYM_OFFSET:
+                    char = chr(keySym - UNICODE_KEYSYM_OFFSET)
+                else:
+                    continue
+                if char not in keyTable:
+                    keyTable[char] = KeyBinding(keyCode, offset, masks[offset])
+        self.__keyTable = keyTable
+        self.__unicodeInputChars = frozenset(unicodeInputChars)
+
     def keymap_test(self):
-        code = self.localDisplay.keycode_to_keysym(108, 0)
+        code = self.outputDisplay.keycode_to_keysym(108, 0)
         for attr in XK.__dict__.items():
             if attr[0].startswith("XK"):
                 if attr[1] == code:
@@ -333,247 +830,239 @@ class XInterfaceBase(threading.Thread):
 
         logger.debug("X Server Keymap, listing unmapped keys.")
         for char in "\\|`1234567890-=~!@#$%^&*()qwertyuiop[]asdfghjkl;'zxcvbnm,./QWERTYUIOP{}ASDFGHJKL:\"ZXCVBNM<>?":
-            keyCodeList = list(self.localDisplay.keysym_to_keycodes(ord(char)))
+            keyCodeList = list(self.outputDisplay.keysym_to_keycodes(ord(char)))
             if not keyCodeList:
                 logger.debug("No mapping for [%s]", char)
                 
-    def __needsMutterWorkaround(self, item):
-        if Key.SUPER not in item.modifiers:
+    def __needsMutterWorkaround(self, modifiers) -> bool:
+        """
+        Some window managers grab Super hotkeys on the root window themselves. Hotkeys using Super are grabbed in the
+        top level windows as well, so they still reach AutoKey. The running processes are only checked once.
+        """
+        if Key.SUPER not in modifiers:
             return False
-    
-        try:
-            output = subprocess.check_output(["ps", "-eo", "command"]).decode()
-        except subprocess.CalledProcessError:
-            pass # since this is just a nasty workaround, if anything goes wrong just disable it 
-        else:
-            lines = output.splitlines()
-            
-            for line in lines:
-                if "gnome-shell" in line or "cinnamon" in line or "unity" in line:
-                    return True
-                
-        return False
+
+        if self.__mutterWorkaround is None:
+            self.__mutterWorkaround = False
+            try:
+                output = subprocess.check_output(["ps", "-eo", "command"]).decode()
+            except (OSError, subprocess.CalledProcessError):
+                pass # since this is just a nasty workaround, if anything goes wrong just disable it
+            else:
+                lines = output.splitlines()
+
+                for line in lines:
+                    if "gnome-shell" in line or "cinnamon" in line or "unity" in line:
+                        self.__mutterWorkaround = True
+                        break
+
+        return self.__mutterWorkaround
+
+    @staticmethod
+    def __hotkeyUser(item) -> typing.Tuple[str, typing.Tuple[str, ...], bool]:
+        return item.hotKey, tuple(sorted(item.modifiers)), item.get_applicable_regex() is not None
 
     def __grabHotkeys(self):
         """
-        Run during startup to grab global and specific hotkeys in all open windows
+        Run during startup and after keymap changes to grab the global hotkeys and the hotkeys of all folders and items
         """
         c = self.app.configManager
-        hotkeys = c.hotKeys + c.hotKeyFolders
-
-        # Grab global hotkeys in root window
+        users = collections.Counter()
         for item in c.globalHotkeys:
             if item.enabled:
-                self.__enqueue(self.__grabHotkey, item.hotKey, item.modifiers, self.rootWindow)
-                if self.__needsMutterWorkaround(item):
-                    self.__enqueue(self.__grabRecurse, item, self.rootWindow, False)
+                users[self.__hotkeyUser(item)] += 1
+        for item in c.hotKeys + c.hotKeyFolders:
+            users[self.__hotkeyUser(item)] += 1
 
-        # Grab hotkeys without a filter in root window
-        for item in hotkeys:
-            if item.get_applicable_regex() is None:
-                self.__enqueue(self.__grabHotkey, item.hotKey, item.modifiers, self.rootWindow)
-                if self.__needsMutterWorkaround(item):
-                    self.__enqueue(self.__grabRecurse, item, self.rootWindow, False)
+        self.inputQueue.put(self.__setHotkeyUsers, users, priority=PRIORITY_BACKGROUND)
 
-        self.__enqueue(self.__recurseTree, self.rootWindow, hotkeys)
+    def __setHotkeyUsers(self, users):
+        self.__hotkeyUsers = users
+        self.__staleHotkeys.update(self.__hotkeyGrabs)
+        self.__staleHotkeys.update((key, modifiers) for key, modifiers, filtered in users)
+        self.__updateStaleHotkeyGrabs()
 
-    def __recurseTree(self, parent, hotkeys):
-        # Grab matching hotkeys in all open child windows
-        try:
-            children = parent.query_tree().children
-        except:
-            return # window has been destroyed
-            
-        for window in children:
-            try:
-                window_info = self.get_window_info(window, False)
-                
-                if window_info.wm_title or window_info.wm_class:
-                    for item in hotkeys:
-                        if item.get_applicable_regex() is not None and item._should_trigger_window_title(window_info):
-                            self.__grabHotkey(item.hotKey, item.modifiers, window)
-                            self.__grabRecurse(item, window, False)
-                        
-                self.__enqueue(self.__recurseTree, window, hotkeys)
-            except:
-                logger.exception("grab on window failed")
-                
     def __ungrabAllHotkeys(self):
         """
         Ungrab all hotkeys in preparation for keymap change
         """
-        c = self.app.configManager
-        hotkeys = c.hotKeys + c.hotKeyFolders
+        topLevelWindows = self.__topLevelWindows(grab.modifiers for grab in self.__hotkeyGrabs.values())
+        for grab in self.__hotkeyGrabs.values():
+            self.__ungrabHotkey(grab, topLevelWindows)
+        self.__hotkeyGrabs.clear()
+        self.__syncGrabs = {}
+
+    def __changeHotkeyUser(self, user, count):
+        key, modifiers, filtered = user
+        if key is None:
+            return
+        self.__hotkeyUsers[user] += count
+        if self.__hotkeyUsers[user] <= 0:
+            del self.__hotkeyUsers[user]
+        self.__staleHotkeys.add((key, modifiers))
+
+    def __updateStaleHotkeyGrabs(self):
+        if self.__staleHotkeys:
+            hotkeys, self.__staleHotkeys = self.__staleHotkeys, set()
+            self.__updateHotkeyGrabs(hotkeys)
+            self.localDisplay.flush()
 
-        # Ungrab global hotkeys in root window, recursively
-        for item in c.globalHotkeys:
-            if item.enabled:
-                self.__ungrabHotkey(item.hotKey, item.modifiers, self.rootWindow)
-                if self.__needsMutterWorkaround(item):
-                    self.__ungrabRecurse(item, self.rootWindow, False)
-        
-        # Ungrab hotkeys without a filter in root window, recursively
-        for item in hotkeys:
-            if item.get_applicable_regex() is None:
-                self.__ungrabHotkey(item.hotKey, item.modifiers, self.rootWindow)
-                if self.__needsMutterWorkaround(item):
-                    self.__ungrabRecurse(item, self.rootWindow, False)
-                
-        self.__recurseTreeUngrab(self.rootWindow, hotkeys)
-                
-    def __recurseTreeUngrab(self, parent, hotkeys):
-        # Ungrab matching hotkeys in all open child windows
+    def __updateHotkeyGrabs(self, hotkeys):
+        """
+        Bring the grabs of the given (key, modifiers) hotkeys in line with the folders and items using them. A hotkey
+        used by anything without a window filter is grabbed asynchronously, a hotkey only used with window filters
+        synchronously. Grabs of other hotkeys are left untouched.
+        """
+        changed = []  # type: typing.List[typing.Tuple[typing.Optional[HotkeyGrab], typing.Optional[tuple]]]
+        for hotkey in hotkeys:
+            if self.__hotkeyUsers[hotkey + (False,)]:
+                sync = False
+            elif self.__hotkeyUsers[hotkey + (True,)]:
+                sync = True
+            else:
+                sync = None
+
+            current = self.__hotkeyGrabs.get(hotkey)
+            if (None if current is None else current.sync) != sync:
+                changed.append((current, None if sync is None else hotkey + (sync,)))
+        if not changed:
+            return
+
+        topLevelWindows = self.__topLevelWindows((current or wanted)[1] for current, wanted in changed)
+        for current, wanted in changed:
+            if current is not None:
+                self.__ungrabHotkey(current, topLevelWindows)
+                del self.__hotkeyGrabs[current.key, current.modifiers]
+            if wanted is not None:
+                grab = self.__grabHotkey(*wanted, topLevelWindows)
+                if grab is not None:
+                    self.__hotkeyGrabs[grab.key, grab.modifiers] = grab
+        self.__syncGrabs = {(grab.key_code, grab.mask): grab for grab in self.__hotkeyGrabs.values() if grab.sync}
+
+    def __topLevelWindows(self, modifierLists) -> list:
+        """Return the top level windows, if the mutter workaround applies to any of the given modifier lists."""
+        if not any(self.__needsMutterWorkaround(modifiers) for modifiers in modifierLists):
+            return []
         try:
-            children = parent.query_tree().children
-        except:
-            return # window has been destroyed
-            
-        for window in children:
-            try:
-                window_info = self.get_window_info(window, False)
-                
-                if window_info.wm_title or window_info.wm_class:
-                    for item in hotkeys:
-                        if item.get_applicable_regex() is not None and item._should_trigger_window_title(window_info):
-                            self.__ungrabHotkey(item.hotKey, item.modifiers, window)
-                            self.__ungrabRecurse(item, window, False)
-                        
-                self.__enqueue(self.__recurseTreeUngrab, window, hotkeys)
-            except:
-                logger.exception("ungrab on window failed")
+            return self.rootWindow.query_tree().children
+        except error.XError:
+            logger.exception("Failed to list the top level windows")
+            return []
 
-    def __grabHotkeysForWindow(self, window):
+    def __grabHotkeysForWindows(self):
         """
-        Grab all hotkeys relevant to the window
+        Grab the hotkeys affected by the mutter workaround in the top level windows created since the last call.
+        Windows destroyed in the meantime are skipped.
 
-        Used when a new window is created
+        Used when new windows are created
         """
-        c = self.app.configManager
-        hotkeys = c.hotKeys + c.hotKeyFolders
-        window_info = self.get_window_info(window)
-        for item in hotkeys:
-            if item.get_applicable_regex() is not None and item._should_trigger_window_title(window_info):
-                self.__enqueue(self.__grabHotkey, item.hotKey, item.modifiers, window)
-            elif self.__needsMutterWorkaround(item):
-                self.__enqueue(self.__grabHotkey, item.hotKey, item.modifiers, window)
-
-    def __grabHotkey(self, key, modifiers, window):
+        with self.__createdWindowsLock:
+            windows, self.__createdWindows = list(self.__createdWindows.values()), {}
+        grabs = [grab for grab in self.__hotkeyGrabs.values() if self.__needsMutterWorkaround(grab.modifiers)]
+        for window in windows:
+            for grab in grabs:
+                try:
+                    self.__grabKey(window, grab)
+                except error.BadWindow:
+                    break  # The window was destroyed in the meantime
+
+    def __lockMasks(self):
+        """Return the modifier mask variants with NumLock and CapsLock active, which have to be grabbed as well."""
+        masks = [0]
+        if Key.NUMLOCK in self.modMasks:
+            masks.append(self.modMasks[Key.NUMLOCK])
+        if Key.CAPSLOCK in self.modMasks:
+            masks.append(self.modMasks[Key.CAPSLOCK])
+        if Key.CAPSLOCK in self.modMasks and Key.NUMLOCK in self.modMasks:
+            masks.append(self.modMasks[Key.CAPSLOCK]|self.modMasks[Key.NUMLOCK])
+        return masks
+
+    def __grabKey(self, window, grab):
+        keyboardMode = X.GrabModeSync if grab.sync else X.GrabModeAsync
+        for lockMask in self.__lockMasks():
+            window.grab_key(grab.key_code, grab.mask|lockMask, True, X.GrabModeAsync, keyboardMode)
+
+    def __grabHotkey(self, key, modifiers, sync, topLevelWindows=()) -> typing.Optional[HotkeyGrab]:
         """
-        Grab a specific hotkey in the given window
+        Grab a specific hotkey in the root window
         """
-        logger.debug("Grabbing hotkey: %r %r", modifiers, key)
+        logger.debug("Grabbing hotkey: %r %r, synchronous: %s", modifiers, key, sync)
         try:
-            keycode = self.__lookupKeyCode(key)
             mask = 0
             for mod in modifiers:
                 mask |= self.modMasks[mod]
-
-            window.grab_key(keycode, mask, True, X.GrabModeAsync, X.GrabModeAsync)
-
-            if Key.NUMLOCK in self.modMasks:
-                window.grab_key(keycode, mask|self.modMasks[Key.NUMLOCK], True, X.GrabModeAsync, X.GrabModeAsync)
-
-            if Key.CAPSLOCK in self.modMasks:
-                window.grab_key(keycode, mask|self.modMasks[Key.CAPSLOCK], True, X.GrabModeAsync, X.GrabModeAsync)
-
-            if Key.CAPSLOCK in self.modMasks and Key.NUMLOCK in self.modMasks:
-                window.grab_key(keycode, mask|self.modMasks[Key.CAPSLOCK]|self.modMasks[Key.NUMLOCK], True, X.GrabModeAsync, X.GrabModeAsync)
-
+            grab = HotkeyGrab(key, modifiers, self.__lookupKeyCode(key, self.localDisplay), mask, sync)
+
+            self.__grabKey(self.rootWindow, grab)
+            if self.__needsMutterWorkaround(modifiers):
+                for window in topLevelWindows:
+                    try:
+                        self.__grabKey(window, grab)
+                    except error.BadWindow:
+                        pass  # The window was destroyed in the meantime
+            return grab
         except Exception as e:
             logger.warning("Failed to grab hotkey %r %r: %s", modifiers, key, str(e))
+            return None
 
     def grab_hotkey(self, item):
         """
         Grab a hotkey.
 
-        If the hotkey has no filter regex, it is global and is grabbed recursively from the root window
-        If it has a filter regex, iterate over all children of the root and grab from matching windows
+        Hotkeys are grabbed once in the root window. If the hotkey is only used with window filters, the grab is
+        synchronous and the window filter is checked when the hotkey is pressed, see __handleGrabbedKeyPress().
         """
-        if item.get_applicable_regex() is None:
-            self.__enqueue(self.__grabHotkey, item.hotKey, item.modifiers, self.rootWindow)
-            if self.__needsMutterWorkaround(item):
-                self.__enqueue(self.__grabRecurse, item, self.rootWindow, False)
-        else:
-            self.__enqueue(self.__grabRecurse, item, self.rootWindow)
-
-    def __grabRecurse(self, item, parent, checkWinInfo=True):
-        try:
-            children = parent.query_tree().children
-        except:
-            return # window has been destroyed
-                     
-        for window in children:
-            shouldTrigger = False
-            
-            if checkWinInfo:
-                window_info = self.get_window_info(window, False)
-                shouldTrigger = item._should_trigger_window_title(window_info)
-
-            if shouldTrigger or not checkWinInfo:
-                self.__grabHotkey(item.hotKey, item.modifiers, window)
-                self.__grabRecurse(item, window, False)
-            else:
-                self.__grabRecurse(item, window)
+        self.inputQueue.put(self.__changeHotkeyUser, self.__hotkeyUser(item), 1, priority=PRIORITY_BACKGROUND)
+        # A burst of hotkey changes updates the grabs once, after the last change.
+        self.inputQueue.put(self.__updateStaleHotkeyGrabs, priority=PRIORITY_BACKGROUND, key="hotkey grabs")
 
     def ungrab_hotkey(self, item):
         """
         Ungrab a hotkey.
 
-        If the hotkey has no filter regex, it is global and is grabbed recursively from the root window
-        If it has a filter regex, iterate over all children of the root and ungrab from matching windows
+        The hotkey stays grabbed, as long as other folders or items use it.
         """
-        import copy
-        newItem = copy.copy(item)
-        
-        if item.get_applicable_regex() is None:
-            self.__enqueue(self.__ungrabHotkey, newItem.hotKey, newItem.modifiers, self.rootWindow)
-            if self.__needsMutterWorkaround(item):
-                self.__enqueue(self.__ungrabRecurse, newItem, self.rootWindow, False)
-        else:
-            self.__enqueue(self.__ungrabRecurse, newItem, self.rootWindow)
+        # The item may change before the queue gets to it, so use the current hotkey.
+        self.inputQueue.put(self.__changeHotkeyUser, self.__hotkeyUser(item), -1, priority=PRIORITY_BACKGROUND)
+        self.inputQueue.put(self.__updateStaleHotkeyGrabs, priority=PRIORITY_BACKGROUND, key="hotkey grabs")
 
-    def __ungrabRecurse(self, item, parent, checkWinInfo=True):
-        try:
-            children = parent.query_tree().children
-        except:
-            return # window has been destroyed
-                     
-        for window in children:
-            shouldTrigger = False
-            
-            if checkWinInfo:
-                window_info = self.get_window_info(window, False)
-                shouldTrigger = item._should_trigger_window_title(window_info)
-
-            if shouldTrigger or not checkWinInfo:
-                self.__ungrabHotkey(item.hotKey, item.modifiers, window)
-                self.__ungrabRecurse(item, window, False)
-            else:
-                self.__ungrabRecurse(item, window)
+    def __ungrabHotkey(self, grab, topLevelWindows=()):
+        """
+        Ungrab a specific hotkey in the root window
+        """
+        logger.debug("Ungrabbing hotkey: %r %r", grab.modifiers, grab.key)
+        windows = [self.rootWindow]
+        if self.__needsMutterWorkaround(grab.modifiers):
+            windows += topLevelWindows
+        for window in windows:
+            try:
+                for lockMask in self.__lockMasks():
+                    window.ungrab_key(grab.key_code, grab.mask|lockMask)
+            except Exception as e:
+                logger.warning("Failed to ungrab hotkey %r %r: %s", grab.modifiers, grab.key, str(e))
 
-    def __ungrabHotkey(self, key, modifiers, window):
+    def __handleGrabbedKeyPress(self, keyEvent):
         """
-        Ungrab a specific hotkey in the given window
+        Called by the listener thread for key presses of grabbed hotkeys. If the hotkey is grabbed synchronously, the
+        keyboard is frozen until it is either passed on to the focused window or kept by AutoKey. It is kept, if the
+        window filter of a folder or item using the hotkey matches the focused window.
         """
-        logger.debug("Ungrabbing hotkey: %r %r", modifiers, key)
+        lockMask = self.modMasks.get(Key.NUMLOCK, 0) | self.modMasks.get(Key.CAPSLOCK, 0)
+        grab = self.__syncGrabs.get((keyEvent.detail, keyEvent.state & 0xff & ~lockMask))
+        if grab is None:
+            return
+        mode = X.ReplayKeyboard
         try:
-            keycode = self.__lookupKeyCode(key)
-            mask = 0
-            for mod in modifiers:
-                mask |= self.modMasks[mod]
-
-            window.ungrab_key(keycode, mask)
-
-            if Key.NUMLOCK in self.modMasks:
-                window.ungrab_key(keycode, mask|self.modMasks[Key.NUMLOCK])
-
-            if Key.CAPSLOCK in self.modMasks:
-                window.ungrab_key(keycode, mask|self.modMasks[Key.CAPSLOCK])
-
-            if Key.CAPSLOCK in self.modMasks and Key.NUMLOCK in self.modMasks:
-                window.ungrab_key(keycode, mask|self.modMasks[Key.CAPSLOCK]|self.modMasks[Key.NUMLOCK])
-        except Exception as e:
-            logger.warning("Failed to ungrab hotkey %r %r: %s", modifiers, key, str(e))
+            snapshot = self.app.configManager.snapshot
+            windowItems = snapshot.window_filters.get(self.get_window_info())
+            modifiers = list(grab.modifiers)
+            owners = snapshot.hotkey_index.dispatch_items(modifiers, grab.key) + \
+                snapshot.hotkey_index.dispatch_folders(modifiers, grab.key)
+            if any(owner in windowItems for owner in owners):
+                mode = X.AsyncKeyboard
+        finally:
+            self.localDisplay.allow_events(mode, keyEvent.time)
+            self.localDisplay.flush()
 
     def lookup_string(self, keyCode, shifted, numlock, altGrid):
         if keyCode == 0:
@@ -604,247 +1093,332 @@ class XInterfaceBase(threading.Thread):
          causing a paste operation to happen.
         """
         logger.debug("Sending string via clipboard: " + string)
-        if common.USING_QT:
-            if paste_command in (None, autokey.model.phrase.SendMode.SELECTION):
-                self.__enqueue(self.app.exec_in_main, self._send_string_selection, string)
-            else:
-                self.__enqueue(self.app.exec_in_main, self._send_string_clipboard, string, paste_command)
+        if paste_command in (None, autokey.model.phrase.SendMode.SELECTION):
+            self.outputQueue.put(self._send_string_selection, string)
         else:
-            if paste_command in (None, autokey.model.phrase.SendMode.SELECTION):
-                self.__enqueue(self._send_string_selection, string)
-            else:
-                self.__enqueue(self._send_string_clipboard, string, paste_command)
+            self.outputQueue.put(self._send_string_clipboard, string, paste_command)
         logger.debug("Sending via clipboard enqueued.")
 
     def _send_string_clipboard(self, string: str, paste_command: autokey.model.phrase.SendMode):
         """
         Use the clipboard to send a string.
         """
-        backup = self.clipboard.text  # Keep a backup of current content, to restore the original afterwards.
-        if backup is None:
-            logger.warning("Tried to backup the X clipboard content, but got None instead of a string.")
-        self.clipboard.text = string
+        owner = self.__selectionOwner("CLIPBOARD")
+        generation = owner.paste(string)
         try:
             self.mediator.send_string(paste_command.value)
         finally:
             self.ungrab_keyboard()
         # Because send_string is queued, also enqueue the clipboard restore, to keep the proper action ordering.
-        self.__enqueue(self._restore_clipboard_text, backup)
-
-    def _restore_clipboard_text(self, backup: str):
-        """Restore the clipboard content."""
-        # Pasting takes some time, so wait a bit before restoring the content. Otherwise the restore is done before
-        # the pasting happens, causing the backup to be pasted instead of the desired clipboard content.
-        time.sleep(0.2)
-        self.clipboard.text = backup if backup is not None else ""
+        self.outputQueue.put(self.__queueSelectionRestore, owner, generation)
 
     def _send_string_selection(self, string: str):
         """Use the mouse selection clipboard to send a string."""
-        backup = self.clipboard.selection  # Keep a backup of current content, to restore the original afterwards.
-        if backup is None:
-            logger.warning("Tried to backup the X PRIMARY selection content, but got None instead of a string.")
-        self.clipboard.selection = string
-        self.__enqueue(self._paste_using_mouse_button_2)
-        self.__enqueue(self._restore_clipboard_selection, backup)
-
-    def _restore_clipboard_selection(self, backup: str):
-        """Restore the selection clipboard content."""
-        # Pasting takes some time, so wait a bit before restoring the content. Otherwise the restore is done before
-        # the pasting happens, causing the backup to be pasted instead of the desired clipboard content.
-
-        # Programmatically pressing the middle mouse button seems VERY slow, so wait rather long.
-        # It might be a good idea to make this delay configurable. There might be systems that need even longer.
-        time.sleep(1)
-        self.clipboard.selection = backup if backup is not None else ""
+        owner = self.__selectionOwner("PRIMARY")
+        generation = owner.paste(string)
+        self._paste_using_mouse_button_2()
+        self.__queueSelectionRestore(owner, generation)
+
+    def __selectionOwner(self, selection: str) -> SelectionOwner:
+        """Return the owner used to paste using the given selection. Runs on the output thread."""
+        owner = self.__selectionOwners.get(selection)
+        if owner is None:
+            owner = self.__selectionOwners[selection] = SelectionOwner(selection)
+        return owner
+
+    def __queueSelectionRestore(self, owner: SelectionOwner, generation: int):
+        # The restore waits until the application fetched the pasted text. It runs on its own queue, so the output
+        # queue can go on with the next phrase meanwhile.
+        self.clipboardQueue.put(self.__restoreSelection, owner, generation)
+
+    def __restoreSelection(self, owner: SelectionOwner, generation: int):
+        """Restore the selection content, once the pasted text was requested or the fallback timeout passed."""
+        owner.restore(
+            generation, cm.ConfigManager.SETTINGS[cm_constants.CLIPBOARD_RESTORE_TIMEOUT],
+            lambda backup: self.__handBackSelection(owner.name, backup)
+        )
+
+    def __handBackSelection(self, selection: str, content: str):
+        """
+        Set the content of the selection using the Qt or GTK clipboard, which serves it from then on. Qt requires
+        the clipboard to be used on the main thread, so the content is set there and this waits until it is done.
+        """
+        if common.USING_QT:
+            done = threading.Event()
+
+            def hand_back():
+                try:
+                    self.__setClipboardContent(selection, content)
+                finally:
+                    done.set()
+
+            self.app.exec_in_main(hand_back)
+            done.wait()
+        else:
+            self.__setClipboardContent(selection, content)
+
+    def __setClipboardContent(self, selection: str, content: str):
+        if self.clipboard is None:
+            # Created on first use, as the Qt clipboard has to be created on the main thread.
+            self.clipboard = Clipboard()
+        if selection == "PRIMARY":
+            self.clipboard.selection = content
+        else:
+            self.clipboard.text = content
 
     def _paste_using_mouse_button_2(self):
         """Paste using the mouse: Press the second mouse button, then release it again."""
-        focus = self.localDisplay.get_input_focus().focus
+        focus = self.outputDisplay.get_input_focus().focus
         xtest.fake_input(focus, X.ButtonPress, X.Button2)
         xtest.fake_input(focus, X.ButtonRelease, X.Button2)
+        self.outputDisplay.flush()
         logger.debug("Mouse Button2 event sent.")
 
     def begin_send(self):
-        self.__enqueue(self.__grab_keyboard)
+        self.outputQueue.put(self.__beginSend)
 
     def finish_send(self):
-        self.__enqueue(self.__ungrabKeyboard)
+        self.outputQueue.put(self.__finishSend)
+
+    def __beginSend(self):
+        # Events injected using XTEST are delivered like real input. An active keyboard grab would redirect them to
+        # AutoKey instead of the focused application.
+        if not self.__usingXTest():
+            self.__grab_keyboard()
+
+    def __finishSend(self):
+        if self.__usingXTest():
+            self.__flush()
+        else:
+            self.__ungrabKeyboard()
+        self.__discardOutputEvents()
+
+    def __discardOutputEvents(self):
+        """
+        The output connection receives MappingNotify events and, while it grabs the keyboard, key events. Nothing
+        handles those there, so drop them instead of letting them pile up.
+        """
+        for _ in range(self.outputDisplay.pending_events()):
+            self.outputDisplay.next_event()
+
+    @staticmethod
+    def __usingXTest() -> bool:
+        return cm.ConfigManager.SETTINGS[cm_constants.KEYBOARD_BACKEND] == XTEST_BACKEND
 
     def grab_keyboard(self):
-        self.__enqueue(self.__grab_keyboard)
+        self.outputQueue.put(self.__grab_keyboard)
 
     def __grab_keyboard(self):
-        focus = self.localDisplay.get_input_focus().focus
+        focus = self.outputDisplay.get_input_focus().focus
         focus.grab_keyboard(True, X.GrabModeAsync, X.GrabModeAsync, X.CurrentTime)
-        self.localDisplay.flush()
+        self.outputDisplay.flush()
 
     def ungrab_keyboard(self):
-        self.__enqueue(self.__ungrabKeyboard)
+        self.outputQueue.put(self.__ungrabKeyboard)
         
     def __ungrabKeyboard(self):
-        self.localDisplay.ungrab_keyboard(X.CurrentTime)
-        self.localDisplay.flush()
-
-    def __findUsableKeycode(self, codeList):
-        for code, offset in codeList:
-            if offset in self.__usableOffsets:
-                return code, offset
-
-        return None, None
+        self.outputDisplay.ungrab_keyboard(X.CurrentTime)
+        self.outputDisplay.flush()
 
     def send_string(self, string):
-        self.__enqueue(self.__sendString, string)
+        self.outputQueue.put(self.__sendString, string)
         
     def __sendString(self, string):
         """
         Send a string of printable characters.
+
+        Using the XTEST backend, the key events of the whole string are written to the X server with a single flush.
         """
         logger.debug("Sending string: %r", string)
         # Determine if workaround is needed
         if not cm.ConfigManager.SETTINGS[cm_constants.ENABLE_QT4_WORKAROUND]:
             self.__checkWorkaroundNeeded()
 
-        # First find out if any chars need remapping
-        remapNeeded = False
-        for char in string:
-            keyCodeList = self.localDisplay.keysym_to_keycodes(ord(char))
-            usableCode, offset = self.__findUsableKeycode(keyCodeList)
-            if usableCode is None and char not in self.remappedChars:
-                remapNeeded = True
-                break
-
-        # Now we know chars need remapping, do it
-        if remapNeeded:
-            self.__ignoreRemap = True
-            self.remappedChars = {}
-            remapChars = []
-
-            for char in string:
-                keyCodeList = self.localDisplay.keysym_to_keycodes(ord(char))
-                usableCode, offset = self.__findUsableKeycode(keyCodeList)
-                if usableCode is None:
-                    remapChars.append(char)
-
-            logger.debug("Characters requiring remapping: %r", remapChars)
-            availCodes = self.__availableKeycodes
-            logger.debug("Remapping with keycodes in the range: %r", availCodes)
-            mapping = self.localDisplay.get_keyboard_mapping(8, 200)
-            firstCode = 8
-
-            for i in range(len(availCodes) - 1):
-                code = availCodes[i]
-                sym1 = 0
-                sym2 = 0
-
-                if len(remapChars) > 0:
-                    char = remapChars.pop(0)
-                    self.remappedChars[char] = (code, 0)
-                    sym1 = ord(char)
-                if len(remapChars) > 0:
-                    char = remapChars.pop(0)
-                    self.remappedChars[char] = (code, 1)
-                    sym2 = ord(char)
-
-                if sym1 != 0:
-                    mapping[code - firstCode][0] = sym1
-                    mapping[code - firstCode][1] = sym2
-
-            mapping = [tuple(l) for l in mapping]
-            self.localDisplay.change_keyboard_mapping(firstCode, mapping)
-            self.localDisplay.flush()
+        keyTable = self.__keyTable
 
-        focus = self.localDisplay.get_input_focus().focus
+        useXTest = self.__usingXTest()
+        # XTEST events go to the focused window anyway, so avoid the round trip to the X server.
+        focus = None if useXTest else self.outputDisplay.get_input_focus().focus
 
-        for char in string:
+        # Modifiers held down while typing a run of characters on the same shift level
+        heldModifiers = ()
+        # Characters up to this index have been bound to spare key codes, if needed
+        remapLimit = 0
+        for index, char in enumerate(string):
+            if index == remapLimit:
+                remapLimit = self.__remapChars(string, index, keyTable)
             try:
-                keyCodeList = self.localDisplay.keysym_to_keycodes(ord(char))
-                keyCode, offset = self.__findUsableKeycode(keyCodeList)
-                if keyCode is not None:
-                    if offset == 0:
-                        if self.localDisplay.lookup_string(ord(char)) is None:
-                            # No reasonable translation of key to string found
-                            # Try typing this as Unicode: <control><shift>u + hex
-                            ukeyCodeList = self.localDisplay.keysym_to_keycodes(ord('u'))
-                            ukeyCode, uOffset = self.__findUsableKeycode(ukeyCodeList)
-                            self.__sendKeyCode(ukeyCode, self.modMasks[Key.CONTROL] | self.modMasks[Key.SHIFT], focus)
-                            self.__releaseKey(Key.CONTROL)
-                            self.__releaseKey(Key.SHIFT)
-                            char_as_hex_string = '{:X}'.format(ord(char))
-                            for hex_char in char_as_hex_string:
-                                hexKeyCodeList = self.localDisplay.keysym_to_keycodes(ord(hex_char))
-                                hexKeyCode, hexOffset = self.__findUsableKeycode(hexKeyCodeList)
-                                self.__sendKeyCode(hexKeyCode)
-                            self.__pressKey(Key.ENTER)
-                        else:
-                            self.__sendKeyCode(keyCode, theWindow=focus)
-                    if offset == 1:
-                        self.__pressKey(Key.SHIFT)
-                        self.__sendKeyCode(keyCode, self.modMasks[Key.SHIFT], focus)
-                        self.__releaseKey(Key.SHIFT)
-                    if offset == 4:
-                        self.__pressKey(Key.ALT_GR)
-                        self.__sendKeyCode(keyCode, self.modMasks[Key.ALT_GR], focus)
-                        self.__releaseKey(Key.ALT_GR)
-                    if offset == 5:
-                        self.__pressKey(Key.ALT_GR)
-                        self.__pressKey(Key.SHIFT)
-                        self.__sendKeyCode(keyCode, self.modMasks[Key.ALT_GR]|self.modMasks[Key.SHIFT], focus)
-                        self.__releaseKey(Key.SHIFT)
-                        self.__releaseKey(Key.ALT_GR)
-
-                elif char in self.remappedChars:
+                binding = keyTable.get(char)
+                if binding is None and char in self.remappedChars:
                     keyCode, offset = self.remappedChars[char]
-                    if offset == 0:
-                        self.__sendKeyCode(keyCode, theWindow=focus)
-                    if offset == 1:
+                    binding = KeyBinding(keyCode, offset, self.modMasks[Key.SHIFT] if offset else 0)
+
+                if binding is None:
+                    logger.warning("Unable to send character %r", char)
+                elif char in self.__unicodeInputChars:
+                    # No reasonable translation of key to string found
+                    # Try typing this as Unicode: <control><shift>u + hex
+                    heldModifiers = self.__holdModifiers(heldModifiers, (), focus)
+                    ukeyCode = keyTable['u'].key_code
+                    if useXTest:
+                        self.__pressKey(Key.CONTROL)
                         self.__pressKey(Key.SHIFT)
-                        self.__sendKeyCode(keyCode, self.modMasks[Key.SHIFT], focus)
-                        self.__releaseKey(Key.SHIFT)
+                    self.__sendKeyCode(ukeyCode, self.modMasks[Key.CONTROL] | self.modMasks[Key.SHIFT], focus)
+                    self.__releaseKey(Key.CONTROL)
+                    self.__releaseKey(Key.SHIFT)
+                    char_as_hex_string = '{:X}'.format(ord(char))
+                    for hex_char in char_as_hex_string:
+                        self.__sendKeyCode(keyTable[hex_char].key_code)
+                    self.__pressKey(Key.ENTER)
                 else:
-                    logger.warning("Unable to send character %r", char)
+                    heldModifiers = self.__holdModifiers(heldModifiers, OFFSET_MODIFIERS[binding.offset], focus)
+                    self.__sendKeyCode(binding.key_code, binding.mask, focus)
             except Exception as e:
                 logger.exception("Error sending char %r: %s", char, str(e))
 
-        self.__ignoreRemap = False
+        # Leave the modifier state as it was, the IoMediator restores the modifiers held by the user afterwards.
+        self.__holdModifiers(heldModifiers, (), focus)
+        if useXTest:
+            self.__flush()
+
+    def __remapChars(self, string, start, keyTable) -> int:
+        """
+        Binds the characters of string[start:] missing in the keyboard mapping to spare key codes. If there are more
+        such characters than spare key codes, only those up to the first character that does not fit are bound.
+        A character already bound is reused, otherwise the least recently used binding is replaced.
+        Only the changed key codes are written to the keyboard mapping.
 
+        The key events sent before are processed by the X server before the mapping change, so a binding can be
+        replaced even if it was used earlier in the same string.
 
-    def send_key(self, keyName):
+        Returns the index of the first character that was not considered.
+        """
+        remapped = self.remappedChars
+        poolSize = len(self.__availableKeycodes)
+        needed = []
+        end = len(string)
+        for index in range(start, len(string)):
+            char = string[index]
+            if char in keyTable or char in needed:
+                continue
+            if len(needed) == poolSize:
+                end = index
+                break
+            needed.append(char)
+        if not needed:
+            return end
+        # Mark the bound characters as used first, so that none of them is replaced by the new bindings.
+        for char in needed:
+            if char in remapped:
+                remapped.move_to_end(char)
+
+        changes = {}
+        for char in needed:
+            if char in remapped:
+                continue
+            if self.__freeKeycodes:
+                code = self.__freeKeycodes.pop(0)
+            else:
+                replaced, (code, offset) = remapped.popitem(last=False)
+                logger.debug("Replacing the key code binding of %r", replaced)
+            remapped[char] = (code, 0)
+            changes[code] = char_to_keysym(char)
+        if changes:
+            logger.debug("Characters requiring remapping: %r", [char for char in needed if char not in keyTable])
+            self.__changeKeyboardMapping(changes)
+        return end
+
+    def __changeKeyboardMapping(self, changes):
+        """
+        Binds each key code in changes to the given key symbol, on all shift levels. Consecutive key codes are changed
+        using a single request. The resulting MappingNotify events are ignored, see __isOwnMappingChange().
+        """
+        codes = sorted(changes)
+        runStart = 0
+        for index in range(1, len(codes) + 1):
+            if index == len(codes) or codes[index] != codes[index - 1] + 1:
+                firstCode = codes[runStart]
+                keySyms = [(changes[code], changes[code]) for code in codes[runStart:index]]
+                self.__ownMappingChanges.append((firstCode, len(keySyms), time.monotonic() + OWN_MAPPING_CHANGE_TIMEOUT))
+                self.outputDisplay.change_keyboard_mapping(firstCode, keySyms)
+                runStart = index
+
+    def __isOwnMappingChange(self, mappingEvent) -> bool:
+        """
+        Checks if a MappingNotify event reports a keyboard mapping change done by __changeKeyboardMapping(). Those only
+        rebind spare key codes, so the mappings and hotkey grabs do not have to be rebuilt.
+        """
+        if mappingEvent.request != X.MappingKeyboard:
+            return False
+        changes = self.__ownMappingChanges
+        now = time.monotonic()
+        while changes and changes[0][2] < now:
+            changes.popleft()
+        if changes and changes[0][:2] == (mappingEvent.first_keycode, mappingEvent.count):
+            changes.popleft()
+            return True
+        return False
+
+
+    def __holdModifiers(self, heldModifiers, modifiers, theWindow=None):
+        """
+        Releases the held modifiers not in the given modifiers and presses the missing ones.
+        Returns the modifiers held afterwards.
+        """
+        if heldModifiers == modifiers:
+            return heldModifiers
+        for modifier in reversed(heldModifiers):
+            if modifier not in modifiers:
+                self.__releaseKey(modifier, theWindow)
+        for modifier in modifiers:
+            if modifier not in heldModifiers:
+                self.__pressKey(modifier, theWindow)
+        return modifiers
+
+    def send_key(self, keyName, repeat=1):
         """
         Send a specific non-printing key, eg Up, Left, etc
+        If repeat is greater than 1, the key is sent that often as a single operation, followed by a single flush.
         """
-        self.__enqueue(self.__sendKey, keyName)
+        if repeat > 0:
+            self.outputQueue.put(self.__sendKey, keyName, repeat)
         
-    def __sendKey(self, keyName):
-        logger.debug("Send special key: [%r]", keyName)
-        self.__sendKeyCode(self.__lookupKeyCode(keyName))
+    def __sendKey(self, keyName, repeat=1):
+        logger.debug("Send special key: [%r] %d time(s)", keyName, repeat)
+        keyCode = self.__lookupKeyCode(keyName)
+        focus = None if self.__usingXTest() else self.outputDisplay.get_input_focus().focus
+        for _ in range(repeat):
+            self.__sendKeyCode(keyCode, theWindow=focus)
+        if repeat > 1:
+            self.__flush()
 
     def fake_keypress(self, keyName):
-         self.__enqueue(self.__fakeKeypress, keyName)
+         self.outputQueue.put(self.__fakeKeypress, keyName)
          
     def __fakeKeypress(self, keyName):        
         keyCode = self.__lookupKeyCode(keyName)
-        xtest.fake_input(self.rootWindow, X.KeyPress, keyCode)
-        xtest.fake_input(self.rootWindow, X.KeyRelease, keyCode)
+        xtest.fake_input(self.outputRoot, X.KeyPress, keyCode)
+        xtest.fake_input(self.outputRoot, X.KeyRelease, keyCode)
 
     def fake_keydown(self, keyName):
-        self.__enqueue(self.__fakeKeydown, keyName)
+        self.outputQueue.put(self.__fakeKeydown, keyName)
         
     def __fakeKeydown(self, keyName):
         keyCode = self.__lookupKeyCode(keyName)
-        xtest.fake_input(self.rootWindow, X.KeyPress, keyCode)
+        xtest.fake_input(self.outputRoot, X.KeyPress, keyCode)
 
     def fake_keyup(self, keyName):
-        self.__enqueue(self.__fakeKeyup, keyName)
+        self.outputQueue.put(self.__fakeKeyup, keyName)
         
     def __fakeKeyup(self, keyName):
         keyCode = self.__lookupKeyCode(keyName)
-        xtest.fake_input(self.rootWindow, X.KeyRelease, keyCode)
+        xtest.fake_input(self.outputRoot, X.KeyRelease, keyCode)
 
     def send_modified_key(self, keyName, modifiers):
         """
         Send a modified key (e.g. when emulating a hotkey)
         """
-        self.__enqueue(self.__sendModifiedKey, keyName, modifiers)
+        self.outputQueue.put(self.__sendModifiedKey, keyName, modifiers)
 
     def __sendModifiedKey(self, keyName, modifiers):
         logger.debug("Send modified key: modifiers: %s key: %s", modifiers, keyName)
@@ -860,39 +1434,39 @@ class XInterfaceBase(threading.Thread):
             logger.warning("Error sending modified key %r %r: %s", modifiers, keyName, str(e))
 
     def send_mouse_click(self, xCoord, yCoord, button, relative):
-        self.__enqueue(self.__sendMouseClick, xCoord, yCoord, button, relative)
+        self.outputQueue.put(self.__sendMouseClick, xCoord, yCoord, button, relative)
         
     def __sendMouseClick(self, xCoord, yCoord, button, relative):    
         # Get current pointer position so we can return it there
-        pos = self.rootWindow.query_pointer()
+        pos = self.outputRoot.query_pointer()
 
         if relative:
-            focus = self.localDisplay.get_input_focus().focus
+            focus = self.outputDisplay.get_input_focus().focus
             focus.warp_pointer(xCoord, yCoord)
             xtest.fake_input(focus, X.ButtonPress, button, x=xCoord, y=yCoord)
             xtest.fake_input(focus, X.ButtonRelease, button, x=xCoord, y=yCoord)
         else:
-            self.rootWindow.warp_pointer(xCoord, yCoord)
-            xtest.fake_input(self.rootWindow, X.ButtonPress, button, x=xCoord, y=yCoord)
-            xtest.fake_input(self.rootWindow, X.ButtonRelease, button, x=xCoord, y=yCoord)
+            self.outputRoot.warp_pointer(xCoord, yCoord)
+            xtest.fake_input(self.outputRoot, X.ButtonPress, button, x=xCoord, y=yCoord)
+            xtest.fake_input(self.outputRoot, X.ButtonRelease, button, x=xCoord, y=yCoord)
 
-        self.rootWindow.warp_pointer(pos.root_x, pos.root_y)
+        self.outputRoot.warp_pointer(pos.root_x, pos.root_y)
 
         self.__flush()
 
     def mouse_press(self, xCoord, yCoord, button):
-        self.__enqueue(self.__mousePress, xCoord, yCoord, button)
+        self.outputQueue.put(self.__mousePress, xCoord, yCoord, button)
 
     def __mousePress(self, xCoord, yCoord, button):
-        focus = self.localDisplay.get_input_focus().focus
+        focus = self.outputDisplay.get_input_focus().focus
         xtest.fake_input(focus, X.ButtonPress, button, x=xCoord, y=yCoord)
         self.__flush()
 
     def mouse_release(self, xCoord, yCoord, button):
-        self.__enqueue(self.__mouseRelease, xCoord, yCoord, button)
+        self.outputQueue.put(self.__mouseRelease, xCoord, yCoord, button)
 
     def __mouseRelease(self, xCoord, yCoord, button):
-        focus = self.localDisplay.get_input_focus().focus
+        focus = self.outputDisplay.get_input_focus().focus
         xtest.fake_input(focus, X.ButtonRelease, button, x=xCoord, y=yCoord)
         self.__flush()
 
@@ -909,100 +1483,134 @@ class XInterfaceBase(threading.Thread):
 
     def scroll_down(self, number):
         for i in range(0, number):
-            self.__enqueue(self.__scroll, Button.SCROLL_DOWN)
+            self.outputQueue.put(self.__scroll, Button.SCROLL_DOWN)
 
     def scroll_up(self, number):
         for i in range(0, number):
-            self.__enqueue(self.__scroll, Button.SCROLL_UP)
+            self.outputQueue.put(self.__scroll, Button.SCROLL_UP)
 
     def __scroll(self, button):
-        focus = self.localDisplay.get_input_focus().focus
+        focus = self.outputDisplay.get_input_focus().focus
         x,y = self.mouse_location()
         xtest.fake_input(self=focus, event_type=X.ButtonPress, detail=button, x=x, y=y)
         xtest.fake_input(self=focus, event_type=X.ButtonRelease, detail=button, x=x, y=y)
         self.__flush()
 
     def move_cursor(self, xCoord, yCoord, relative=False, relative_self=False):
-        self.__enqueue(self.__moveCursor, xCoord, yCoord, relative, relative_self)
+        self.outputQueue.put(self.__moveCursor, xCoord, yCoord, relative, relative_self)
 
     def __moveCursor(self, xCoord, yCoord, relative=False, relative_self=False):
         if relative:
-            focus = self.localDisplay.get_input_focus().focus
+            focus = self.outputDisplay.get_input_focus().focus
             focus.warp_pointer(xCoord, yCoord)
             self.__flush()
             return
 
         if relative_self:
-            pos = self.rootWindow.query_pointer()
+            pos = self.outputRoot.query_pointer()
             xCoord += pos.root_x
             yCoord += pos.root_y
         
-        self.rootWindow.warp_pointer(xCoord,yCoord)
+        self.outputRoot.warp_pointer(xCoord,yCoord)
         self.__flush()
 
     def send_mouse_click_relative(self, xoff, yoff, button):
-        self.__enqueue(self.__sendMouseClickRelative, xoff, yoff, button)
+        self.outputQueue.put(self.__sendMouseClickRelative, xoff, yoff, button)
         
     def __sendMouseClickRelative(self, xoff, yoff, button):
         # Get current pointer position
-        pos = self.rootWindow.query_pointer()
+        pos = self.outputRoot.query_pointer()
 
         xCoord = pos.root_x + xoff
         yCoord = pos.root_y + yoff
 
-        self.rootWindow.warp_pointer(xCoord, yCoord)
-        xtest.fake_input(self.rootWindow, X.ButtonPress, button, x=xCoord, y=yCoord)
-        xtest.fake_input(self.rootWindow, X.ButtonRelease, button, x=xCoord, y=yCoord)
+        self.outputRoot.warp_pointer(xCoord, yCoord)
+        xtest.fake_input(self.outputRoot, X.ButtonPress, button, x=xCoord, y=yCoord)
+        xtest.fake_input(self.outputRoot, X.ButtonRelease, button, x=xCoord, y=yCoord)
 
-        self.rootWindow.warp_pointer(pos.root_x, pos.root_y)
+        self.outputRoot.warp_pointer(pos.root_x, pos.root_y)
 
         self.__flush()
 
     def flush(self):
-        self.__enqueue(self.__flush)
+        self.outputQueue.put(self.__flush)
         
     def __flush(self):
-        self.localDisplay.flush()
+        self.outputDisplay.flush()
         self.lastChars = []
 
+    def __flushOutput(self):
+        if self.outputDisplay is not None:
+            self.outputDisplay.flush()
+
     def press_key(self, keyName):
-        self.__enqueue(self.__pressKey, keyName)
+        self.outputQueue.put(self.__pressKey, keyName)
         
-    def __pressKey(self, keyName):
-        self.__sendKeyPressEvent(self.__lookupKeyCode(keyName), 0)
+    def __pressKey(self, keyName, theWindow=None):
+        if self.__usingXTest():
+            self.__injectKeyEvent(X.KeyPress, self.__lookupKeyCode(keyName))
+        else:
+            self.__sendKeyPressEvent(self.__lookupKeyCode(keyName), 0, theWindow)
 
     def release_key(self, keyName):
-        self.__enqueue(self.__releaseKey, keyName)
+        self.outputQueue.put(self.__releaseKey, keyName)
         
-    def __releaseKey(self, keyName):
-        self.__sendKeyReleaseEvent(self.__lookupKeyCode(keyName), 0)
+    def __releaseKey(self, keyName, theWindow=None):
+        if self.__usingXTest():
+            self.__injectKeyEvent(X.KeyRelease, self.__lookupKeyCode(keyName))
+        else:
+            self.__sendKeyReleaseEvent(self.__lookupKeyCode(keyName), 0, theWindow)
 
     def __flushEvents(self):
+        """
+        Listener thread. Waits for events of the X server and handles key presses of grabbed hotkeys, windows created
+        since the last wakeup and keyboard mapping changes. Keyboard mapping changes often come in bursts, they are
+        handled once no further change was reported for MAPPING_CHANGE_DEBOUNCE seconds.
+        """
         logger.debug("__flushEvents: Entering event loop.")
+        # Time at which the reported keyboard mapping changes are handled, None if there are none
+        mappingChangeDeadline = None
         while True:
             try:
-                readable, w, e = select.select([self.localDisplay], [], [], 1)
-                time.sleep(1)
-                if self.localDisplay in readable:
-                    createdWindows = []
-                    destroyedWindows = []
-                    
-                    for x in range(self.localDisplay.pending_events()):
-                        event = self.localDisplay.next_event()
-                        if event.type == X.CreateNotify:
-                            createdWindows.append(event.window)
-                        if event.type == X.DestroyNotify:
-                            destroyedWindows.append(event.window)
-                        if event.type == X.MappingNotify:
-                            logger.debug("X Mapping Event Detected")
-                            self.on_keys_changed()
-                            
-                    for window in createdWindows:
-                        if window not in destroyedWindows:
-                            self.__enqueue(self.__grabHotkeysForWindow, window)
-
+                # Xlib may have read events already, while waiting for a reply to a request of another thread.
+                if not self.localDisplay.pending_events():
+                    timeout = None
+                    if mappingChangeDeadline is not None:
+                        timeout = max(0.0, mappingChangeDeadline - time.monotonic())
+                    readable, w, e = select.select([self.localDisplay, self.__wakeupReader], [], [], timeout)
+                    if self.__wakeupReader in readable:
+                        os.read(self.__wakeupReader, 512)
                 if self.shutdown:
                     break
+
+                createdWindows = []
+                destroyedWindows = set()
+                for x in range(self.localDisplay.pending_events()):
+                    event = self.localDisplay.next_event()
+                    if event.type == X.KeyPress:
+                        self.__handleGrabbedKeyPress(event)
+                    if event.type == X.CreateNotify:
+                        createdWindows.append(event.window)
+                    if event.type == X.DestroyNotify:
+                        destroyedWindows.add(event.window)
+                    if event.type == X.PropertyNotify:
+                        self.__handlePropertyChange(event)
+                    if event.type == X.ReparentNotify:
+                        self.__invalidateWindowInfo([event.window.id])
+                    if event.type == X.MappingNotify:
+                        if self.__isOwnMappingChange(event):
+                            logger.debug("Ignored keyboard mapping change done by AutoKey")
+                        else:
+                            logger.debug("X Mapping Event Detected")
+                            mappingChangeDeadline = time.monotonic() + MAPPING_CHANGE_DEBOUNCE
+
+                if destroyedWindows:
+                    self.__invalidateWindowInfo([window.id for window in destroyedWindows], True)
+                if createdWindows or destroyedWindows:
+                    self.__updateCreatedWindows(createdWindows, destroyedWindows)
+                if mappingChangeDeadline is not None and time.monotonic() >= mappingChangeDeadline:
+                    mappingChangeDeadline = None
+                    self.on_keys_changed()
             except ConnectionClosedError:
                 # Autokey does not properly exit on logout. It causes an infinite exception loop, accumulating stack
                 # traces along. This acts like a memory leak, filling the system RAM until it hits an OOM condition.
@@ -1011,28 +1619,61 @@ class XInterfaceBase(threading.Thread):
                 # the connection.
                 # See https://github.com/autokey/autokey/issues/198 for details
                 logger.exception("__flushEvents: Connection to the X server closed. Forcefully exiting Autokey now.")
-                import os
                 os._exit(1)
             except Exception:
                 logger.exception("__flushEvents: Some exception occured:")
-                pass
+                if self.shutdown:
+                    break
         logger.debug("__flushEvents: Left event loop.")
 
+    def __updateCreatedWindows(self, createdWindows, destroyedWindows):
+        """
+        Queue grabbing the hotkeys in the created windows. Windows created earlier, which were not handled yet, are
+        handled together with them. Destroyed windows are dropped, if they were not handled yet.
+        """
+        with self.__createdWindowsLock:
+            for window in createdWindows:
+                self.__createdWindows[window.id] = window
+            for window in destroyedWindows:
+                self.__createdWindows.pop(window.id, None)
+            pending = bool(self.__createdWindows)
+        if pending:
+            self.inputQueue.put(self.__grabHotkeysForWindows, priority=PRIORITY_BACKGROUND, key="created windows")
+        else:
+            self.inputQueue.cancel("created windows")
+
     def handle_keypress(self, keyCode):
-        self.__enqueue(self.__handleKeyPress, keyCode)
+        if self.__isInjectedEvent(X.KeyPress, keyCode):
+            return
+        self.inputQueue.put(self.__handleKeyPress, keyCode, priority=PRIORITY_INPUT)
     
     def __handleKeyPress(self, keyCode):
-        focus = self.localDisplay.get_input_focus().focus
-
         modifier = self.__decodeModifier(keyCode)
         if modifier is not None:
             self.mediator.handle_modifier_down(modifier)
         else:
-            window_info = self.get_window_info(focus)
+            window_info = self.get_window_info()
             self.mediator.handle_keypress(keyCode, window_info)
 
     def handle_keyrelease(self, keyCode):
-        self.__enqueue(self.__handleKeyrelease, keyCode)
+        if self.__isInjectedEvent(X.KeyRelease, keyCode):
+            return
+        self.inputQueue.put(self.__handleKeyrelease, keyCode, priority=PRIORITY_INPUT)
+
+    def __isInjectedEvent(self, eventType, keyCode) -> bool:
+        """
+        Checks if a key event reported by the input listener was injected by AutoKey using XTEST. Those are seen
+        like real input and must not be processed as typed by the user. Injected events are reported in the order they
+        were sent, so only the oldest pending injected event can match.
+        """
+        injected = self.__injectedEvents
+        now = time.monotonic()
+        while injected and injected[0][2] < now:
+            injected.popleft()
+        if injected and injected[0][:2] == (eventType, keyCode):
+            injected.popleft()
+            return True
+        return False
     
     def __handleKeyrelease(self, keyCode):
         modifier = self.__decodeModifier(keyCode)
@@ -1040,7 +1681,7 @@ class XInterfaceBase(threading.Thread):
             self.mediator.handle_modifier_up(modifier)
             
     def handle_mouseclick(self, button, x, y):
-        self.__enqueue(self.__handleMouseclick, button, x, y)
+        self.inputQueue.put(self.__handleMouseclick, button, x, y, priority=PRIORITY_INPUT)
         
     def __handleMouseclick(self, button, x, y):
         # Sleep a bit to timing issues. A mouse click might change the active application.
@@ -1074,12 +1715,23 @@ class XInterfaceBase(threading.Thread):
     def __sendKeyCode(self, keyCode, modifiers=0, theWindow=None):
         if cm.ConfigManager.SETTINGS[cm_constants.ENABLE_QT4_WORKAROUND] or self.__enableQT4Workaround:
             self.__doQT4Workaround(keyCode)
-        self.__sendKeyPressEvent(keyCode, modifiers, theWindow)
-        self.__sendKeyReleaseEvent(keyCode, modifiers, theWindow)
+        if self.__usingXTest():
+            # The X server computes the modifier state from the keys pressed before.
+            self.__injectKeyEvent(X.KeyPress, keyCode)
+            self.__injectKeyEvent(X.KeyRelease, keyCode)
+        else:
+            self.__sendKeyPressEvent(keyCode, modifiers, theWindow)
+            self.__sendKeyReleaseEvent(keyCode, modifiers, theWindow)
+
+    def __injectKeyEvent(self, eventType, keyCode):
+        """
+        Injects a key event using the XTEST extension. The request is only buffered, it is sent on the next flush.
+        """
+        self.__injectedEvents.append((eventType, keyCode, time.monotonic() + INJECTED_EVENT_TIMEOUT))
+        xtest.fake_input(self.outputRoot, eventType, keyCode)
 
     def __checkWorkaroundNeeded(self):
-        focus = self.localDisplay.get_input_focus().focus
-        window_info = self.get_window_info(focus)
+        window_info = self.get_window_info()
         w = self.app.configManager.workAroundApps
         if w.match(window_info.wm_title) or w.match(window_info.wm_class):
             self.__enableQT4Workaround = True
@@ -1089,7 +1741,7 @@ class XInterfaceBase(threading.Thread):
     def __doQT4Workaround(self, keyCode):
         if len(self.lastChars) > 0:
             if keyCode in self.lastChars:
-                self.localDisplay.flush()
+                self.outputDisplay.flush()
                 time.sleep(0.0125)
 
         self.lastChars.append(keyCode)
@@ -1099,13 +1751,13 @@ class XInterfaceBase(threading.Thread):
 
     def __sendKeyPressEvent(self, keyCode, modifiers, theWindow=None):
         if theWindow is None:
-            focus = self.localDisplay.get_input_focus().focus
+            focus = self.outputDisplay.get_input_focus().focus
         else:
             focus = theWindow
         keyEvent = event.KeyPress(
                                   detail=keyCode,
                                   time=X.CurrentTime,
-                                  root=self.rootWindow,
+                                  root=self.outputRoot,
                                   window=focus,
                                   child=X.NONE,
                                   root_x=1,
@@ -1119,13 +1771,13 @@ class XInterfaceBase(threading.Thread):
 
     def __sendKeyReleaseEvent(self, keyCode, modifiers, theWindow=None):
         if theWindow is None:
-            focus = self.localDisplay.get_input_focus().focus
+            focus = self.outputDisplay.get_input_focus().focus
         else:
             focus = theWindow
         keyEvent = event.KeyRelease(
                                   detail=keyCode,
                                   time=X.CurrentTime,
-                                  root=self.rootWindow,
+                                  root=self.outputRoot,
                                   window=focus,
                                   child=X.NONE,
                                   root_x=1,
@@ -1137,28 +1789,108 @@ class XInterfaceBase(threading.Thread):
                                   )
         focus.send_event(keyEvent)
 
-    def __lookupKeyCode(self, char: str) -> int:
+    def __lookupKeyCode(self, char: str, connection=None) -> int:
+        """
+        Look up the key code using the keymap of the given display connection. By default, that is the output
+        connection, which only the output thread uses. The listener thread passes its own connection, as the output
+        connection is replaced by the output thread when the keyboard mapping changes.
+        """
+        if connection is None:
+            connection = self.outputDisplay
         if char in AK_TO_XK_MAP:
-            return self.localDisplay.keysym_to_keycode(AK_TO_XK_MAP[char])
+            return connection.keysym_to_keycode(AK_TO_XK_MAP[char])
         elif char.startswith("<code"):
             return int(char[5:-1])
         else:
             try:
-                return self.localDisplay.keysym_to_keycode(ord(char))
+                return connection.keysym_to_keycode(ord(char))
             except Exception as e:
                 logger.error("Unknown key name: %s", char)
                 raise
 
     def get_window_info(self, window=None, traverse: bool=True) -> WindowInfo:
+        """
+        Return the title and class of the given window, of the focused window by default.
+
+        With traverse, the result is cached per window id. AutoKey listens for property changes of the windows the
+        information was read from, and drops the cached information, if their title or class changes or one of them
+        is destroyed or reparented. The focused window is cached until the window manager reports another active
+        window. So repeated lookups for an unchanged window do not send any requests to the X server.
+        """
         try:
             if window is None:
-                window = self.localDisplay.get_input_focus().focus
-            return self._get_window_info(window, traverse)
+                window = self.__getFocusWindow()
+            if not traverse or isinstance(window, int):
+                return self._get_window_info(window, traverse)
+            with self.__windowInfoLock:
+                cached = self.__windowInfoCache.get(window.id)
+                if cached is not None:
+                    self.__windowInfoCache.move_to_end(window.id)
+                    return cached[0]
+                generation = self.__windowInfoGeneration
+            visited = []
+            window_info = self._get_window_info(window, traverse, visited=visited)
+            with self.__windowInfoLock:
+                if generation == self.__windowInfoGeneration:
+                    self.__windowInfoCache[window.id] = (window_info, frozenset(visited))
+                    if len(self.__windowInfoCache) > WINDOW_INFO_CACHE_SIZE:
+                        self.__windowInfoCache.popitem(last=False)
+            return window_info
         except error.BadWindow:
             logger.warning("Got BadWindow error while requesting window information.")
             return self._create_window_info(window, "", "")
 
-    def _get_window_info(self, window, traverse: bool, wm_title: str=None, wm_class: str=None) -> WindowInfo:
+    def __getFocusWindow(self):
+        focus = self.__focusWindow
+        if focus is None:
+            with self.__windowInfoLock:
+                generation = self.__windowInfoGeneration
+            focus = self.localDisplay.get_input_focus().focus
+            # Without an EWMH compliant window manager, focus changes are not reported.
+            if self.__ActiveWindowAtom and not isinstance(focus, int):
+                with self.__windowInfoLock:
+                    if generation == self.__windowInfoGeneration:
+                        self.__focusWindow = focus
+        return focus
+
+    def __watchWindow(self, window, visited: list):
+        """Select the property and structure events of the given window, which are used to invalidate the cache."""
+        visited.append(window.id)
+        if window.id not in self.__watchedWindows and window.id != self.rootWindow.id:
+            window.change_attributes(event_mask=X.PropertyChangeMask|X.StructureNotifyMask)
+            self.__watchedWindows.add(window.id)
+
+    def __handlePropertyChange(self, propertyEvent):
+        if propertyEvent.atom in self.__windowInfoAtoms:
+            self.__invalidateWindowInfo([propertyEvent.window.id])
+        elif propertyEvent.atom == self.__ActiveWindowAtom:
+            with self.__windowInfoLock:
+                self.__focusWindow = None
+                self.__windowInfoGeneration += 1
+
+    def __invalidateWindowInfo(self, windowIds, destroyed: bool=False):
+        """Drop the cached information read from the given windows. With None, the whole cache is cleared."""
+        with self.__windowInfoLock:
+            self.__windowInfoGeneration += 1
+            if windowIds is None:
+                self.__windowInfoCache.clear()
+                self.__watchedWindows.clear()
+                self.__focusWindow = None
+                return
+            windowIds = set(windowIds)
+            for cachedId, (window_info, visited) in list(self.__windowInfoCache.items()):
+                if not visited.isdisjoint(windowIds):
+                    del self.__windowInfoCache[cachedId]
+            if destroyed:
+                self.__watchedWindows.difference_update(windowIds)
+                if self.__focusWindow is not None and self.__focusWindow.id in windowIds:
+                    self.__focusWindow = None
+
+    def _get_window_info(self, window, traverse: bool, wm_title: str=None, wm_class: str=None,
+                         visited: list=None) -> WindowInfo:
+        if visited is not None:
+            # Listen for changes before reading the properties, so no change gets lost in between.
+            self.__watchWindow(window, visited)
         new_wm_title = self._try_get_window_title(window)
         new_wm_class = self._try_get_window_class(window)
 
@@ -1170,7 +1902,7 @@ class XInterfaceBase(threading.Thread):
         if traverse:
             # Recursive operation on the parent window
             if wm_title and wm_class:  # Both known, abort walking the tree and return the data.
-                return self._create_window_info(window, wm_title, wm_class)
+                return self._create_window_info(window, wm_title, wm_class, visited)
             else:  # At least one property is still not known. So walk the window tree up.
                 parent = window.query_tree().parent
                 # Stop traversal, if the parent is not a window. When querying the parent, at some point, an integer
@@ -1178,9 +1910,9 @@ class XInterfaceBase(threading.Thread):
                 if isinstance(parent, int):
                     # At this point, wm_title or wm_class may still be None. The recursive call with traverse=False
                     # will replace any None with an empty string. See below.
-                    return self._get_window_info(window, False, wm_title, wm_class)
+                    return self._get_window_info(window, False, wm_title, wm_class, visited)
                 else:
-                    return self._get_window_info(parent, traverse, wm_title, wm_class)
+                    return self._get_window_info(parent, traverse, wm_title, wm_class, visited)
 
         else:
             # No recursion, so fill unknown values with empty strings.
@@ -1188,9 +1920,9 @@ class XInterfaceBase(threading.Thread):
                 wm_title = ""
             if wm_class is None:
                 wm_class = ""
-            return self._create_window_info(window, wm_title, wm_class)
+            return self._create_window_info(window, wm_title, wm_class, visited)
 
-    def _create_window_info(self, window, wm_title: str, wm_class: str):
+    def _create_window_info(self, window, wm_title: str, wm_class: str, visited: list=None):
         """
         Creates a WindowInfo object from the window title and WM_CLASS.
         Also checks for the Java XFocusProxyWindow workaround and applies it if needed:
@@ -1202,7 +1934,7 @@ class XInterfaceBase(threading.Thread):
         if "FocusProxy" in wm_class:
             parent = window.query_tree().parent
             # Discard both the already known wm_class and window title, because both are known to be wrong.
-            return self._get_window_info(parent, False)
+            return self._get_window_info(parent, False, visited=visited)
         else:
             return WindowInfo(wm_title=wm_title, wm_class=wm_class)
 
@@ -1243,16 +1975,25 @@ class XInterfaceBase(threading.Thread):
         return self.get_window_info(window, traverse).wm_class
 
     def cancel(self):
-        logger.debug("XInterfaceBase: Try to exit event thread.")
-        self.queue.put_nowait((None, None))
-        logger.debug("XInterfaceBase: Event thread exit marker enqueued.")
+        logger.debug("XInterfaceBase: Try to exit the input and output threads.")
         self.shutdown = True
+        self.__wakeListener()
         logger.debug("XInterfaceBase: self.shutdown set to True. This should stop the listener thread.")
         self.listenerThread.join()
-        self.eventThread.join()
+        self.inputQueue.stop()
+        self.outputQueue.stop()
+        self.clipboardQueue.stop()
+        for owner in self.__selectionOwners.values():
+            owner.close()
+        os.close(self.__wakeupReader)
+        os.close(self.__wakeupWriter)
+        self.outputDisplay.flush()
+        self.outputDisplay.close()
         self.localDisplay.flush()
         self.localDisplay.close()
-        self.join()
+        # The AT-SPI interface does not run the thread.
+        if self.is_alive():
+            self.join()
 
 
 class XRecordInterface(XInterfaceBase):
@@ -1442,6 +2183,14 @@ XK_TO_AK_MAP = {
 
 AK_TO_XK_MAP = dict((v,k) for k, v in XK_TO_AK_MAP.items())
 
+# Modifiers to hold down to type the key symbol at the given offset of a key code
+OFFSET_MODIFIERS = {
+           0: (),
+           1: (Key.SHIFT,),
+           4: (Key.ALT_GR,),
+           5: (Key.ALT_GR, Key.SHIFT),
+           }
+
 XK_TO_AK_NUMLOCKED = {
            XK.XK_KP_Insert: "0",
            XK.XK_KP_Delete: ".",
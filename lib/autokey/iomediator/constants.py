@@ -1 +1,5 @@
 X_RECORD_INTERFACE = "XRecord"
+
+# Keyboard output backends of the X interface
+SEND_EVENT_BACKEND = "SendEvent"
+XTEST_BACKEND = "XTest"
@@ -202,9 +202,9 @@ class IoMediator(threading.Thread):
                 
         self.send_backspace(backspaces)
 
-    def send_key(self, key_name):
+    def send_key(self, key_name, repeat: int=1):
         key_name = key_name.replace('\n', "<enter>")
-        self.interface.send_key(key_name)
+        self.interface.send_key(key_name, repeat)
 
     def press_key(self, key_name):
         key_name = key_name.replace('\n', "<enter>")
@@ -222,26 +222,22 @@ class IoMediator(threading.Thread):
         """
         Sends the given number of left key presses.
         """
-        for i in range(count):
-            self.interface.send_key(Key.LEFT)
+        self.interface.send_key(Key.LEFT, count)
 
     def send_right(self, count):
-        for i in range(count):
-            self.interface.send_key(Key.RIGHT)
+        self.interface.send_key(Key.RIGHT, count)
     
     def send_up(self, count):
         """
         Sends the given number of up key presses.
         """        
-        for i in range(count):
-            self.interface.send_key(Key.UP)
+        self.interface.send_key(Key.UP, count)
 
     def send_backspace(self, count):
         """
         Sends the given number of backspace key presses.
         """
-        for i in range(count):
-            self.interface.send_key(Key.BACKSPACE)
+        self.interface.send_key(Key.BACKSPACE, count)
 
     def flush(self):
         self.interface.flush()
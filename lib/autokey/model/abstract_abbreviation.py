@@ -20,6 +20,93 @@ import typing
 from autokey.model.helpers import DEFAULT_WORDCHAR_REGEX, TriggerMode
 
 
+class InputBuffer(str):
+    """
+    Typed input, together with its case-folded form used to match abbreviations ignoring case.
+
+    Every input character is case-folded on its own, so a case-folded abbreviation only matches whole input characters,
+    even where folding changes the length (like "ß", which folds to "ss"). The Service passes the folded characters
+    it collects while the user types. For plain strings, the folded form is computed on first use.
+    """
+
+    def __new__(cls, value: str="", folded_chars: typing.Sequence[str]=None):
+        buffer = super().__new__(cls, value)
+        buffer._folded_chars = folded_chars
+        buffer._folded = None
+        buffer._starts = None
+        return buffer
+
+    @classmethod
+    def of(cls, value: str) -> "InputBuffer":
+        return value if isinstance(value, InputBuffer) else cls(value)
+
+    @property
+    def folded(self) -> str:
+        if self._folded is None:
+            if self._folded_chars is None:
+                # Full case folding maps every character on its own, so this equals folding character by character.
+                self._folded = str.casefold(self)
+            else:
+                self._folded = "".join(self._folded_chars)
+        return self._folded
+
+    def folded_rpartition(self, folded_separator: str) -> typing.Tuple[str, str, str]:
+        """
+        Same as str.rpartition(), except that the case-folded input is searched for the given case-folded separator.
+        The returned parts are taken from the original input.
+        """
+        folded = self.folded
+        if len(folded) == len(self):
+            # No character changed its length, so positions in the folded input are positions in the input.
+            index = folded.rfind(folded_separator)
+            if index < 0:
+                return "", "", str(self)
+            end = index + len(folded_separator)
+            return self[:index], self[index:end], self[end:]
+
+        starts = self._character_starts()
+        limit = len(folded)
+        while True:
+            index = folded.rfind(folded_separator, 0, limit)
+            if index < 0:
+                return "", "", str(self)
+            start = starts.get(index)
+            end = starts.get(index + len(folded_separator))
+            if start is not None and end is not None:
+                return self[:start], self[start:end], self[end:]
+            # The match covers only part of a folded input character, look further left.
+            limit = index + len(folded_separator) - 1
+
+    def _character_starts(self) -> typing.Dict[int, int]:
+        """Map the offsets in the folded input, where a folded input character starts, to its position."""
+        if self._starts is None:
+            if self._folded_chars is None:
+                self._folded_chars = [char.casefold() for char in self]
+            starts = {}
+            offset = 0
+            for position, folded_char in enumerate(self._folded_chars):
+                starts[offset] = position
+                offset += len(folded_char)
+            starts[offset] = len(self)
+            self._starts = starts
+        return self._starts
+
+
+class AbbreviationMatch(typing.NamedTuple):
+    """
+    Describes how an abbreviation matched the typed input. It is created once by match_input() and passed on to
+    the expansion and the undo of the expansion, so the input does not have to be searched again.
+    """
+    # The configured abbreviation
+    abbreviation: str
+    # Start and end of the typed abbreviation in the input buffer
+    span: typing.Tuple[int, int]
+    # The abbreviation as typed, differing from the configured one in case, if ignoreCase is set
+    typed_abbreviation: str
+    # Characters typed after the abbreviation, i.e. the trigger character. Empty for immediately triggering ones
+    trigger_chars: str
+
+
 class AbstractAbbreviation:
     """
     Abstract class encapsulating the common functionality of an abbreviation list
@@ -33,6 +120,24 @@ class AbstractAbbreviation:
         self.triggerInside = False
         self.set_word_chars(DEFAULT_WORDCHAR_REGEX)
 
+    @property
+    def abbreviations(self) -> typing.List[str]:
+        return self._abbreviations
+
+    @abbreviations.setter
+    def abbreviations(self, abbreviations: typing.List[str]):
+        self._abbreviations = abbreviations
+        self._refresh_folded_abbreviations()
+
+    def _refresh_folded_abbreviations(self):
+        """
+        Case-fold the abbreviations, so matching them ignoring case does not fold them on every key press. Called
+        whenever the abbreviations are set or extended, see _folded_abbreviation().
+        """
+        self._folded_abbreviations = {
+            abbreviation: abbreviation.casefold() for abbreviation in self._abbreviations
+        }  # type: typing.Dict[str, str]
+
     def get_serializable(self):
         d = {
             "abbreviations": self.abbreviations,
@@ -76,6 +181,7 @@ class AbstractAbbreviation:
                 abbr, type(abbr)
             ))
         self.abbreviations.append(abbr)
+        self._folded_abbreviations[abbr] = abbr.casefold()
         if TriggerMode.ABBREVIATION not in self.modes:
             self.modes.append(TriggerMode.ABBREVIATION)
 
@@ -106,16 +212,28 @@ class AbstractAbbreviation:
 
         @param buffer Input buffer to be checked (as string)
         """
-        return any(self.__checkInput(buffer, abbr) for abbr in self.abbreviations)
+        return self._match_abbreviation(buffer) is not None
 
     def _get_trigger_abbreviation(self, buffer):
+        match = self._match_abbreviation(buffer)
+        return None if match is None else match.abbreviation
+
+    def _match_abbreviation(self, buffer) -> typing.Optional["AbbreviationMatch"]:
+        """
+        Return where the first abbreviation that should trigger on the given input matched it, or None.
+
+        @param buffer Input buffer to be checked (as string)
+        """
+        if self.ignoreCase:
+            buffer = InputBuffer.of(buffer)
         for abbr in self.abbreviations:
-            if self.__checkInput(buffer, abbr):
-                return abbr
+            match = self.__checkInput(buffer, abbr)
+            if match is not None:
+                return match
 
         return None
 
-    def __checkInput(self, buffer, abbr):
+    def __checkInput(self, buffer, abbr) -> typing.Optional["AbbreviationMatch"]:
         stringBefore, typedAbbr, stringAfter = self._partition_input(buffer, abbr)
         if len(typedAbbr) > 0:
             # Check trigger character condition
@@ -125,29 +243,30 @@ class AbstractAbbreviation:
                     # Have a character after abbr
                     if self.wordChars.match(stringAfter):
                         # last character(s) is a word char, can't send expansion
-                        return False
+                        return None
                     elif len(stringAfter) > 1:
                         # Abbr not at/near end of buffer any more, can't send
-                        return False
+                        return None
                 else:
                     # Nothing after abbr yet, can't expand yet
-                    return False
+                    return None
 
             else:
                 # immediate option enabled, check abbr is at end of buffer
                 if len(stringAfter) > 0:
-                    return False
+                    return None
 
             # Check chars ahead of abbr
             # length of stringBefore should always be > 0
             if len(stringBefore) > 0 and not re.match('(^\s)', stringBefore[-1]) and not self.triggerInside:
                 # check if last char before the typed abbreviation is a word char
                 # if triggerInside is not set, can't trigger when inside a word
-                return False
+                return None
 
-            return True
+            start = len(stringBefore)
+            return AbbreviationMatch(abbr, (start, start + len(typedAbbr)), typedAbbr, stringAfter)
 
-        return False
+        return None
 
     def _partition_input(self, current_string: str, abbr: typing.Optional[str]) -> typing.Tuple[str, str, str]:
         """
@@ -155,12 +274,9 @@ class AbstractAbbreviation:
         """
         if abbr:
             if self.ignoreCase:
-                string_before, typed_abbreviation, string_after = self._case_insensitive_rpartition(
-                    current_string, abbr
+                string_before, typed_abbreviation, string_after = InputBuffer.of(current_string).folded_rpartition(
+                    self._folded_abbreviation(abbr)
                 )
-                abbr_start_index = len(string_before)
-                abbr_end_index = abbr_start_index + len(typed_abbreviation)
-                typed_abbreviation = current_string[abbr_start_index:abbr_end_index]
             else:
                 string_before, typed_abbreviation, string_after = current_string.rpartition(abbr)
 
@@ -171,18 +287,15 @@ class AbstractAbbreviation:
             # should be undone.
             return "", current_string, ""
 
+    def _folded_abbreviation(self, abbr: str) -> str:
+        """
+        Return the case-folded abbreviation. Abbreviations added to the list without using the methods of this class
+        are folded on every call.
+        """
+        folded = self._folded_abbreviations.get(abbr)
+        return abbr.casefold() if folded is None else folded
+
     @staticmethod
     def _case_insensitive_rpartition(input_string: str, separator: str) -> typing.Tuple[str, str, str]:
         """Same as str.rpartition(), except that the partitioning is done case insensitive."""
-        lowered_input_string = input_string.lower()
-        lowered_separator = separator.lower()
-        try:
-            split_index = lowered_input_string.rindex(lowered_separator)
-        except ValueError:
-            # Did not find the separator in the input_string.
-            # Follow https://docs.python.org/3/library/stdtypes.html#text-sequence-type-str
-            # str.rpartition documentation and return the tuple ("", "", unmodified_input) in this case
-            return "", "", input_string
-        else:
-            split_index_2 = split_index+len(separator)
-            return input_string[:split_index], input_string[split_index: split_index_2], input_string[split_index_2:]
+        return InputBuffer.of(input_string).folded_rpartition(separator.casefold())
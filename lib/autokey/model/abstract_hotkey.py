@@ -55,8 +55,9 @@ class AbstractHotkey(AbstractWindowFilter):
             self.modes.remove(TriggerMode.HOTKEY)
 
     def check_hotkey(self, modifiers, key, windowTitle):
-        if self.hotKey is not None and self._should_trigger_window_title(windowTitle):
-            return (self.modifiers == modifiers) and (self.hotKey == key)
+        # Compare the key first, the window filter is comparatively expensive to evaluate.
+        if self.hotKey is not None and (self.modifiers == modifiers) and (self.hotKey == key):
+            return self._should_trigger_window_title(windowTitle)
         else:
             return False
 
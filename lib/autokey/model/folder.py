@@ -24,7 +24,7 @@ from autokey.configmanager import configmanager_constants as cm_constants
 from autokey.model.phrase import Phrase
 from autokey.model.script import Script
 from autokey.model.helpers import get_safe_path, TriggerMode
-from autokey.model.abstract_abbreviation import AbstractAbbreviation
+from autokey.model.abstract_abbreviation import AbstractAbbreviation, AbbreviationMatch
 from autokey.model.abstract_window_filter import AbstractWindowFilter
 from autokey.model.abstract_hotkey import AbstractHotkey
 
@@ -212,10 +212,15 @@ class Folder(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
         self.items.remove(item)
 
     def check_input(self, buffer, window_info):
+        return self.match_input(buffer, window_info) is not None
+
+    def match_input(self, buffer, window_info) -> typing.Optional[AbbreviationMatch]:
+        """Like check_input(), but returns how the abbreviation matched the input, or None."""
         if TriggerMode.ABBREVIATION in self.modes:
-            return self._should_trigger_abbreviation(buffer) and self._should_trigger_window_title(window_info)
-        else:
-            return False
+            match = self._match_abbreviation(buffer)
+            if match is not None and self._should_trigger_window_title(window_info):
+                return match
+        return None
 
     def increment_usage_count(self):
         self.usageCount += 1
@@ -228,10 +233,9 @@ class Folder(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
         that triggered this folder.
         """
         if TriggerMode.ABBREVIATION in self.modes and self.backspace:
-            if self._should_trigger_abbreviation(buffer):
-                abbr = self._get_trigger_abbreviation(buffer)
-                stringBefore, typedAbbr, stringAfter = self._partition_input(buffer, abbr)
-                return len(abbr) + len(stringAfter)
+            match = self._match_abbreviation(buffer)
+            if match is not None:
+                return len(match.typed_abbreviation) + len(match.trigger_chars)
 
         if self.parent is not None:
             return self.parent.get_backspace_count(buffer)
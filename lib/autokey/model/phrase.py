@@ -21,7 +21,7 @@ import typing
 
 from autokey.model.key import NAVIGATION_KEYS, Key, KEY_SPLIT_RE
 from autokey.model.helpers import JSON_FILE_PATTERN, get_safe_path, TriggerMode
-from autokey.model.abstract_abbreviation import AbstractAbbreviation
+from autokey.model.abstract_abbreviation import AbstractAbbreviation, AbbreviationMatch
 from autokey.model.abstract_window_filter import AbstractWindowFilter
 from autokey.model.abstract_hotkey import AbstractHotkey
 
@@ -162,26 +162,38 @@ class Phrase(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
         self.modes = modes
 
     def check_input(self, buffer, window_info):
+        return self.match_input(buffer, window_info) is not None
+
+    def match_input(self, buffer, window_info) -> typing.Optional[AbbreviationMatch]:
+        """
+        Like check_input(), but returns how the abbreviation matched the input, or None. The result can be passed on
+        to build_phrase().
+        """
         if TriggerMode.ABBREVIATION in self.modes:
-            return self._should_trigger_abbreviation(buffer) and self._should_trigger_window_title(window_info)
-        else:
-            return False
+            match = self._match_abbreviation(buffer)
+            if match is not None and self._should_trigger_window_title(window_info):
+                return match
+        return None
 
-    def build_phrase(self, buffer):
+    def build_phrase(self, buffer, match: AbbreviationMatch=None):
+        """
+        @param buffer: the typed input
+        @param match: the result of match_input() for the buffer, if known. Otherwise the buffer is searched again.
+        """
         self.usageCount += 1
         self.parent.increment_usage_count()
         expansion = Expansion(self.phrase)
         trigger_found = False
 
         if TriggerMode.ABBREVIATION in self.modes:
-            if self._should_trigger_abbreviation(buffer):
-                abbr = self._get_trigger_abbreviation(buffer)
-
-                stringBefore, typedAbbr, stringAfter = self._partition_input(buffer, abbr)
+            if match is None:
+                match = self._match_abbreviation(buffer)
+            if match is not None:
+                typedAbbr, stringAfter = match.typed_abbreviation, match.trigger_chars
                 trigger_found = True
                 if self.backspace:
                     # determine how many backspaces to send
-                    expansion.backspaces = len(abbr) + len(stringAfter)
+                    expansion.backspaces = len(typedAbbr) + len(stringAfter)
                 else:
                     expansion.backspaces = len(stringAfter)
 
@@ -232,10 +244,13 @@ class Phrase(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
 
         return self.parent.calculate_input(buffer)
 
-    def get_trigger_chars(self, buffer):
-        abbr = self._get_trigger_abbreviation(buffer)
-        stringBefore, typedAbbr, stringAfter = self._partition_input(buffer, abbr)
-        return typedAbbr + stringAfter
+    def get_trigger_chars(self, buffer, match: AbbreviationMatch=None):
+        if match is None:
+            match = self._match_abbreviation(buffer)
+        if match is None:
+            # Not triggered by an abbreviation, the whole buffer was typed.
+            return buffer
+        return match.typed_abbreviation + match.trigger_chars
 
     def should_prompt(self, buffer):
         """
@@ -22,7 +22,7 @@ from pathlib import Path
 
 from autokey.model.store import Store
 from autokey.model.helpers import JSON_FILE_PATTERN, get_safe_path, TriggerMode
-from autokey.model.abstract_abbreviation import AbstractAbbreviation
+from autokey.model.abstract_abbreviation import AbstractAbbreviation, AbbreviationMatch
 from autokey.model.abstract_window_filter import AbstractWindowFilter
 from autokey.model.abstract_hotkey import AbstractHotkey
 
@@ -47,6 +47,10 @@ class Script(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
         self.omitTrigger = False
         self.parent = None
         self.show_in_tray_menu = False
+        # If False, triggering the script while it runs queues the new run until the previous one finished.
+        self.allow_concurrent_runs = False
+        # If True, the script runs in one of the worker processes of autokey.script_processes
+        self.run_in_process = False
         self.path = path
 
     def build_path(self, base_name=None):
@@ -79,6 +83,8 @@ class Script(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
             "prompt": self.prompt,
             "omitTrigger": self.omitTrigger,
             "showInTrayMenu": self.show_in_tray_menu,
+            "allowConcurrentRuns": self.allow_concurrent_runs,
+            "runInProcess": self.run_in_process,
             "abbreviation": AbstractAbbreviation.get_serializable(self),
             "hotkey": AbstractHotkey.get_serializable(self),
             "filter": AbstractWindowFilter.get_serializable(self)
@@ -161,6 +167,8 @@ class Script(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
         self.prompt = data["prompt"]
         self.omitTrigger = data["omitTrigger"]
         self.show_in_tray_menu = data["showInTrayMenu"]
+        self.allow_concurrent_runs = data.get("allowConcurrentRuns", False)
+        self.run_in_process = data.get("runInProcess", False)
         AbstractAbbreviation.load_from_serialized(self, data["abbreviation"])
         AbstractHotkey.load_from_serialized(self, data["hotkey"])
         AbstractWindowFilter.load_from_serialized(self, data["filter"])
@@ -190,6 +198,8 @@ class Script(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
         self.omitTrigger = source_script.omitTrigger
         self.parent = source_script.parent
         self.show_in_tray_menu = source_script.show_in_tray_menu
+        self.allow_concurrent_runs = source_script.allow_concurrent_runs
+        self.run_in_process = source_script.run_in_process
         self.copy_abbreviation(source_script)
         self.copy_hotkey(source_script)
         self.copy_window_filter(source_script)
@@ -201,12 +211,24 @@ class Script(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
         self.modes = modes
 
     def check_input(self, buffer, window_info):
+        return self.match_input(buffer, window_info) is not None
+
+    def match_input(self, buffer, window_info) -> typing.Optional[AbbreviationMatch]:
+        """
+        Like check_input(), but returns how the abbreviation matched the input, or None. The result can be passed on
+        to process_buffer().
+        """
         if TriggerMode.ABBREVIATION in self.modes:
-            return self._should_trigger_abbreviation(buffer) and self._should_trigger_window_title(window_info)
-        else:
-            return False
+            match = self._match_abbreviation(buffer)
+            if match is not None and self._should_trigger_window_title(window_info):
+                return match
+        return None
 
-    def process_buffer(self, buffer):
+    def process_buffer(self, buffer, match: AbbreviationMatch=None):
+        """
+        @param buffer: the typed input
+        @param match: the result of match_input() for the buffer, if known. Otherwise the buffer is searched again.
+        """
         self.usageCount += 1
         self.parent.increment_usage_count()
         trigger_found = False
@@ -214,13 +236,14 @@ class Script(AbstractAbbreviation, AbstractHotkey, AbstractWindowFilter):
         string = ""
 
         if TriggerMode.ABBREVIATION in self.modes:
-            if self._should_trigger_abbreviation(buffer):
-                abbr = self._get_trigger_abbreviation(buffer)
-                stringBefore, typedAbbr, stringAfter = self._partition_input(buffer, abbr)
+            if match is None:
+                match = self._match_abbreviation(buffer)
+            if match is not None:
+                typedAbbr, stringAfter = match.typed_abbreviation, match.trigger_chars
                 trigger_found = True
                 if self.backspace:
                     # determine how many backspaces to send
-                    backspaces = len(abbr) + len(stringAfter)
+                    backspaces = len(typedAbbr) + len(stringAfter)
                 else:
                     backspaces = len(stringAfter)
 
@@ -78,7 +78,7 @@ class FileMonitor(threading.Thread):
         self.notifier = Notifier(self.manager, self.__p)
         self.event = threading.Event()
         self.setDaemon(True)
-        self.watches = []
+        self.watches = set()
         self.__isSuspended = False
         
     def suspend(self):
@@ -91,10 +91,10 @@ class FileMonitor(threading.Thread):
     def __unsuspend(self):
         time.sleep(1.5)
         self.__isSuspended = False
-        for watch in self.watches:
+        for watch in list(self.watches):
             if not os.path.exists(watch):
                 logger.debug("Removed stale watch on %s", watch)
-                self.watches.remove(watch)
+                self.watches.discard(watch)
         
     def is_suspended(self):
         return self.__isSuspended
@@ -105,19 +105,14 @@ class FileMonitor(threading.Thread):
     def add_watch(self, path):
         logger.debug("Adding watch for %s", path)
         self.manager.add_watch(path, MASK, self.__p)
-        self.watches.append(path)
+        self.watches.add(path)
         
     def remove_watch(self, path):
         logger.debug("Removing watch for %s", path)
         wd = self.manager.get_wd(path)
         self.manager.rm_watch(wd, True)
-        self.watches.remove(path)
-        for i in range(len(self.watches)):
-            try:
-                if self.watches[i].startswith(path):
-                    self.watches.remove(self.watches[i])
-            except IndexError:
-                break       
+        self.watches.discard(path)
+        self.watches = {watch for watch in self.watches if not watch.startswith(path)}
         
     def run(self):        
         while not self.event.isSet():
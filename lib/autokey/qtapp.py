@@ -181,6 +181,11 @@ class Application(QApplication):
         self.configManager.config_altered(persistGlobal)
         self.notifier.create_assign_context_menu()
 
+    def items_altered(self, added=(), removed=(), updated=(), persistGlobal=False):
+        """Like config_altered(), but only updates the given folders and items, see ConfigManager.apply_changes()."""
+        self.configManager.apply_changes(added, removed, updated, persistGlobal)
+        self.notifier.create_assign_context_menu()
+
     def hotkey_created(self, item):
         UI_common.hotkey_created(self.service, item)
 
@@ -150,7 +150,7 @@ class CentralWidget(*ui_common.inherits_from_ui_file_with_name("centralwidget"))
 
                 persistGlobal = self.stack.currentWidget().save()
                 self.window().app.monitor.unsuspend()
-                self.window().app.config_altered(persistGlobal)
+                self.window().app.items_altered(updated=[self.__extractData(item)], persistGlobal=persistGlobal)
 
                 self.treeWidget.sortItems(0, Qt.AscendingOrder)
             else:
@@ -229,7 +229,7 @@ class CentralWidget(*ui_common.inherits_from_ui_file_with_name("centralwidget"))
                     new_item = ak_tree.FolderWidgetItem(None, folder)
                     self.treeWidget.addTopLevelItem(new_item)
                     self.configManager.folders.append(folder)
-                    self.window().app.config_altered(True)
+                    self.window().app.items_altered(added=[folder], persistGlobal=True)
 
             self.window().app.monitor.unsuspend()
         else:
@@ -338,7 +338,7 @@ class CentralWidget(*ui_common.inherits_from_ui_file_with_name("centralwidget"))
         tree_widget.setCurrentItem(new_item)
         parent_item.setSelected(False)
         self.on_treeWidget_itemSelectionChanged()
-        self.window().app.config_altered(False)
+        self.window().app.items_altered(added=[new_obj])
 
     def on_cut(self):
         self.cutCopiedItems = self.__getSelection()
@@ -350,7 +350,7 @@ class CentralWidget(*ui_common.inherits_from_ui_file_with_name("centralwidget"))
             self.__removeItem(item)
 
         self.window().app.monitor.unsuspend()
-        self.window().app.config_altered(False)
+        self.window().app.items_altered(removed=self.cutCopiedItems)
 
     def on_paste(self):
         parent_item = self._get_current_treewidget_item()
@@ -377,11 +377,12 @@ class CentralWidget(*ui_common.inherits_from_ui_file_with_name("centralwidget"))
         self.treeWidget.sortItems(0, Qt.AscendingOrder)
         self.treeWidget.setCurrentItem(new_items[-1])
         self.on_treeWidget_itemSelectionChanged()
+        pasted = self.cutCopiedItems
         self.cutCopiedItems = []
         for item in new_items:
             item.setSelected(True)
         self.window().app.monitor.unsuspend()
-        self.window().app.config_altered(False)
+        self.window().app.items_altered(added=pasted)
 
     def on_delete(self):
         widget_items = self.treeWidget.selectedItems()
@@ -406,12 +407,13 @@ class CentralWidget(*ui_common.inherits_from_ui_file_with_name("centralwidget"))
         result = QMessageBox.question(self.window(), header, msg, QMessageBox.Yes | QMessageBox.No)
 
         if result == QMessageBox.Yes:
+            removed = self.__getSelection()
             for widget_item in widget_items:
                 self.__removeItem(widget_item)
 
         self.window().app.monitor.unsuspend()
         if result == QMessageBox.Yes:
-            self.window().app.config_altered(False)
+            self.window().app.items_altered(removed=removed)
 
     def on_rename(self):
         widget_item = self._get_current_treewidget_item()
@@ -422,9 +424,9 @@ class CentralWidget(*ui_common.inherits_from_ui_file_with_name("centralwidget"))
         if self.stack.currentWidget().validate():
             self.window().app.monitor.suspend()
             persist_global = self.stack.currentWidget().save()
-            self.window().save_completed(persist_global)
-            self.set_dirty(False)
             item = self._get_current_treewidget_item()
+            self.window().save_completed(persist_global, self.__extractData(item))
+            self.set_dirty(False)
             item.update()
             self.treeWidget.update()
             self.treeWidget.sortItems(0, Qt.AscendingOrder)
@@ -469,9 +471,11 @@ class CentralWidget(*ui_common.inherits_from_ui_file_with_name("centralwidget"))
 
         self.window().app.monitor.suspend()
 
+        moved = []
         for source in result:
             self.__removeItem(source)
             source_model_item = self.__extractData(source)
+            moved.append(source_model_item)
 
             if isinstance(source_model_item, autokey.model.folder.Folder):
                 target_model_item.add_folder(source_model_item)
@@ -485,7 +489,8 @@ class CentralWidget(*ui_common.inherits_from_ui_file_with_name("centralwidget"))
 
         self.window().app.monitor.unsuspend()
         self.treeWidget.sortItems(0, Qt.AscendingOrder)
-        self.window().app.config_altered(True)
+        # Moved items get the position of their new parent.
+        self.window().app.items_altered(added=moved, removed=moved, persistGlobal=True)
 
     def __moveRecurseUpdate(self, folder):
         folder.path = None
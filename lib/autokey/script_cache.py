@@ -0,0 +1,189 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Cache of the compiled code of user scripts.
+
+Scripts stored in the configuration are looked up by the Script instance and are valid as long as the source code of
+the Script is unchanged. Scripts run by path are valid as long as the modification time and size of the file are
+unchanged, so a cache hit does not read the file. The file monitor also drops the entries of changed files.
+
+Optionally, the compiled code is written to COMPILED_SCRIPTS_DIR, keyed by a hash of the source code, the file name
+and the Python bytecode version. This saves compiling the scripts again after restarting AutoKey. Only the code of the
+last compiled source of each script file is kept there. Scripts without a file, like temporary scripts, are not written.
+"""
+
+import collections
+import hashlib
+import importlib.util
+import marshal
+import os
+import pathlib
+import threading
+import types
+import typing
+
+from autokey import common
+import autokey.model.script
+
+logger = __import__("autokey.logger").logger.get_logger(__name__)
+
+COMPILED_SCRIPTS_DIR = os.path.join(common.DATA_DIR, "compiled_scripts")
+# Number of compiled scripts kept in memory
+COMPILED_CODE_CACHE_SIZE = 256
+# File name used to compile scripts that are not stored in a file
+NO_FILE_NAME = "<string>"
+
+ScriptSource = typing.Union[autokey.model.script.Script, pathlib.Path]
+
+
+class _Entry(typing.NamedTuple):
+    file_name: str
+    # The source code for scripts of the configuration, (modification time, size) of the file for paths
+    validator: typing.Any
+    code: types.CodeType
+
+
+class CompiledCodeCache:
+    """Returns the compiled code of scripts, compiling only scripts that changed since the last call."""
+
+    def __init__(self, persist_dir: str=None, max_size: int=COMPILED_CODE_CACHE_SIZE):
+        self.persist_dir = persist_dir
+        self.max_size = max_size
+        self.__entries = collections.OrderedDict()  # type: typing.MutableMapping[typing.Hashable, _Entry]
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    def get(self, script: ScriptSource) -> types.CodeType:
+        """Return the compiled code of the script. Raises SyntaxError, if the script can not be compiled."""
+        if isinstance(script, pathlib.Path):
+            key = str(script)
+            status = script.stat()
+            validator = (status.st_mtime_ns, status.st_size)
+        elif isinstance(script, autokey.model.script.Script):
+            key = script
+            validator = script.code
+        else:
+            raise TypeError(
+                "Unknown script type passed in, expected one of [autokey.model.Script, pathlib.Path], got {}".format(
+                    type(script)))
+
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and (entry.validator is validator or entry.validator == validator):
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return entry.code
+            self.misses += 1
+
+        source, file_name = get_source_code_and_name(script)
+        code = self.__compile(source, file_name)
+        with self.__lock:
+            self.__entries[key] = _Entry(file_name, validator, code)
+            self.__entries.move_to_end(key)
+            if len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+        return code
+
+    def invalidate(self, path: str=None):
+        """Drop the compiled code of the script file at the given path, or of all scripts if no path is given."""
+        with self.__lock:
+            if path is None:
+                self.__entries.clear()
+                return
+            for key in [key for key, entry in self.__entries.items() if entry.file_name == path]:
+                del self.__entries[key]
+
+    def statistics(self) -> typing.Dict[str, typing.Union[int, float]]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.__entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def reset_statistics(self):
+        self.hits = self.misses = self.disk_hits = 0
+
+    def __compile(self, source: str, file_name: str) -> types.CodeType:
+        if self.persist_dir is None or file_name == NO_FILE_NAME:
+            return compile(source, file_name, "exec")
+        encoded_name = file_name.encode("utf-8", "surrogateescape")
+        # The files of a script file share the prefix, so those of older versions can be found and deleted.
+        prefix = hashlib.sha256(encoded_name).hexdigest() + "-"
+        digest = hashlib.sha256(importlib.util.MAGIC_NUMBER)
+        digest.update(encoded_name + b"\0")
+        digest.update(source.encode("utf-8", "surrogateescape"))
+        cache_file_name = prefix + digest.hexdigest() + ".bin"
+        cache_file = os.path.join(self.persist_dir, cache_file_name)
+        try:
+            with open(cache_file, "rb") as in_file:
+                code = marshal.load(in_file)
+            if isinstance(code, types.CodeType):
+                with self.__lock:
+                    self.disk_hits += 1
+                return code
+        except FileNotFoundError:
+            pass
+        except (OSError, EOFError, ValueError, TypeError):
+            logger.warning("Ignoring unreadable compiled script %s", cache_file)
+
+        code = compile(source, file_name, "exec")
+        try:
+            os.makedirs(self.persist_dir, exist_ok=True)
+            # Written to a temporary file first, so concurrent runs never read a partially written file.
+            temporary_file = "{}.{}.tmp".format(cache_file, threading.get_ident())
+            with open(temporary_file, "wb") as out_file:
+                marshal.dump(code, out_file)
+            os.replace(temporary_file, cache_file)
+        except OSError:
+            logger.exception("Could not store the compiled script in %s", self.persist_dir)
+            return code
+        self.__remove_outdated(prefix, cache_file_name)
+        return code
+
+    def __remove_outdated(self, prefix: str, current: str):
+        """Delete the compiled code of previous versions of the script file, those sharing the prefix."""
+        try:
+            with os.scandir(self.persist_dir) as entries:
+                outdated = [entry.path for entry in entries
+                            if entry.name.startswith(prefix) and entry.name.endswith(".bin") and entry.name != current]
+            for path in outdated:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Deleted by a concurrent run of another version of the script
+                    pass
+        except OSError:
+            logger.exception("Could not delete outdated compiled scripts in %s", self.persist_dir)
+
+
+def get_source_code_and_name(script: ScriptSource) -> typing.Tuple[str, str]:
+    if isinstance(script, pathlib.Path):
+        script_code = script.read_text()
+        script_name = str(script)
+    elif isinstance(script, autokey.model.script.Script):
+        script_code = script.code
+        if script.path is None:
+            script_name = NO_FILE_NAME
+        else:
+            script_name = str(script.path)
+    else:
+        raise TypeError(
+            "Unknown script type passed in, expected one of [autokey.model.Script, pathlib.Path], got {}".format(
+                type(script)))
+    return script_code, script_name
@@ -0,0 +1,374 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Runs user scripts in separate worker processes.
+
+Scripts using the runInProcess option do not run on a thread of the AutoKey process. A CPU-heavy script then does not
+hold the interpreter lock needed by the key press handling, and a hung script can be killed once it exceeds the
+configured timeout.
+
+The worker processes are started once and reused for many runs, so a run does not pay for starting a Python
+interpreter. They are started using the "spawn" method, as forking the multi-threaded AutoKey process is unsafe.
+
+The scripting API objects (keyboard, mouse, window, clipboard, dialog, system, engine, highlevel) and the store of the
+script stay in the AutoKey process. The script gets proxies, which forward method calls over the pipe of its worker.
+Arguments and return values are pickled, so API methods taking or returning configuration objects, like folders, are
+not available in worker processes. Attributes can not be read through the proxies, only methods can be called.
+Scripts running in a worker process can not use ConfigManager without importing it, unlike other scripts.
+"""
+
+import builtins
+import collections
+import collections.abc
+import datetime
+import multiprocessing
+import pathlib
+import pickle
+import sys
+import threading
+import time
+import traceback
+import types
+import typing
+
+from autokey.model.key import Key, KEY_FIND_RE
+
+logger = __import__("autokey.logger").logger.get_logger(__name__)
+
+# Names of the scripting API objects proxied into the worker processes
+API_NAMES = ("keyboard", "mouse", "system", "window", "engine", "dialog", "clipboard", "highlevel", "store")
+# Number of compiled scripts kept by a worker process
+WORKER_CODE_CACHE_SIZE = 64
+# Seconds to wait for a worker process to exit, before it is killed
+WORKER_EXIT_TIMEOUT = 1.0
+
+_main_module_lock = threading.Lock()
+
+
+class ScriptProcessError(Exception):
+    """The script failed in its worker process. The message contains the traceback from the worker."""
+
+
+class ScriptTimeoutError(ScriptProcessError):
+    """The script did not finish in time, its worker process was killed."""
+
+
+class _ApiProxy:
+    """Stands in for a scripting API object in a worker process. Method calls are run by the AutoKey process."""
+
+    def __init__(self, connection, name: str):
+        self._connection = connection
+        self._name = name
+
+    def __getattr__(self, attribute: str):
+        if attribute.startswith("__"):
+            raise AttributeError(attribute)
+
+        def method(*args, **kwargs):
+            return self._call(attribute, *args, **kwargs)
+
+        method.__name__ = attribute
+        return method
+
+    def _call(self, attribute: str, *args, **kwargs):
+        self._connection.send(("call", self._name, attribute, args, kwargs))
+        kind, value = self._connection.recv()
+        if kind == "error":
+            raise value
+        return value
+
+    # Used by the store, special methods are not looked up using __getattr__().
+    def __getitem__(self, key):
+        return self._call("__getitem__", key)
+
+    def __setitem__(self, key, value):
+        self._call("__setitem__", key, value)
+
+    def __delitem__(self, key):
+        self._call("__delitem__", key)
+
+    def __contains__(self, key) -> bool:
+        return self._call("__contains__", key)
+
+    def __len__(self) -> int:
+        return self._call("__len__")
+
+    def __iter__(self):
+        return iter(self._call("keys"))
+
+
+def _worker_main(connection):
+    """Main function of the worker processes. Runs scripts until the pipe is closed."""
+    proxies = {name: _ApiProxy(connection, name) for name in API_NAMES}
+    # Like the namespace scripts get in the AutoKey process, see ScriptRunner. ConfigManager is left out, as
+    # importing it would load most of AutoKey into the worker.
+    scope = {
+        "__builtins__": builtins,
+        "__name__": "autokey.service",
+        "collections": collections,
+        "datetime": datetime,
+        "pathlib": pathlib,
+        "threading": threading,
+        "time": time,
+        "traceback": traceback,
+        "typing": typing,
+        "Key": Key,
+        "KEY_FIND_RE": KEY_FIND_RE,
+        "logger": __import__("autokey.logger").logger.get_logger("autokey.service"),
+    }
+    scope.update(proxies)
+    compiled = collections.OrderedDict()
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if message[0] == "stop":
+            return
+        source, file_name, variables = message[1:]
+        error = None
+        try:
+            code = compiled.get((file_name, source))
+            if code is None:
+                code = compiled[(file_name, source)] = compile(source, file_name, "exec")
+                if len(compiled) > WORKER_CODE_CACHE_SIZE:
+                    compiled.popitem(last=False)
+            namespace = dict(scope)
+            namespace.update(variables)
+            exec(code, namespace)
+        except SystemExit:
+            pass
+        except BaseException:
+            error = traceback.format_exc()
+        connection.send(("done", error))
+
+
+def _transferable(value):
+    """Turn dictionary views, as returned by the store, into lists. Those can be pickled."""
+    if isinstance(value, (collections.abc.KeysView, collections.abc.ValuesView, collections.abc.ItemsView)):
+        return list(value)
+    return value
+
+
+class _Worker:
+
+    def __init__(self, context):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_connection,), name="autokey-script-worker", daemon=True)
+        # Spawned processes import the main module of the parent first. For AutoKey, that is the GUI, which the
+        # workers must not load. Without a file name or module spec, the main module is not imported.
+        with _main_module_lock:
+            main_module = sys.modules["__main__"]
+            sys.modules["__main__"] = types.ModuleType("__main__")
+            try:
+                self.process.start()
+            finally:
+                sys.modules["__main__"] = main_module
+        child_connection.close()
+
+    def run(self, api: typing.Mapping[str, typing.Any], source: str, file_name: str, variables: dict,
+            timeout: typing.Optional[float]):
+        """Run the script, serving its API calls until it finished. Raises ScriptProcessError if it failed."""
+        self.connection.send(("run", source, file_name, variables))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not self.connection.poll(remaining):
+                self.kill()
+                raise ScriptTimeoutError("The script did not finish within {} seconds and was killed.".format(timeout))
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError):
+                self.kill()
+                raise ScriptProcessError("The worker process running the script exited unexpectedly.")
+            if message[0] == "done":
+                if message[1] is not None:
+                    raise ScriptProcessError(message[1])
+                return
+            self.__serve(api, *message[1:])
+
+    def __serve(self, api: typing.Mapping[str, typing.Any], name: str, attribute: str, args: tuple, kwargs: dict):
+        try:
+            reply = ("result", _transferable(getattr(api[name], attribute)(*args, **kwargs)))
+        except Exception as e:
+            reply = ("error", e)
+        try:
+            self.connection.send(reply)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            self.connection.send(("error", RuntimeError(
+                "The result of {}.{}() can not be passed to a script running in a separate process: {!r}".format(
+                    name, attribute, reply[1]))))
+
+    @property
+    def alive(self) -> bool:
+        return self.process.is_alive()
+
+    def stop(self):
+        try:
+            self.connection.send(("stop",))
+        except (OSError, ValueError):
+            pass
+        self.process.join(WORKER_EXIT_TIMEOUT)
+        if self.process.is_alive():
+            self.kill()
+        self.connection.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(WORKER_EXIT_TIMEOUT)
+
+
+class ScriptProcessPool:
+    """
+    Keeps up to size warm worker processes. Each run takes an idle worker or starts a new one, if fewer than size
+    workers exist. Otherwise the run waits for a worker to become idle. Workers killed after a timeout are replaced in
+    the background.
+
+    Starting a worker takes a while, so it is never done holding the condition. A slot is reserved by counting the
+    worker as starting, then the worker is started and added to the idle or busy workers, see __spawn().
+    """
+
+    def __init__(self, size: int, timeout: typing.Optional[float]):
+        self.size = size
+        # Seconds a script may run, None for no limit
+        self.timeout = timeout
+        self.__context = multiprocessing.get_context("spawn")
+        self.__idle = []  # type: typing.List[_Worker]
+        self.__busy = set()  # type: typing.Set[_Worker]
+        # Number of workers being started
+        self.__starting = 0
+        self.__condition = threading.Condition()
+        self.__shutdown = False
+        self.runs = 0
+        self.timeouts = 0
+
+    def start(self):
+        """Start all workers, so the first runs do not wait for an interpreter to start."""
+        with self.__condition:
+            missing = 0 if self.__shutdown else self.size - len(self.__idle) - len(self.__busy) - self.__starting
+            missing = max(0, missing)
+            self.__starting += missing
+        for _ in range(missing):
+            self.__spawn(busy=False)
+
+    def run(self, api: typing.Mapping[str, typing.Any], source: str, file_name: str, variables: dict=None):
+        """
+        Run the script source in a worker process. api maps the names in API_NAMES to the objects whose methods the
+        proxies call. variables are added to the namespace of the script and must be picklable.
+        Raises ScriptProcessError, if the script failed, and ScriptTimeoutError, if it was killed.
+        """
+        worker = self.__checkout()
+        try:
+            with self.__condition:
+                self.runs += 1
+            worker.run(api, source, file_name, variables or {}, self.timeout)
+        except ScriptTimeoutError:
+            with self.__condition:
+                self.timeouts += 1
+            raise
+        finally:
+            self.__checkin(worker)
+
+    def kill_running(self) -> int:
+        """Kill the workers running a script. Returns their number."""
+        with self.__condition:
+            busy = list(self.__busy)
+        for worker in busy:
+            worker.kill()
+        return len(busy)
+
+    def shutdown(self):
+        """Stop the idle workers and kill the workers still running a script."""
+        with self.__condition:
+            self.__shutdown = True
+            idle, self.__idle = self.__idle, []
+            self.__condition.notify_all()
+        self.kill_running()
+        for worker in idle:
+            worker.stop()
+
+    def statistics(self) -> typing.Dict[str, int]:
+        with self.__condition:
+            return {
+                "workers": len(self.__idle) + len(self.__busy),
+                "busy": len(self.__busy),
+                "runs": self.runs,
+                "timeouts": self.timeouts,
+            }
+
+    def __checkout(self) -> _Worker:
+        with self.__condition:
+            while True:
+                if self.__shutdown:
+                    raise ScriptProcessError("The script worker processes are shut down.")
+                while self.__idle:
+                    worker = self.__idle.pop()
+                    if worker.alive:
+                        self.__busy.add(worker)
+                        return worker
+                    worker.connection.close()
+                if len(self.__busy) + self.__starting < self.size:
+                    self.__starting += 1
+                    break
+                self.__condition.wait()
+        worker = self.__spawn(busy=True)
+        if worker is None:
+            raise ScriptProcessError("The script worker processes are shut down.")
+        return worker
+
+    def __checkin(self, worker: _Worker):
+        with self.__condition:
+            self.__busy.discard(worker)
+            if worker.alive and not self.__shutdown:
+                self.__idle.append(worker)
+                self.__condition.notify()
+                return
+            worker.connection.close()
+            if self.__shutdown:
+                return
+            self.__starting += 1
+        # Replace the killed worker, so the next run finds a warm one. Started in the background, so the caller of
+        # run() gets the result of its script without waiting for the new interpreter.
+        threading.Thread(target=self.__replace, name="autokey-script-worker-start", daemon=True).start()
+
+    def __replace(self):
+        try:
+            self.__spawn(busy=False)
+        except Exception:
+            logger.exception("Could not start a script worker process")
+
+    def __spawn(self, busy: bool) -> typing.Optional[_Worker]:
+        """
+        Start a worker in a slot reserved by incrementing __starting, then add it to the busy or idle workers. Must be
+        called without holding the condition. Returns None, if the pool was shut down meanwhile.
+        """
+        worker = None
+        try:
+            worker = _Worker(self.__context)
+        finally:
+            with self.__condition:
+                self.__starting -= 1
+                shutdown = self.__shutdown
+                if worker is not None and not shutdown:
+                    if busy:
+                        self.__busy.add(worker)
+                    else:
+                        self.__idle.append(worker)
+                # Wakes up a run waiting for the new worker, or for the slot, if starting the worker failed.
+                self.__condition.notify()
+        if shutdown:
+            worker.stop()
+            return None
+        return worker
@@ -15,17 +15,20 @@
 
 """Engine backend for Autokey"""
 
+import contextlib
 import pathlib
+import threading
 
 from collections.abc import Iterable
 
-from typing import Tuple, Optional, List, Union
+from typing import Tuple, Optional, List, Union, Dict, Any
 
 import autokey.model.folder
 import autokey.model.helpers
 import autokey.model.phrase
 import autokey.model.script
 from autokey import configmanager
+from autokey.configmanager.hotkey_index import make_key
 from autokey.model.key import Key
 
 from autokey.scripting.system import System
@@ -53,6 +56,8 @@ class Engine:
         self._script_kwargs = {}
         self._return_value = ''
         self._triggered_abbreviation = None  # type: Optional[str]
+        # Holds the batch started by batch() in the current thread.
+        self._local = threading.local()
 
     def get_folder(self, title: str):
         """
@@ -231,19 +236,18 @@ Folders created within temporary folders must themselves be set temporary")
 
         if abbreviations and isinstance(abbreviations, str):
             abbreviations = [abbreviations]
-        check_abbreviation_unique(self.configManager, abbreviations, window_filter)
+        batch = self._current_batch()
+        check_abbreviation_unique(self.configManager, abbreviations, window_filter, batch)
 
+        cleared_items = []
         if not replace_existing_hotkey:
-            check_hotkey_unique(self.configManager, hotkey, window_filter)
+            check_hotkey_unique(self.configManager, hotkey, window_filter, batch)
         else:
             # XXX If something causes the phrase creation to fail after this,
             # this will unset the hotkey without replacing it.
-            self.__clear_existing_hotkey(hotkey, window_filter)
+            cleared_items = self.__clear_existing_hotkey(hotkey, window_filter)
 
-
-
-        self.monitor.suspend()
-        try:
+        with self.__creating_items(cleared_items) as created:
             p = autokey.model.phrase.Phrase(name, contents)
             if send_mode in autokey.model.phrase.SendMode:
                 p.sendMode = send_mode
@@ -258,21 +262,103 @@ Folders created within temporary folders must themselves be set temporary")
             p.temporary = temporary
 
             folder.add_item(p)
+            created.append((folder, p))
             # Don't save a json if it is a temporary hotkey. Won't persist across
             # reloads.
             if not temporary:
                 p.persist()
             return p
+
+    def create_phrases(self, phrases):
+        """
+        Create many text phrases at once. Each element of phrases is a dictionary containing the arguments of
+        C{engine.create_phrase()}. The phrases are validated against each other and against the existing
+        configuration. If one of them is invalid, none of them are created.
+
+        Usage: C{engine.create_phrases([{"folder": folder, "name": "Phrase", "contents": "ABC", "abbreviations": "abc"}])}
+
+        @param phrases: iterable of dictionaries with the keyword arguments for C{engine.create_phrase()}
+        @raise ValueError: If a given abbreviation or hotkey is already in use or parameters are otherwise invalid
+        @return A list with the created Phrase objects. See C{engine.create_phrase()}.
+        """
+        with self.batch():
+            return [self.create_phrase(**arguments) for arguments in phrases]
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Group the creation of many phrases. Inside the batch, C{engine.create_phrase()} validates the new phrases
+        against the existing configuration and the phrases created earlier in the same batch, and writes the files.
+        The new phrases become active all at once, when the batch ends. This is much faster than creating the phrases
+        one by one, for example in rc-style scripts defining hundreds of temporary phrases.
+
+        If an exception leaves the batch, all phrases created inside it are removed again and hotkeys cleared by
+        replace_existing_hotkey are restored. Nested batches are part of the outermost batch.
+
+        Usage:
+        C{
+        with engine.batch():
+            engine.create_phrase(folder, "Phrase 1", "ABC", abbreviations="abc")
+            engine.create_phrase(folder, "Phrase 2", "DEF", abbreviations="def")
+        }
+        """
+        if self._current_batch() is not None:
+            yield
+            return
+
+        batch = self._local.batch = _Batch()
+        self.monitor.suspend()
+        succeeded = False
+        try:
+            yield
+            succeeded = True
         finally:
+            self._local.batch = None
+            if not succeeded:
+                batch.rollback()
             self.monitor.unsuspend()
-            self.configManager.config_altered(False)
+            if succeeded:
+                self.configManager.apply_changes(added=batch.added_items(), updated=batch.cleared_items())
+
+    def _current_batch(self) -> Optional["_Batch"]:
+        return getattr(self._local, "batch", None)
+
+    @contextlib.contextmanager
+    def __creating_items(self, cleared_items=()):
+        """
+        Suspend the file monitor while new items are written, then add them to the configuration. The body appends
+        (folder, item) tuples to the yielded list. Inside batch(), the items are recorded in the batch instead.
+        """
+        created = []  # type: List[Tuple[autokey.model.folder.Folder, Any]]
+        batch = self._current_batch()
+        if batch is not None:
+            try:
+                yield created
+            finally:
+                for folder, item in created:
+                    batch.add(folder, item)
+            return
 
+        self.monitor.suspend()
+        try:
+            yield created
+        finally:
+            self.monitor.unsuspend()
+            added = [item for folder, item in created if item.parent is folder]
+            self.configManager.apply_changes(added=added, updated=cleared_items)
 
     def __clear_existing_hotkey(self, hotkey, window_filter):
+        """Unset the given hotkey on the item currently using it. Returns the changed items."""
         existing_item = self.get_item_with_hotkey(hotkey)
         if existing_item and not isinstance(existing_item, configmanager.configmanager.GlobalHotkey):
             if existing_item.filter_matches(window_filter):
-                existing_item.unset_hotkey()
+                batch = self._current_batch()
+                if batch is not None:
+                    batch.clear_hotkey(existing_item)
+                else:
+                    existing_item.unset_hotkey()
+                return [existing_item]
+        return []
 
     def create_abbreviation(self, folder, description, abbr, contents):
         """
@@ -290,17 +376,18 @@ Folders created within temporary folders must themselves be set temporary")
         @param contents: the expansion text
         @raise Exception: if the specified abbreviation is not unique
         """
-        if not self.configManager.check_abbreviation_unique(abbr, None, None)[0]:
+        batch = self._current_batch()
+        if not self.configManager.check_abbreviation_unique(abbr, None, None)[0] or \
+                (batch is not None and batch.item_with_abbreviation(abbr, None) is not None):
             raise Exception("The specified abbreviation is already in use")
 
-        self.monitor.suspend()
-        p = autokey.model.phrase.Phrase(description, contents)
-        p.modes.append(autokey.model.helpers.TriggerMode.ABBREVIATION)
-        p.abbreviations = [abbr]
-        folder.add_item(p)
-        p.persist()
-        self.monitor.unsuspend()
-        self.configManager.config_altered(False)
+        with self.__creating_items() as created:
+            p = autokey.model.phrase.Phrase(description, contents)
+            p.modes.append(autokey.model.helpers.TriggerMode.ABBREVIATION)
+            p.abbreviations = [abbr]
+            folder.add_item(p)
+            created.append((folder, p))
+            p.persist()
 
     def create_hotkey(self, folder, description, modifiers, key, contents):
         """
@@ -331,17 +418,18 @@ Folders created within temporary folders must themselves be set temporary")
         @raise Exception: if the specified hotkey is not unique
         """
         modifiers.sort()
-        if not self.configManager.check_hotkey_unique(modifiers, key, None, None)[0]:
+        batch = self._current_batch()
+        if not self.configManager.check_hotkey_unique(modifiers, key, None, None)[0] or \
+                (batch is not None and batch.item_with_hotkey(modifiers, key, None) is not None):
             raise Exception("The specified hotkey and modifier combination is already in use")
 
-        self.monitor.suspend()
-        p = autokey.model.phrase.Phrase(description, contents)
-        p.modes.append(autokey.model.helpers.TriggerMode.HOTKEY)
-        p.set_hotkey(modifiers, key)
-        folder.add_item(p)
-        p.persist()
-        self.monitor.unsuspend()
-        self.configManager.config_altered(False)
+        with self.__creating_items() as created:
+            p = autokey.model.phrase.Phrase(description, contents)
+            p.modes.append(autokey.model.helpers.TriggerMode.HOTKEY)
+            p.set_hotkey(modifiers, key)
+            folder.add_item(p)
+            created.append((folder, p))
+            p.persist()
 
     def run_script(self, description, *args, **kwargs):
         """
@@ -492,7 +580,74 @@ Folders created within temporary folders must themselves be set temporary")
         if not hotkey:
             return
         modifiers = sorted(hotkey[0])
-        return self.configManager.get_item_with_hotkey(modifiers, hotkey[1])
+        item = self.configManager.get_item_with_hotkey(modifiers, hotkey[1])
+        batch = self._current_batch()
+        if item is None and batch is not None:
+            item = batch.item_with_hotkey(modifiers, hotkey[1])
+        return item
+
+
+class _Batch:
+    """
+    Items created inside Engine.batch(). They are not part of the configuration until the batch ends, so the batch
+    indexes their abbreviations and hotkeys itself.
+    """
+
+    def __init__(self):
+        self.created = []  # type: List[Tuple[autokey.model.folder.Folder, Any]]
+        # Items whose hotkey was cleared, with their previous modifiers and hotkey
+        self.cleared = []  # type: List[Tuple[Any, list, Any]]
+        self.abbreviations = {}  # type: Dict[str, list]
+        self.hotkeys = {}  # type: Dict[Tuple[Tuple[str, ...], str], list]
+
+    def add(self, folder, item):
+        self.created.append((folder, item))
+        for abbreviation in item.abbreviations:
+            self.abbreviations.setdefault(abbreviation, []).append(item)
+        if item.hotKey is not None:
+            self.hotkeys.setdefault(make_key(item.modifiers, item.hotKey), []).append(item)
+
+    def clear_hotkey(self, item):
+        self.cleared.append((item, list(item.modifiers), item.hotKey))
+        item.unset_hotkey()
+
+    def item_with_abbreviation(self, abbreviation, window_filter):
+        for item in self.abbreviations.get(abbreviation, ()):
+            if configmanager.configmanager.ConfigManager.item_has_abbreviation(item, abbreviation) and \
+                    item.filter_matches(window_filter):
+                return item
+        return None
+
+    def item_with_hotkey(self, modifiers, key, window_filter=None):
+        for item in self.hotkeys.get(make_key(modifiers, key), ()):
+            if autokey.model.helpers.TriggerMode.HOTKEY in item.modes and \
+                    configmanager.configmanager.ConfigManager.item_has_same_hotkey(item, modifiers, key, window_filter):
+                return item
+        return None
+
+    def added_items(self) -> list:
+        """Return the created items still attached to their folder."""
+        attached = {}  # type: Dict[int, set]
+        added = []
+        for folder, item in self.created:
+            if id(folder) not in attached:
+                attached[id(folder)] = {id(child) for child in folder.items}
+            if item.parent is folder and id(item) in attached[id(folder)]:
+                added.append(item)
+        return added
+
+    def cleared_items(self) -> list:
+        return [item for item, modifiers, hotkey in self.cleared]
+
+    def rollback(self):
+        """Remove the created items from their folders and restore the cleared hotkeys."""
+        for folder, item in reversed(self.created):
+            if item in folder.items:
+                folder.remove_item(item)
+            if not item.temporary:
+                item.remove_data()
+        for item, modifiers, hotkey in reversed(self.cleared):
+            item.set_hotkey(modifiers, hotkey)
 
 
 def validateAbbreviations(abbreviations):
@@ -518,34 +673,38 @@ def validateAbbreviations(abbreviations):
             )
 
 
-def check_abbreviation_unique(configmanager, abbreviations, window_filter):
+def check_abbreviation_unique(configmanager, abbreviations, window_filter, batch=None):
     """
     Checks if the given abbreviations are unique
 
     @param configmanager: ConfigManager Instance to check abbrevations
     @param abbreviations: List of abbreviations to be checked
     @param window_filter: Window filter that the abbreviation will apply to.
+    @param batch: The current Engine batch, if any. Items created in it are checked as well.
     @raise ValueError: Raises C{ValueError} if an abbreviation is already in use.
     """
     if not abbreviations:
         return
     for abbr in abbreviations:
-        if not configmanager.check_abbreviation_unique(abbr, window_filter, None)[0]:
+        if not configmanager.check_abbreviation_unique(abbr, window_filter, None)[0] or \
+                (batch is not None and batch.item_with_abbreviation(abbr, window_filter) is not None):
             raise ValueError("The specified abbreviation '{}' is already in use.".format(abbr))
 
 
-def check_hotkey_unique(configmanager, hotkey, window_filter):
+def check_hotkey_unique(configmanager, hotkey, window_filter, batch=None):
     """
     Checks if the given hotkey is unique
 
     @param configmanager: ConfigManager Instance used to check hotkey
     @param hotkey: hotkey to be check if unique
     @param window_filter: Window filter to be applied to the hotkey
+    @param batch: The current Engine batch, if any. Items created in it are checked as well.
     """
     if not hotkey:
         return
     modifiers = sorted(hotkey[0])
-    if not configmanager.check_hotkey_unique(modifiers, hotkey[1], window_filter, None)[0]:
+    if not configmanager.check_hotkey_unique(modifiers, hotkey[1], window_filter, None)[0] or \
+            (batch is not None and batch.item_with_hotkey(modifiers, hotkey[1], window_filter) is not None):
         raise ValueError("The specified hotkey and modifier combination is already in use: {}".format(hotkey))
 
 
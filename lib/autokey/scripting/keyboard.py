@@ -68,10 +68,9 @@ class Keyboard:
         Usage: C{keyboard.send_key(key, repeat=1)}
 
         @param key: the key to be sent (e.g. "s" or "<enter>")
-        @param repeat: number of times to repeat the key event
+        @param repeat: number of times to repeat the key event. The repeated events are sent as a single operation.
         """
-        for _ in range(repeat):
-            self.mediator.send_key(key)
+        self.mediator.send_key(key, repeat)
         self.mediator.flush()
 
     def press_key(self, key):
@@ -17,6 +17,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import builtins
 import collections
 import datetime
 import pathlib
@@ -36,24 +37,38 @@ from autokey.macro import MacroManager
 
 import autokey.scripting
 from autokey.configmanager.configmanager import ConfigManager, save_config
+from autokey.configmanager.abbreviation_index import AbbreviationMatcher
+from autokey.model.abstract_abbreviation import AbbreviationMatch, InputBuffer
 import autokey.configmanager.configmanager_constants as cm_constants
+from autokey.script_cache import CompiledCodeCache, COMPILED_SCRIPTS_DIR, get_source_code_and_name
+from autokey.script_processes import ScriptProcessPool
+from autokey.worker_pool import WorkerPool
 
 logger = __import__("autokey.logger").logger.get_logger(__name__)
 MAX_STACK_LENGTH = 150
+# Lane of the worker pool used by all phrase expansions, so that they are typed one after the other
+PHRASE_LANE = "phrases"
 
 
-def threaded(f):
+def pooled(lane: typing.Callable[..., typing.Hashable]=None):
+    """
+    Run the decorated method on the worker pool of the object (its workerPool attribute) instead of the calling thread.
+    Runs with the same lane, as returned by lane(self, *args, **kwargs), run one after the other. The decorated method
+    returns the queued autokey.worker_pool.Run, which can be cancelled until it starts.
+    """
+
+    def decorator(f):
 
-    def wrapper(*args, **kwargs):
-        t = threading.Thread(target=f, args=args, kwargs=kwargs, name="Phrase-thread")
-        t.setDaemon(False)
-        t.start()
+        def wrapper(self, *args, **kwargs):
+            return self.workerPool.submit(
+                f, (self,) + args, kwargs, lane=None if lane is None else lane(self, *args, **kwargs))
 
-    wrapper.__name__ = f.__name__
-    wrapper.__dict__ = f.__dict__
-    wrapper.__doc__ = f.__doc__
-    wrapper._original = f  # Store the original function for unit testing purposes.
-    return wrapper
+        wrapper.__name__ = f.__name__
+        wrapper.__dict__ = f.__dict__
+        wrapper.__doc__ = f.__doc__
+        wrapper._original = f  # Store the original function for unit testing purposes.
+        return wrapper
+    return decorator
 
 
 def synchronized(lock):
@@ -83,9 +98,24 @@ class Service:
         self.mediator = None
         self.app = app
         self.inputStack = collections.deque(maxlen=MAX_STACK_LENGTH)
+        # Follows the inputStack character by character, yielding the abbreviations that can match at its end.
+        # It also keeps the case-folded input characters.
+        self.abbreviationMatcher = AbbreviationMatcher(maxlen=MAX_STACK_LENGTH)
         self.lastStackState = ''
         self.lastMenu = None
         self.name = None
+        # Runs scripts and the items selected from menus
+        self.workerPool = WorkerPool(ConfigManager.SETTINGS[cm_constants.WORKER_POOL_SIZE])
+        # Runs phrase expansions on a worker of their own, so phrases are expanded even while the workers of the
+        # workerPool are all busy running scripts.
+        self.phrasePool = WorkerPool(1, "Phrase")
+        # Compiled code of the scripts. Entries of changed script files are dropped by path_changed().
+        self.compiledScripts = CompiledCodeCache(
+            COMPILED_SCRIPTS_DIR if ConfigManager.SETTINGS[cm_constants.PERSIST_COMPILED_SCRIPTS] else None)
+        # Runs the scripts using the runInProcess option. The worker processes are started by start(), if needed.
+        self.scriptProcesses = ScriptProcessPool(
+            ConfigManager.SETTINGS[cm_constants.SCRIPT_PROCESS_POOL_SIZE],
+            ConfigManager.SETTINGS[cm_constants.SCRIPT_PROCESS_TIMEOUT] or None)
 
     def start(self):
         self.mediator = IoMediator(self)
@@ -93,7 +123,10 @@ class Service:
         self.mediator.interface.start()
         self.mediator.start()
         ConfigManager.SETTINGS[cm_constants.SERVICE_RUNNING] = True
-        self.scriptRunner = ScriptRunner(self.mediator, self.app)
+        self.scriptRunner = ScriptRunner(
+            self.mediator, self.app, self.workerPool, self.compiledScripts, self.scriptProcesses)
+        if any(getattr(item, "run_in_process", False) for item in self.configManager.allItems):
+            self.scriptProcesses.start()
         self.phraseRunner = PhraseRunner(self)
         autokey.model.store.Store.GLOBALS.update(ConfigManager.SETTINGS[cm_constants.SCRIPT_GLOBALS])
         logger.info("Service now marked as running")
@@ -111,6 +144,9 @@ class Service:
 
     def shutdown(self, save=True):
         logger.info("Service shutting down")
+        self.scriptProcesses.shutdown()
+        self.workerPool.shutdown()
+        self.phrasePool.shutdown()
         if self.mediator is not None: self.mediator.shutdown()
         if save:
             save_config(self.configManager)
@@ -118,7 +154,7 @@ class Service:
 
     def handle_mouseclick(self, rootX, rootY, relX, relY, button, windowTitle):
         # logger.debug("Received mouse click - resetting buffer")
-        self.inputStack.clear()
+        self.__clearInput()
 
         logger.log(level=9, msg="Mouse click at root:("+str(rootX)+", "+str(rootY)+") Relative:("+str(relX)+","+str(relY)+") Button: "+str(button)+" In window: "+str(windowTitle))
         # If we had a menu and receive a mouse click, means we already
@@ -131,18 +167,22 @@ class Service:
     def handle_keypress(self, rawKey, modifiers, key, window_info):
         logger.debug("Raw key: %r, modifiers: %r, Key: %s", rawKey, modifiers, key)
         logger.debug("Window visible title: %r, Window class: %r" % window_info)
-        self.configManager.lock.acquire()
-
+        # The snapshot is immutable and replaced as a whole on configuration changes, so no locking is needed.
+        snapshot = self.configManager.snapshot
+        hotkeyIndex = snapshot.hotkey_index
         # Always check global hotkeys
-        for hotkey in self.configManager.globalHotkeys:
+        for hotkey in hotkeyIndex.global_hotkeys(modifiers, rawKey):
             hotkey.check_hotkey(modifiers, rawKey, window_info)
 
         if self.__shouldProcess(window_info):
             itemMatch = None
             menu = None
+            # Only the hotkeys and abbreviations whose window filter matches the active window.
+            windowItems = snapshot.window_filters.get(window_info)
 
-            for item in self.configManager.hotKeys:
-                if item.check_hotkey(modifiers, rawKey, window_info):
+            # Items using this hotkey, the most specific window filter first.
+            for item in hotkeyIndex.dispatch_items(modifiers, rawKey):
+                if item in windowItems:
                     itemMatch = item
                     break
 
@@ -154,8 +194,8 @@ class Service:
                     menu = ([], [itemMatch])
 
             else:
-                for folder in self.configManager.hotKeyFolders:
-                    if folder.check_hotkey(modifiers, rawKey, window_info):
+                for folder in hotkeyIndex.dispatch_folders(modifiers, rawKey):
+                    if folder in windowItems:
                         #menu = PopupMenu(self, [folder], [])
                         menu = ([folder], [])
 
@@ -171,7 +211,6 @@ class Service:
                 self.app.show_popup_menu(*menu)
 
             if itemMatch is not None:
-                self.__tryReleaseLock()
                 self.__processItem(itemMatch)
 
 
@@ -180,27 +219,31 @@ class Service:
             modifierCount = len(modifiers)
 
             if modifierCount > 1 or (modifierCount == 1 and Key.SHIFT not in modifiers):
-                self.inputStack.clear()
-                self.__tryReleaseLock()
+                self.__clearInput()
                 return
 
             ### --- end of processing if non-printing modifiers are on --- ###
 
-            if self.__updateStack(key):
-                currentInput = ''.join(self.inputStack)
-                item, menu = self.__checkTextMatches([], self.configManager.abbreviations,
-                                                    currentInput, window_info, True)
-                if not item or menu:
-                    item, menu = self.__checkTextMatches(
-                        self.configManager.allFolders,
-                        self.configManager.allItems,
-                        currentInput, window_info)  # type: autokey.model.phrase.Phrase, list
+            if self.__updateStack(key, snapshot.abbreviation_index):
+                # Only folders and items having an abbreviation ending at the end of the input can match.
+                folders, items = self.abbreviationMatcher.candidates()
+                if folders or items:
+                    folders = [folder for folder in folders if folder in windowItems]
+                    items = [item for item in items if item in windowItems]
+                item = menu = match = None
+                if folders or items:
+                    # The matcher already holds the case-folded input, so case insensitive items need not fold it.
+                    currentInput = InputBuffer(''.join(self.inputStack), self.abbreviationMatcher.folded_chars())
+                    item, menu, match = self.__checkTextMatches([], items, currentInput, window_info, True)
+                    if not item or menu:
+                        item, menu, match = self.__checkTextMatches(
+                            folders, items, currentInput, window_info
+                        )  # type: autokey.model.phrase.Phrase, list, AbbreviationMatch
 
                 if item:
-                    self.__tryReleaseLock()
                     logger.info('Matched {} "{}" having abbreviations "{}" against current input'.format(
                         item.__class__.__name__, item.description, item.abbreviations))
-                    self.__processItem(item, currentInput)
+                    self.__processItem(item, currentInput, match)
                 elif menu:
                     if self.lastMenu is not None:
                         #self.lastMenu.remove_from_desktop()
@@ -209,16 +252,12 @@ class Service:
                     #self.lastMenu.show_on_desktop()
                     self.app.show_popup_menu(*menu)
 
-                logger.debug("Input queue at end of handle_keypress: %s", self.inputStack)
+                logger.debug("Input queue at end of handle_keypress: %s, matcher step took %d ns",
+                             self.inputStack, self.abbreviationMatcher.last_step_ns)
 
-        self.__tryReleaseLock()
-
-    def __tryReleaseLock(self):
-        try:
-            if self.configManager.lock.locked():
-                self.configManager.lock.release()
-        except:
-            logger.exception("Ignored locking error in handle_keypress")
+    def path_changed(self, path: str):
+        """Called by the file monitor, when a file in the configuration directory was changed or removed."""
+        self.compiledScripts.invalidate(path)
 
     def run_folder(self, name):
         folder = None
@@ -252,7 +291,7 @@ class Service:
 
         raise Exception("No %s found with name '%s'" % (typeDescription, name))
 
-    @threaded
+    @pooled()
     def item_selected(self, item):
         time.sleep(0.25)  # wait for window to be active
         self.lastMenu = None # if an item has been selected, the menu has been hidden
@@ -270,11 +309,12 @@ class Service:
             extraKeys = ''
         return extraBs, extraKeys
 
-    def __updateStack(self, key):
+    def __updateStack(self, key, abbreviationIndex):
         """
         Update the input stack in non-hotkey mode, and determine if anything
         further is needed.
 
+        @param abbreviationIndex: the abbreviation index of the current configuration snapshot
         @return: True if further action is needed
         """
         #if self.lastMenu is not None:
@@ -297,6 +337,7 @@ class Service:
                 # handle backspace by dropping the last saved character
                 try:
                     self.inputStack.pop()
+                    self.abbreviationMatcher.pop()
                 except IndexError:
                     # in case self.inputStack is empty
                     pass
@@ -305,32 +346,43 @@ class Service:
 
         elif len(key) > 1:
             # non-simple key
-            self.inputStack.clear()
+            self.__clearInput()
             self.phraseRunner.clear_last()
             return False
         else:
             # Key is a character
             self.phraseRunner.clear_last()
+            # The configuration may have changed since the last key press. If so, rebuild the matcher state first.
+            self.abbreviationMatcher.set_index(abbreviationIndex, self.inputStack)
             # if len(self.inputStack) == MAX_STACK_LENGTH, front items will removed for appending new items.
             self.inputStack.append(key)
+            self.abbreviationMatcher.push(key)
             return True
 
+    def __clearInput(self):
+        self.inputStack.clear()
+        self.abbreviationMatcher.clear()
+
     def __checkTextMatches(self, folders, items, buffer, windowInfo, immediate=False):
         """
         Check for an abbreviation/predictive match among the given folder and items
         (scripts, phrases).
 
-        @return: a tuple possibly containing an item to execute, or a menu to show
+        @return: a tuple possibly containing an item to execute together with how its abbreviation matched the input,
+        or a menu to show
         """
         itemMatches = []
         folderMatches = []
+        abbreviationMatch = None
 
         for item in items:
-            if item.check_input(buffer, windowInfo):
+            match = item.match_input(buffer, windowInfo)
+            if match is not None:
                 if not item.prompt and immediate:
-                    return item, None
+                    return item, None, match
                 else:
                     itemMatches.append(item)
+                    abbreviationMatch = match
 
         for folder in folders:
             if folder.check_input(buffer, windowInfo):
@@ -340,12 +392,12 @@ class Service:
         if self.__menuRequired(folderMatches, itemMatches, buffer):
             self.lastStackState = buffer
             #return (None, PopupMenu(self, folderMatches, itemMatches))
-            return None, (folderMatches, itemMatches)
+            return None, (folderMatches, itemMatches), None
         elif len(itemMatches) == 1:
             self.lastStackState = buffer
-            return itemMatches[0], None
+            return itemMatches[0], None, abbreviationMatch
         else:
-            return None, None
+            return None, None, None
 
 
     def __shouldProcess(self, windowInfo):
@@ -354,14 +406,14 @@ class Service:
         """
         return windowInfo[0] != "Set Abbreviations" and self.is_running()
 
-    def __processItem(self, item, buffer=''):
-        self.inputStack.clear()
+    def __processItem(self, item, buffer='', match: AbbreviationMatch=None):
+        self.__clearInput()
         self.lastStackState = ''
 
         if isinstance(item, autokey.model.phrase.Phrase):
-            self.phraseRunner.execute(item, buffer)
+            self.phraseRunner.execute(item, buffer, match)
         else:
-            self.scriptRunner.execute_script(item, buffer)
+            self.scriptRunner.execute_script(item, buffer, match)
 
 
 
@@ -394,19 +446,21 @@ class PhraseRunner:
 
     def __init__(self, service: Service):
         self.service = service
+        self.workerPool = service.phrasePool
         self.macroManager = MacroManager(service.scriptRunner.engine)
         self.lastExpansion = None
         self.lastPhrase = None
         self.lastBuffer = None
+        # How the abbreviation of the last phrase matched the input. Used to undo the expansion.
+        self.lastMatch = None  # type: typing.Optional[AbbreviationMatch]
         self.contains_special_keys = False
 
-    @threaded
-    #@synchronized(iomediator.SEND_LOCK)
-    def execute(self, phrase: autokey.model.phrase.Phrase, buffer=''):
+    @pooled(lambda runner, *args, **kwargs: PHRASE_LANE)
+    def execute(self, phrase: autokey.model.phrase.Phrase, buffer='', match: AbbreviationMatch=None):
         mediator = self.service.mediator  # type: IoMediator
         mediator.interface.begin_send()
         try:
-            expansion = phrase.build_phrase(buffer)
+            expansion = phrase.build_phrase(buffer, match)
             expansion.string = \
                     self.macroManager.process_expansion_macros(expansion.string)
 
@@ -420,6 +474,7 @@ class PhraseRunner:
             self.lastExpansion = expansion
             self.lastPhrase = phrase
             self.lastBuffer = buffer
+            self.lastMatch = match
         finally:
             mediator.interface.finish_send()
 
@@ -445,11 +500,12 @@ class PhraseRunner:
     def clear_last(self):
         self.lastExpansion = None
         self.lastPhrase = None
+        self.lastMatch = None
 
     # @synchronized(iomediator.SEND_LOCK) #TODO_PY3 commented this
     def undo_expansion(self):
         logger.info("Undoing last phrase expansion")
-        replay = self.lastPhrase.get_trigger_chars(self.lastBuffer)
+        replay = self.lastPhrase.get_trigger_chars(self.lastBuffer, self.lastMatch)
         logger.debug("Replay string: %s", replay)
         logger.debug("Erase string: %r", self.lastExpansion.string)
         mediator = self.service.mediator  # type: IoMediator
@@ -466,11 +522,33 @@ class PhraseRunner:
 
 class ScriptRunner:
 
-    def __init__(self, mediator: IoMediator, app):
+    def __init__(self, mediator: IoMediator, app, workerPool: WorkerPool, compiledScripts: CompiledCodeCache,
+                 scriptProcesses: ScriptProcessPool):
         self.mediator = mediator
         self.app = app
+        self.workerPool = workerPool
+        self.compiledScripts = compiledScripts
+        self.scriptProcesses = scriptProcesses
         self.error_records = []  # type: typing.List[autokey.model.ScriptErrorRecord]
-        self.scope = globals()
+        # Namespace every script starts with, each run executes in a shallow copy of it. Scripts used to run in the
+        # namespace of this module, so the modules and names they could use without importing them are kept. The
+        # internals of this module, like Service or IoMediator, are no longer available.
+        self.scope = {
+            "__builtins__": builtins,
+            "__name__": __name__,
+            "autokey": autokey,
+            "collections": collections,
+            "datetime": datetime,
+            "pathlib": pathlib,
+            "threading": threading,
+            "time": time,
+            "traceback": traceback,
+            "typing": typing,
+            "ConfigManager": ConfigManager,
+            "Key": Key,
+            "KEY_FIND_RE": KEY_FIND_RE,
+            "logger": logger,
+        }
         self.scope["highlevel"] = autokey.scripting.highlevel
         self.scope["keyboard"] = autokey.scripting.Keyboard(mediator)
         self.scope["mouse"] = autokey.scripting.Mouse(mediator)
@@ -486,14 +564,14 @@ class ScriptRunner:
     def clear_error_records(self):
         self.error_records.clear()
 
-    @threaded
-    def execute_script(self, script: autokey.model.script.Script, buffer=''):
+    @pooled(lambda runner, script, *args, **kwargs: None if script.allow_concurrent_runs else script)
+    def execute_script(self, script: autokey.model.script.Script, buffer='', match: AbbreviationMatch=None):
         logger.debug("Script runner executing: %r", script)
 
         scope = self.scope.copy()
         scope["store"] = script.store
 
-        backspaces, trigger_character = script.process_buffer(buffer)
+        backspaces, trigger_character = script.process_buffer(buffer, match)
         self.mediator.send_backspace(backspaces)
 
         self._set_triggered_abbreviation(scope, buffer, trigger_character)
@@ -504,7 +582,7 @@ class ScriptRunner:
 
         self.mediator.send_string(trigger_character)
 
-    @threaded
+    @pooled(lambda runner, path: str(path.resolve()))
     def execute_path(self, path: pathlib.Path):
         logger.debug("Script runner executing: {}".format(path))
         scope = self.scope.copy()
@@ -526,34 +604,26 @@ class ScriptRunner:
         start_time = datetime.datetime.now().time()
         # noinspection PyBroadException
         try:
-            compiled_code = self._compile_script(script)
-            exec(compiled_code, scope)
+            if getattr(script, "run_in_process", False):
+                self._execute_in_process(scope, script)
+            else:
+                compiled_code = self._compile_script(script)
+                exec(compiled_code, scope)
         except Exception:  # Catch everything raised by the User code. Those Exceptions must not crash the thread.
             traceback.print_exc()
             self._record_error(script, start_time)
 
-    @staticmethod
-    def _compile_script(script: typing.Union[autokey.model.script.Script, pathlib.Path]):
-        script_code, script_name = ScriptRunner._get_script_source_code_and_name(script)
-        compiled_code = compile(script_code, script_name, 'exec')
-        return compiled_code
+    def _execute_in_process(self, scope, script: autokey.model.script.Script):
+        """
+        Run the script in a worker process. The scripting API objects and the store in the scope are used by the
+        proxies the script gets. Raises ScriptProcessError, if the script failed or was killed.
+        """
+        source, file_name = get_source_code_and_name(script)
+        variables = {"__file__": scope["__file__"]} if "__file__" in scope else {}
+        self.scriptProcesses.run(scope, source, file_name, variables)
 
-    @staticmethod
-    def _get_script_source_code_and_name(script: typing.Union[autokey.model.script.Script, pathlib.Path]) -> typing.Tuple[str, str]:
-        if isinstance(script, pathlib.Path):
-            script_code = script.read_text()
-            script_name = str(script)
-        elif isinstance(script, autokey.model.script.Script):
-            script_code = script.code
-            if script.path is None:
-                script_name = "<string>"
-            else:
-                script_name = str(script.path)
-        else:
-            raise TypeError(
-                "Unknown script type passed in, expected one of [autokey.model.Script, pathlib.Path], got {}".format(
-                    type(script)))
-        return script_code, script_name
+    def _compile_script(self, script: typing.Union[autokey.model.script.Script, pathlib.Path]):
+        return self.compiledScripts.get(script)
 
     @staticmethod
     def _set_triggered_abbreviation(scope: dict, buffer: str, trigger_character: str):
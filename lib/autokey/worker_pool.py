@@ -0,0 +1,260 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Bounded pool of worker threads running phrase expansions and scripts.
+
+Each run may be submitted to a lane. Runs of the same lane run one after the other, in the order they were submitted.
+The Service runs phrase expansions on a pool of their own, using a single lane, so expansions never interleave on
+screen and are not held up by long running scripts. Scripts use a lane per script, so a script triggered again waits
+until its previous run finished. Runs of different lanes, and runs without a lane, run concurrently, limited by the
+pool size.
+"""
+
+import collections
+import itertools
+import threading
+import time
+import typing
+
+logger = __import__("autokey.logger").logger.get_logger(__name__)
+
+# Seconds an idle worker thread waits for new work, before it exits
+WORKER_IDLE_TIMEOUT = 5.0
+
+
+class Run:
+    """A submitted function call. Can be cancelled, as long as it did not start."""
+
+    __slots__ = ("function", "args", "kwargs", "lane", "queued", "started", "cancelled")
+
+    def __init__(self, function: typing.Callable, args: tuple, kwargs: dict, lane: typing.Hashable):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.lane = lane
+        self.queued = time.perf_counter_ns()
+        self.started = False
+        self.cancelled = False
+
+    def cancel(self) -> bool:
+        """Cancel the run. Returns False if it already started."""
+        self.cancelled = not self.started
+        return self.cancelled
+
+
+class WorkerPool:
+    """
+    Runs the submitted functions on at most max_workers threads. Threads are started on demand and exit after being
+    idle for WORKER_IDLE_TIMEOUT seconds. They are no daemon threads, so running scripts are finished when AutoKey
+    exits.
+
+    The number of waiting and running items and the time the items spent waiting and running are recorded, see
+    statistics().
+    """
+
+    def __init__(self, max_workers: int, name: str="Worker"):
+        if max_workers < 1:
+            raise ValueError("The worker pool needs at least one worker, got {}".format(max_workers))
+        self.max_workers = max_workers
+        self.name = name
+        self.__condition = threading.Condition()
+        # Runs ready to start, in submission order. A lane has at most one run that is ready or running.
+        self.__ready = collections.deque()  # type: typing.Deque[Run]
+        # Runs waiting for the current run of their lane, keyed by lane. A lane is present while one of its runs is
+        # ready or running.
+        self.__lanes = {}  # type: typing.Dict[typing.Hashable, typing.Deque[Run]]
+        self.__workerNumbers = itertools.count(1)
+        self.__shutdown = False
+        self.workers = 0
+        # Workers waiting for a run, that were not woken up yet
+        self.idle_workers = 0
+        # Wakeups of idle workers not yet claimed by one of them, see __nextRun()
+        self.__wakeups = 0
+        self.running = 0
+        self.waiting = 0
+        self.item_count = 0
+        self.cancelled_count = 0
+        self.max_depth = 0
+        self.max_running = 0
+        self.last_wait_ns = self.max_wait_ns = self.total_wait_ns = 0
+        self.last_run_ns = self.max_run_ns = self.total_run_ns = 0
+
+    def submit(self, function: typing.Callable, args: tuple=(), kwargs: dict=None,
+               lane: typing.Hashable=None) -> Run:
+        """Queue the function call. If a lane is given, it starts after all runs submitted to that lane before."""
+        run = Run(function, args, kwargs or {}, lane)
+        with self.__condition:
+            if self.__shutdown:
+                logger.warning("%s pool is shut down, dropping %r", self.name, function)
+                run.cancel()
+                return run
+            self.waiting += 1
+            if self.waiting > self.max_depth:
+                self.max_depth = self.waiting
+            if lane is not None and lane in self.__lanes:
+                self.__lanes[lane].append(run)
+            else:
+                if lane is not None:
+                    self.__lanes[lane] = collections.deque()
+                self.__makeReady(run)
+        return run
+
+    def cancel_queued(self, lane: typing.Hashable=None) -> int:
+        """Cancel the runs that did not start yet, only those of the given lane if given. Returns their number."""
+        with self.__condition:
+            if lane is None:
+                runs = list(self.__ready)
+                for waiting in self.__lanes.values():
+                    runs += waiting
+            else:
+                runs = [run for run in self.__ready if run.lane == lane]
+                runs += self.__lanes.get(lane, ())
+            return sum(run.cancel() for run in runs if not run.cancelled)
+
+    def shutdown(self):
+        """Cancel the queued runs and let the idle workers exit. Running items are not interrupted."""
+        with self.__condition:
+            self.__shutdown = True
+            self.cancel_queued()
+            self.__condition.notify_all()
+
+    @property
+    def depth(self) -> int:
+        """Number of runs that did not start yet."""
+        return self.waiting
+
+    def statistics(self) -> typing.Dict[str, int]:
+        with self.__condition:
+            return {
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+                "running": self.running,
+                "max_running": self.max_running,
+                "workers": self.workers,
+                "items": self.item_count,
+                "cancelled": self.cancelled_count,
+                "last_wait_ns": self.last_wait_ns,
+                "max_wait_ns": self.max_wait_ns,
+                "total_wait_ns": self.total_wait_ns,
+                "last_run_ns": self.last_run_ns,
+                "max_run_ns": self.max_run_ns,
+                "total_run_ns": self.total_run_ns,
+            }
+
+    def reset_statistics(self):
+        self.item_count = self.cancelled_count = 0
+        self.max_depth = self.waiting
+        self.max_running = self.running
+        self.last_wait_ns = self.max_wait_ns = self.total_wait_ns = 0
+        self.last_run_ns = self.max_run_ns = self.total_run_ns = 0
+
+    def __makeReady(self, run: Run):
+        """Queue the run for the next free worker. Starts a worker, if none is idle. Holds the condition."""
+        self.__ready.append(run)
+        if not self.__wakeIdleWorker() and self.workers < self.max_workers:
+            self.workers += 1
+            name = "{}-{}".format(self.name, next(self.__workerNumbers))
+            # Not a daemon thread, like the threads used to run scripts before, so exiting waits for running scripts.
+            threading.Thread(target=self.__work, name=name, daemon=False).start()
+
+    def __wakeIdleWorker(self) -> bool:
+        """
+        Wake up an idle worker, if any. It no longer counts as idle, so runs made ready before it picked up its run
+        wake up another worker. Holds the condition.
+        """
+        if self.idle_workers == 0:
+            return False
+        self.idle_workers -= 1
+        self.__wakeups += 1
+        self.__condition.notify()
+        return True
+
+    def __nextRun(self) -> typing.Optional[Run]:
+        """
+        Wait for a ready run. Returns None, if the worker should exit. Holds the condition.
+
+        The idle count is decremented either by the waking worker or by the waiting worker, never by both. A wakeup
+        is claimed even if the wait timed out, as the notification may race with the timeout.
+        """
+        while not self.__ready:
+            if self.__shutdown:
+                return None
+            self.idle_workers += 1
+            self.__condition.wait_for(lambda: self.__wakeups or self.__shutdown, WORKER_IDLE_TIMEOUT)
+            if self.__wakeups:
+                # __wakeIdleWorker() already stopped counting this worker as idle.
+                self.__wakeups -= 1
+            else:
+                self.idle_workers -= 1
+                if not self.__ready and not self.__shutdown:
+                    return None
+        return self.__ready.popleft()
+
+    def __work(self):
+        with self.__condition:
+            run = self.__nextRun()
+            while run is not None:
+                self.waiting -= 1
+                if run.cancelled:
+                    self.cancelled_count += 1
+                else:
+                    run.started = True
+                    self.running += 1
+                    if self.running > self.max_running:
+                        self.max_running = self.running
+                    self.__condition.release()
+                    try:
+                        waited, ran = self.__execute(run)
+                    finally:
+                        self.__condition.acquire()
+                        self.running -= 1
+                    self.__account(waited, ran)
+                self.__releaseLane(run.lane)
+                run = self.__nextRun()
+            self.workers -= 1
+
+    def __execute(self, run: Run) -> typing.Tuple[int, int]:
+        """Call the function, returning the nanoseconds the run waited and ran."""
+        started = time.perf_counter_ns()
+        try:
+            run.function(*run.args, **run.kwargs)
+        except SystemExit:
+            # A script calling sys.exit() ends the run, not the worker.
+            logger.debug("%r exited", run.function)
+        except Exception:
+            logger.exception("Error in %s pool", self.name)
+        return started - run.queued, time.perf_counter_ns() - started
+
+    def __releaseLane(self, lane: typing.Hashable):
+        """Make the next run of the lane ready, once the current one is done. Holds the condition."""
+        if lane is None:
+            return
+        waiting = self.__lanes[lane]
+        if waiting:
+            # The releasing worker looks for ready runs next, so no worker has to be started.
+            self.__ready.append(waiting.popleft())
+            self.__wakeIdleWorker()
+        else:
+            del self.__lanes[lane]
+
+    def __account(self, waited: int, ran: int):
+        self.item_count += 1
+        self.last_wait_ns = waited
+        self.total_wait_ns += waited
+        if waited > self.max_wait_ns:
+            self.max_wait_ns = waited
+        self.last_run_ns = ran
+        self.total_run_ns += ran
+        if ran > self.max_run_ns:
+            self.max_run_ns = ran
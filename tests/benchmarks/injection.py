@@ -0,0 +1,538 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the keyboard output backends of the X interface.
+
+The same text is typed with every backend selectable using the keyboard backend setting. The X interface runs its
+real event queue thread, but talks to a simulated X server instead of a real one. The simulated server uses a US
+keyboard layout and records every request. Requests waiting for a reply (like querying the input focus or window
+properties) take --round-trip-us microseconds, every flush takes --flush-us microseconds.
+
+Characters missing in the keyboard layout are typed by binding them to spare key codes. Use --unicode to mix such
+characters into the generated text.
+
+Reported per backend:
+  - the typed characters per second,
+  - the number of requests, round trips, flushes and keyboard mapping changes, and the number of bytes written,
+  - whether the key events sent to the server reproduce the text. Synthetic events carry the modifier state, for
+    XTEST events the state follows the modifier keys pressed before, like it does in a real X server.
+
+Usage: PYTHONPATH=lib python -m tests.benchmarks.injection --length 5000 --output results.json
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import os
+import platform
+import random
+import re
+import string
+import struct
+import time
+import types
+import typing
+
+from Xlib import X, XK
+from Xlib.ext import xtest
+from Xlib.protocol import request
+from Xlib.xobject.drawable import Window
+
+import autokey.common
+import autokey.configmanager.configmanager_constants as cm_constants
+import autokey.interface
+from autokey.configmanager.config_snapshot import ConfigSnapshot
+from autokey.configmanager.configmanager import ConfigManager
+from autokey.iomediator.constants import SEND_EVENT_BACKEND, XTEST_BACKEND
+
+BACKENDS = (SEND_EVENT_BACKEND, XTEST_BACKEND)
+DEFAULT_LENGTH = 5000
+DEFAULT_ROUND_TRIP_US = 100
+DEFAULT_FLUSH_US = 20
+TEXT_CHARACTERS = string.ascii_letters + string.digits + "     .,;:!?-()'\"@"
+# Characters missing in the simulated keyboard layout
+UNICODE_CHARACTERS = "\u00e9\u00fc\u00df\u20ac\u2014\u00bd\u65e5\u672c\u8a9e\u6587\u5b57\U0001f600\U0001f44d\U0001f680"
+
+# Key code, unshifted and shifted key symbol of a US keyboard layout
+US_LAYOUT = [
+    (9, XK.XK_Escape, 0), (22, XK.XK_BackSpace, 0), (23, XK.XK_Tab, 0), (36, XK.XK_Return, 0),
+    (37, XK.XK_Control_L, 0), (50, XK.XK_Shift_L, 0), (62, XK.XK_Shift_R, 0), (64, XK.XK_Alt_L, 0),
+    (65, XK.XK_space, 0), (66, XK.XK_Caps_Lock, 0), (77, XK.XK_Num_Lock, 0), (108, XK.XK_ISO_Level3_Shift, 0),
+    (113, XK.XK_Left, 0), (114, XK.XK_Right, 0), (111, XK.XK_Up, 0), (116, XK.XK_Down, 0),
+    (133, XK.XK_Super_L, 0),
+]
+US_LAYOUT += [(10 + index, ord(digit), ord(symbol)) for index, (digit, symbol) in enumerate(zip("1234567890",
+                                                                                               "!@#$%^&*()"))]
+US_LAYOUT += [(code, ord(char), ord(char.upper())) for code, char in zip(
+    (24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 38, 39, 40, 41, 42, 43, 44, 45, 46, 52, 53, 54, 55, 56, 57, 58),
+    "qwertyuiopasdfghjklzxcvbnm")]
+US_LAYOUT += [(code, ord(char), ord(shifted)) for code, char, shifted in (
+    (20, "-", "_"), (21, "=", "+"), (34, "[", "{"), (35, "]", "}"), (47, ";", ":"), (48, "'", '"'), (49, "`", "~"),
+    (51, "\\", "|"), (59, ",", "<"), (60, ".", ">"), (61, "/", "?"))]
+# Modifier map index and the key symbols bound to it
+MODIFIER_MAP = {
+    X.ShiftMapIndex: (XK.XK_Shift_L, XK.XK_Shift_R), X.LockMapIndex: (XK.XK_Caps_Lock,),
+    X.ControlMapIndex: (XK.XK_Control_L,), X.Mod1MapIndex: (XK.XK_Alt_L,), X.Mod2MapIndex: (XK.XK_Num_Lock,),
+    X.Mod4MapIndex: (XK.XK_Super_L,), X.Mod5MapIndex: (XK.XK_ISO_Level3_Shift,),
+}
+XTEST_MAJOR_OPCODE = 132
+VOID_SYMBOL = 0xffffff
+
+
+class KeyEvent(typing.NamedTuple):
+    type: int
+    key_code: int
+    # Modifier state carried by synthetic events, None for XTEST events
+    state: typing.Optional[int]
+    # Key symbols bound to the key code when the event was sent
+    keysyms: typing.Tuple[int, ...]
+
+
+class RequestRecorder:
+    """Stands in for the protocol level connection. Records the requests instead of sending them."""
+
+    def __init__(self, round_trip: float, flush: float):
+        self.round_trip = round_trip
+        self.flush_time = flush
+        self.key_events = []  # type: typing.List[KeyEvent]
+        self.keyboard_mapping = []  # type: typing.List[typing.List[int]]
+        self.reset()
+
+    def reset(self):
+        self.key_events.clear()
+        self.requests = 0
+        self.bytes = 0
+        self.round_trips = 0
+        self.flushes = 0
+        self.mapping_changes = 0
+        self.pending = False
+
+    def get_extension_major(self, name: str) -> int:
+        return XTEST_MAJOR_OPCODE
+
+    def send_request(self, request_, wait_for_response: bool):
+        self.requests += 1
+        self.bytes += len(request_._binary)
+        self.pending = True
+        if isinstance(request_, xtest.FakeInput):
+            event_type, detail = struct.unpack_from("BB", request_._binary, 4)
+            self.key_events.append(KeyEvent(event_type, detail, None, tuple(self.keyboard_mapping[detail - 8])))
+        elif isinstance(request_, request.SendEvent):
+            # The 32 byte event follows the request header, the destination window and the event mask.
+            event_type, detail = struct.unpack_from("BB", request_._binary, 12)
+            state, = struct.unpack_from("=H", request_._binary, 12 + 28)
+            self.key_events.append(KeyEvent(event_type, detail, state, tuple(self.keyboard_mapping[detail - 8])))
+
+    def reply(self):
+        """Account a request waiting for a reply from the X server."""
+        self.requests += 1
+        self.round_trips += 1
+        # Xlib writes the buffered requests before waiting for the reply.
+        self.pending = False
+        wait(self.round_trip)
+
+    def flush(self):
+        # Like Xlib, only write if requests are buffered.
+        if self.pending:
+            self.pending = False
+            self.flushes += 1
+            wait(self.flush_time)
+
+
+def wait(seconds: float):
+    # time.sleep() is too coarse for sub-millisecond latencies.
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class SimulatedWindow(Window):
+    """
+    Window of the simulated display. Events sent to the window are reported to the connection that created it.
+    Selections are transferred like by a real X server. A window with selection_text set serves that text itself.
+    """
+
+    def __init__(self, recorder: RequestRecorder, window_id: int, wm_class: typing.Tuple[str, str]=None,
+                 connection=None, server: "SimulatedDisplay"=None):
+        super().__init__(recorder, window_id)
+        self.wm_class = wm_class
+        self.connection = connection
+        self.server = server
+        self.properties = {}  # type: typing.Dict[int, types.SimpleNamespace]
+        self.selection_text = None  # type: typing.Optional[str]
+
+    def create_window(self, x, y, width, height, border_width, depth, *args, **keys):
+        self.display.requests += 1
+        return SimulatedWindow(self.display, next(self.server.window_ids), connection=self.connection,
+                               server=self.server)
+
+    def get_property(self, property, property_type, offset, length):
+        self.display.reply()
+        return None
+
+    def get_full_property(self, property, property_type, sizehint=10):
+        self.display.reply()
+        return self.properties.get(property)
+
+    def change_property(self, property, property_type, format, data, mode=X.PropModeReplace, onerror=None):
+        self.display.requests += 1
+        self.properties[property] = types.SimpleNamespace(property_type=property_type, format=format, value=data)
+
+    def delete_property(self, property, onerror=None):
+        self.display.requests += 1
+        self.properties.pop(property, None)
+
+    def send_event(self, event, event_mask=0, propagate=0, onerror=None):
+        if self.connection is None:
+            # Key events sent to the focused window are recorded by the request recorder.
+            super().send_event(event, event_mask, propagate, onerror)
+        else:
+            self.display.requests += 1
+            self.connection.post_event(event)
+
+    def set_selection_owner(self, selection, time_, onerror=None):
+        self.display.requests += 1
+        previous = self.server.selection_owners.get(selection)
+        if self.id == X.NONE:
+            # The selection is cleared
+            self.server.selection_owners.pop(selection, None)
+        else:
+            self.server.selection_owners[selection] = self
+        if previous is not None and previous is not self and previous.connection is not None:
+            previous.connection.post_event(types.SimpleNamespace(
+                type=X.SelectionClear, window=previous, selection=selection, time=time_))
+
+    def convert_selection(self, selection, target, property, time_, onerror=None):
+        self.display.requests += 1
+        owner = self.server.selection_owners.get(selection)
+        if owner is not None and owner.selection_text is None:
+            owner.connection.post_event(types.SimpleNamespace(
+                type=X.SelectionRequest, owner=owner, requestor=self, selection=selection, target=target,
+                property=property, time=time_))
+            return
+        if owner is None:
+            property = X.NONE
+        else:
+            self.change_property(property, target, 8, owner.selection_text.encode("utf-8"))
+        self.connection.post_event(types.SimpleNamespace(
+            type=X.SelectionNotify, requestor=self, selection=selection, target=target, property=property,
+            time=time_))
+
+    def get_wm_class(self):
+        self.display.reply()
+        return self.wm_class
+
+    def query_tree(self):
+        self.display.reply()
+        return types.SimpleNamespace(parent=0, children=[])
+
+    def change_attributes(self, **keys):
+        self.display.requests += 1
+
+    def grab_key(self, *args, **keys):
+        self.display.requests += 1
+
+    def ungrab_key(self, *args, **keys):
+        self.display.requests += 1
+
+    def grab_keyboard(self, *args, **keys):
+        self.display.reply()
+        return X.GrabSuccess
+
+
+class SimulatedDisplay:
+    """
+    Stands in for Xlib.display.Display, using a US keyboard layout. If spare_keycodes is given, only that many key codes
+    are left without key symbols.
+    """
+
+    def __init__(self, recorder: RequestRecorder, spare_keycodes: int=None):
+        self.recorder = recorder
+        self.window_ids = itertools.count(0x1000)
+        self.root = SimulatedWindow(recorder, 0x100, connection=self, server=self)
+        self.focus = SimulatedWindow(recorder, 0x200, ("editor", "Editor"), server=self)
+        # Selection owner windows, keyed by the selection atom
+        self.selection_owners = {}  # type: typing.Dict[int, SimulatedWindow]
+        self.keyboard_mapping = [[0] * 8 for _ in range(8, 256)]
+        self.atoms = {}  # type: typing.Dict[str, int]
+        recorder.keyboard_mapping = self.keyboard_mapping
+        self.keysym_codes = {}  # type: typing.Dict[int, typing.List[typing.Tuple[int, int]]]
+        for code, keysym, shifted in US_LAYOUT:
+            self.keyboard_mapping[code - 8][:2] = keysym, shifted
+            for index, symbol in enumerate((keysym, shifted)):
+                if symbol:
+                    self.keysym_codes.setdefault(symbol, []).append((code, index))
+        if spare_keycodes is not None:
+            # The X interface looks for spare key codes in the range 8 to 207.
+            unused = [row for row in self.keyboard_mapping[:200] if not any(row)]
+            for row in unused[:len(unused) - spare_keycodes]:
+                row[0] = VOID_SYMBOL
+        # Events reported to the X interface. The listener thread of the X interface waits for the pipe to be readable.
+        self.events = collections.deque()
+        self._read_end, self._write_end = os.pipe()
+
+    def post_event(self, event):
+        self.events.append(event)
+        os.write(self._write_end, b"\0")
+
+    def pending_events(self) -> int:
+        return len(self.events)
+
+    def next_event(self):
+        os.read(self._read_end, 1)
+        return self.events.popleft()
+
+    def fileno(self) -> int:
+        return self._read_end
+
+    def close(self):
+        if self._read_end is not None:
+            os.close(self._read_end)
+            os.close(self._write_end)
+            self._read_end = self._write_end = None
+
+    def screen(self):
+        return types.SimpleNamespace(root=self.root)
+
+    def keysym_to_keycodes(self, keysym: int):
+        return iter(self.keysym_codes.get(keysym, ()))
+
+    def keysym_to_keycode(self, keysym: int) -> int:
+        codes = self.keysym_codes.get(keysym)
+        return codes[0][0] if codes else 0
+
+    def keycode_to_keysym(self, keycode: int, index: int) -> int:
+        return self.keyboard_mapping[keycode - 8][index]
+
+    def lookup_string(self, keysym: int) -> typing.Optional[str]:
+        return XK.keysym_to_string(keysym)
+
+    def get_modifier_mapping(self):
+        mapping = [[] for _ in range(8)]
+        for index, keysyms in MODIFIER_MAP.items():
+            mapping[index] = [self.keysym_to_keycode(keysym) for keysym in keysyms]
+        return mapping
+
+    def get_keyboard_mapping(self, first_keycode: int, count: int):
+        self.recorder.reply()
+        return [list(keysyms) for keysyms in self.keyboard_mapping[first_keycode - 8:first_keycode - 8 + count]]
+
+    def change_keyboard_mapping(self, first_keycode: int, keysyms):
+        self.recorder.requests += 1
+        self.recorder.mapping_changes += 1
+        self.recorder.pending = True
+        for offset, symbols in enumerate(keysyms):
+            self.keyboard_mapping[first_keycode - 8 + offset] = list(symbols)
+        self.post_event(types.SimpleNamespace(
+            type=X.MappingNotify, request=X.MappingKeyboard, first_keycode=first_keycode, count=len(keysyms)))
+
+    def get_keyboard_control(self):
+        self.recorder.reply()
+        return types.SimpleNamespace(led_mask=0)
+
+    def get_input_focus(self):
+        self.recorder.reply()
+        return types.SimpleNamespace(focus=self.focus)
+
+    def intern_atom(self, name: str, only_if_exists: bool=False) -> int:
+        self.recorder.reply()
+        # Above the predefined atoms
+        return self.atoms.setdefault(name, 0x200 + len(self.atoms))
+
+    def create_resource_object(self, type_: str, resource_id: int) -> SimulatedWindow:
+        return SimulatedWindow(self.recorder, resource_id, connection=self, server=self)
+
+    def get_selection_owner(self, selection: int):
+        self.recorder.reply()
+        return self.selection_owners.get(selection, X.NONE)
+
+    def ungrab_keyboard(self, time_):
+        self.recorder.requests += 1
+        self.recorder.pending = True
+
+    def allow_events(self, mode, time_):
+        self.recorder.requests += 1
+        self.recorder.pending = True
+
+    def flush(self):
+        self.recorder.flush()
+
+
+class SimulatedConnection:
+    """
+    Another connection to the simulated display. Input events are only reported to the first connection, but events
+    sent to windows created by this connection are reported to it.
+    """
+
+    def __init__(self, simulated_display: SimulatedDisplay):
+        self.simulated_display = simulated_display
+        self.root = SimulatedWindow(simulated_display.recorder, simulated_display.root.id, connection=self,
+                                    server=simulated_display)
+        self.events = collections.deque()
+        self._read_end, self._write_end = os.pipe()
+
+    def __getattr__(self, name: str):
+        return getattr(self.simulated_display, name)
+
+    def screen(self):
+        return types.SimpleNamespace(root=self.root)
+
+    post_event = SimulatedDisplay.post_event
+    pending_events = SimulatedDisplay.pending_events
+    next_event = SimulatedDisplay.next_event
+    fileno = SimulatedDisplay.fileno
+    close = SimulatedDisplay.close
+
+
+class StubMediator:
+
+    def set_modifier_state(self, modifier, state):
+        pass
+
+
+class StubConfigManager:
+
+    def __init__(self):
+        self.hotKeys = []
+        self.hotKeyFolders = []
+        self.globalHotkeys = []
+        self.snapshot = ConfigSnapshot.empty()
+        self.workAroundApps = re.compile(ConfigManager.SETTINGS[cm_constants.WORKAROUND_APP_REGEX])
+
+
+def create_interface(simulated_display: SimulatedDisplay) -> autokey.interface.XInterfaceBase:
+    """Create an X interface connected to the simulated display. Its input and output threads are running."""
+    original = autokey.interface.display.Display
+    connections = [simulated_display]
+
+    def connect(*args):
+        # The first connection is used by the listener, the others only send requests.
+        return connections.pop() if connections else SimulatedConnection(simulated_display)
+
+    autokey.interface.display.Display = connect
+    try:
+        # Callbacks for the main thread of the GUI are run right away.
+        app = types.SimpleNamespace(
+            configManager=StubConfigManager(), exec_in_main=lambda callback, *args: callback(*args))
+        return autokey.interface.XInterfaceBase(StubMediator(), app)
+    finally:
+        autokey.interface.display.Display = original
+
+
+def typed_text(simulated_display: SimulatedDisplay, events: typing.Iterable[KeyEvent]) -> str:
+    """Return the text an application receives from the given key events."""
+    shift_codes = {code for code, _ in simulated_display.keysym_codes[XK.XK_Shift_L]}
+    shift_codes.update(code for code, _ in simulated_display.keysym_codes[XK.XK_Shift_R])
+    shift_pressed = False
+    text = []
+    for key_event in events:
+        if key_event.key_code in shift_codes:
+            shift_pressed = key_event.type == X.KeyPress
+        elif key_event.type == X.KeyPress:
+            shifted = shift_pressed if key_event.state is None else bool(key_event.state & X.ShiftMask)
+            keysyms = key_event.keysyms
+            keysym = keysyms[1 if shifted and len(keysyms) > 1 else 0]
+            if keysym > autokey.interface.UNICODE_KEYSYM_OFFSET:
+                text.append(chr(keysym - autokey.interface.UNICODE_KEYSYM_OFFSET))
+            else:
+                text.append(XK.keysym_to_string(keysym) or "")
+    return "".join(text)
+
+
+def generate_text(length: int, seed: int=0, unicode_share: float=0) -> str:
+    rng = random.Random(seed)
+    return "".join(rng.choice(UNICODE_CHARACTERS if rng.random() < unicode_share else TEXT_CHARACTERS)
+                   for _ in range(length))
+
+
+def run(interface: autokey.interface.XInterfaceBase, simulated_display: SimulatedDisplay, backend: str, text: str,
+        repeat: int) -> dict:
+    """Type the text repeat times using the given backend, the way a phrase expansion does."""
+    ConfigManager.SETTINGS[cm_constants.KEYBOARD_BACKEND] = backend
+    recorder = simulated_display.recorder
+    timings = []
+    for _ in range(repeat):
+        interface.wait_for_queues()
+        recorder.reset()
+        start = time.perf_counter()
+        interface.begin_send()
+        interface.send_string(text)
+        interface.finish_send()
+        interface.wait_for_queues()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    return {
+        "backend": backend,
+        "characters": len(text),
+        "seconds": best,
+        "chars_per_second": len(text) / best,
+        "requests": recorder.requests,
+        "round_trips": recorder.round_trips,
+        "flushes": recorder.flushes,
+        "mapping_changes": recorder.mapping_changes,
+        "bytes": recorder.bytes,
+        "typed_correctly": typed_text(simulated_display, recorder.key_events) == text,
+    }
+
+
+def parse_args(argv: typing.List[str]=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the keyboard output backends of the AutoKey X interface.")
+    parser.add_argument("--length", type=int, default=DEFAULT_LENGTH, help="Length of the generated text")
+    parser.add_argument("--text", help="Type this text instead of a generated one")
+    parser.add_argument("--unicode", type=float, default=0,
+                        help="Share of characters missing in the keyboard layout in the generated text")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS, help="Backends to compare")
+    parser.add_argument("--repeat", type=int, default=3, help="Type the text this often, the best run is reported")
+    parser.add_argument("--round-trip-us", type=float, default=DEFAULT_ROUND_TRIP_US,
+                        help="Simulated latency of requests waiting for a reply, in microseconds")
+    parser.add_argument("--flush-us", type=float, default=DEFAULT_FLUSH_US,
+                        help="Simulated time needed to write the request buffer, in microseconds")
+    parser.add_argument("--seed", type=int, default=0, help="Seed used to generate the text")
+    parser.add_argument("--output", help="Write the results to this file instead of standard output")
+    return parser.parse_args(argv)
+
+
+def main(argv: typing.List[str]=None) -> dict:
+    args = parse_args(argv)
+    text = args.text if args.text is not None else generate_text(args.length, args.seed, args.unicode)
+    simulated_display = SimulatedDisplay(RequestRecorder(args.round_trip_us / 1e6, args.flush_us / 1e6))
+    previous_backend = ConfigManager.SETTINGS[cm_constants.KEYBOARD_BACKEND]
+    interface = create_interface(simulated_display)
+    try:
+        backend_results = [run(interface, simulated_display, backend, text, args.repeat) for backend in args.backends]
+    finally:
+        ConfigManager.SETTINGS[cm_constants.KEYBOARD_BACKEND] = previous_backend
+        interface.cancel()
+    results = {
+        "benchmark": "injection",
+        "autokey_version": autokey.common.VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "round_trip_us": args.round_trip_us,
+        "flush_us": args.flush_us,
+        "unicode_share": args.unicode,
+        "results": backend_results,
+    }
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the key press handling done by Service.handle_keypress().
+
+Synthetic configurations with mixed phrase options (ignoreCase, immediate, triggerInside, window filters, folders
+having abbreviations or hotkeys) are generated for each requested size. A keystroke stream is replayed through
+handle_keypress(), using a stub IoMediator that counts the output instead of sending it to the X server. Matched
+phrases are expanded synchronously, so their cost is part of the measured key press.
+
+Reported per configuration size:
+  - the time needed to build the configuration,
+  - the per-keystroke latency percentiles (replay without tracemalloc, after a short warm-up),
+  - memory blocks allocated and bytes retained per keystroke, and the transient peak of traced memory during the
+    replay (second replay with tracemalloc),
+  - the memory used by the configuration and the peak resident set size of the process.
+
+A recorded keystroke stream can be replayed with --stream. The file contains a JSON list. Each element is either a
+typed character, a key name like "<backspace>", or an object like
+{"key": "a", "modifiers": ["<ctrl>"], "window": ["Window title", "WM_CLASS"]}.
+
+Usage: PYTHONPATH=lib python -m tests.benchmarks.matching --sizes 100 1000 --output results.json
+"""
+
+import argparse
+import gc
+import json
+import platform
+import random
+import resource
+import string
+import sys
+import time
+import tracemalloc
+import typing
+
+import autokey.common
+import autokey.configmanager.configmanager_constants as cm_constants
+from autokey.configmanager.configmanager import ConfigManager
+from autokey.interface import WindowInfo
+from autokey.model.folder import Folder
+from autokey.model.key import Key
+from autokey.model.phrase import Phrase, SendMode
+from autokey.scripting import Engine
+from autokey.service import Service, PhraseRunner
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+DEFAULT_KEYSTROKES = 20000
+PHRASES_PER_FOLDER = 50
+WINDOWS = (
+    WindowInfo("user@host: ~", "konsole.Konsole"),
+    WindowInfo("Mozilla Firefox", "Navigator.Firefox"),
+    WindowInfo("Untitled - Kate", "kate.Kate"),
+)
+WINDOW_FILTERS = ("konsole.*", ".*Firefox", "kate.*", "gimp.*")
+HOTKEY_MODIFIERS = (Key.ALT, Key.CONTROL)
+WORD_CHARACTERS = string.ascii_lowercase
+TRIGGER_CHARACTERS = "     .,\n"
+
+
+class Keystroke(typing.NamedTuple):
+    raw_key: str
+    modifiers: typing.List[str]
+    key: str
+    window: WindowInfo
+
+
+class StubInterface:
+
+    def begin_send(self):
+        pass
+
+    def finish_send(self):
+        pass
+
+
+class StubMediator:
+    """Replaces the IoMediator. Counts the output instead of sending it."""
+
+    def __init__(self):
+        self.interface = StubInterface()
+        self.sent_characters = 0
+        self.backspaces = 0
+
+    def send_string(self, string_: str):
+        self.sent_characters += len(string_)
+
+    def paste_string(self, string_: str, paste_command):
+        self.sent_characters += len(string_)
+
+    def remove_string(self, string_: str):
+        self.backspaces += len(string_)
+
+    def send_backspace(self, count: int):
+        self.backspaces += count
+
+
+class StubMonitor:
+
+    def has_watch(self, path) -> bool:
+        return True
+
+    def add_watch(self, path):
+        pass
+
+    def suspend(self):
+        pass
+
+    def unsuspend(self):
+        pass
+
+
+class StubApp:
+    """The parts of the application used by the ConfigManager and the Service."""
+
+    def __init__(self):
+        self.monitor = StubMonitor()
+        self.configManager = None
+        self.menus = 0
+
+    def init_global_hotkeys(self, config_manager):
+        pass
+
+    def hotkey_removed(self, item):
+        pass
+
+    def show_popup_menu(self, folders: list=None, items: list=None, onDesktop=True, title=None):
+        self.menus += 1
+
+    def hide_menu(self):
+        pass
+
+
+class StubScriptRunner:
+
+    def __init__(self, config_manager):
+        self.engine = Engine(config_manager, self)
+        self.executed = 0
+
+    def execute_script(self, script, buffer=''):
+        self.executed += 1
+
+
+class SyntheticConfigManager(ConfigManager):
+    """ConfigManager using the given folders instead of the configuration stored on disk."""
+
+    def __init__(self, app, folders: typing.List[Folder]):
+        self._synthetic_folders = folders
+        super().__init__(app)
+        self.config_altered(False)
+
+    def load_global_config(self):
+        self.folders.extend(self._synthetic_folders)
+
+
+def random_word(rng: random.Random, min_length: int, max_length: int) -> str:
+    return "".join(rng.choice(WORD_CHARACTERS) for _ in range(rng.randint(min_length, max_length)))
+
+
+def generate_phrase(rng: random.Random, number: int) -> Phrase:
+    phrase = Phrase("Phrase {}".format(number), "Expansion of phrase {}".format(number))
+    phrase.sendMode = SendMode.KEYBOARD
+    phrase.add_abbreviation(random_word(rng, 2, 8))
+    if rng.random() < 0.1:
+        phrase.add_abbreviation(random_word(rng, 2, 8))
+    phrase.ignoreCase = rng.random() < 0.2
+    phrase.immediate = rng.random() < 0.2
+    phrase.triggerInside = rng.random() < 0.1
+    if rng.random() < 0.1:
+        phrase.set_window_titles(rng.choice(WINDOW_FILTERS))
+    if rng.random() < 0.02:
+        phrase.set_hotkey(list(HOTKEY_MODIFIERS), rng.choice(string.ascii_lowercase + string.digits))
+    return phrase
+
+
+def generate_folders(phrase_count: int, seed: int=0) -> typing.List[Folder]:
+    """
+    Generate top-level folders holding the given number of phrases. Every folder contains a sub folder holding part
+    of its phrases. Some folders have an abbreviation, a hotkey or a window filter.
+    """
+    rng = random.Random(seed)
+    folders = []
+    number = 0
+    while number < phrase_count:
+        folder = Folder("Folder {}".format(len(folders)))
+        if rng.random() < 0.2:
+            folder.add_abbreviation(random_word(rng, 3, 6))
+        if rng.random() < 0.05:
+            folder.set_hotkey([Key.SUPER], rng.choice(string.digits))
+        if rng.random() < 0.1:
+            folder.set_window_titles(rng.choice(WINDOW_FILTERS))
+        subfolder = Folder("Sub folder {}".format(len(folders)))
+        folder.add_folder(subfolder)
+        for index in range(min(PHRASES_PER_FOLDER, phrase_count - number)):
+            (subfolder if index % 2 else folder).add_item(generate_phrase(rng, number))
+            number += 1
+        folders.append(folder)
+    return folders
+
+
+def _typed(char: str, window: WindowInfo) -> Keystroke:
+    if char == "\n":
+        return Keystroke(Key.ENTER, [], Key.ENTER, window)
+    elif char.isupper():
+        return Keystroke(char.lower(), [Key.SHIFT], char, window)
+    return Keystroke(char, [], char, window)
+
+
+def generate_stream(abbreviations: typing.Sequence[str], length: int, seed: int=0) -> typing.List[Keystroke]:
+    """
+    Generate a stream of typed words separated by trigger characters. About one word in ten is a configured
+    abbreviation. The stream also contains capitalised words, backspaces, hotkeys and window changes.
+    """
+    rng = random.Random(seed)
+    window = rng.choice(WINDOWS)
+    keystrokes = []  # type: typing.List[Keystroke]
+    while len(keystrokes) < length:
+        roll = rng.random()
+        if roll < 0.02:
+            window = rng.choice(WINDOWS)
+        if roll < 0.1 and abbreviations:
+            word = rng.choice(abbreviations)
+        else:
+            word = random_word(rng, 1, 10)
+        if rng.random() < 0.05:
+            word = word.capitalize()
+        keystrokes += (_typed(char, window) for char in word)
+        if rng.random() < 0.05:
+            keystrokes.append(Keystroke(Key.BACKSPACE, [], Key.BACKSPACE, window))
+        if rng.random() < 0.01:
+            key = rng.choice(string.ascii_lowercase + string.digits)
+            keystrokes.append(Keystroke(key, list(HOTKEY_MODIFIERS), key, window))
+        keystrokes.append(_typed(rng.choice(TRIGGER_CHARACTERS), window))
+    return keystrokes[:length]
+
+
+def load_stream(path: str) -> typing.List[Keystroke]:
+    """Load a recorded keystroke stream, see the module documentation for the format."""
+    with open(path, "r") as stream_file:
+        events = json.load(stream_file)
+    window = WINDOWS[0]
+    keystrokes = []
+    for event in events:
+        if isinstance(event, str):
+            event = {"key": event}
+        if "window" in event:
+            window = WindowInfo(*event["window"])
+        key = event["key"]
+        if Key.is_key(key):
+            key = Key(key)
+        modifiers = sorted(Key(modifier) for modifier in event.get("modifiers", []))
+        raw_key = key.lower() if Key.SHIFT in modifiers and len(key) == 1 else key
+        keystrokes.append(Keystroke(raw_key, modifiers, key, window))
+    return keystrokes
+
+
+def create_service(config_manager: ConfigManager, app: StubApp) -> Service:
+    app.configManager = config_manager
+    service = Service(app)
+    service.mediator = StubMediator()
+    service.scriptRunner = StubScriptRunner(config_manager)
+    service.phraseRunner = PhraseRunner(service)
+    # Expand phrases synchronously instead of in a new thread.
+    service.phraseRunner.execute = service.phraseRunner.execute._original.__get__(service.phraseRunner)
+    ConfigManager.SETTINGS[cm_constants.SERVICE_RUNNING] = True
+    return service
+
+
+def replay(service: Service, keystrokes: typing.Iterable[Keystroke]) -> typing.List[int]:
+    """Feed the keystrokes to the service, returning the time taken by each key press in nanoseconds."""
+    timings = []
+    clock = time.perf_counter_ns
+    handle_keypress = service.handle_keypress
+    for keystroke in keystrokes:
+        start = clock()
+        handle_keypress(keystroke.raw_key, keystroke.modifiers, keystroke.key, keystroke.window)
+        timings.append(clock() - start)
+    return timings
+
+
+def percentiles(timings: typing.List[int]) -> typing.Dict[str, float]:
+    ordered = sorted(timings)
+
+    def percentile(fraction: float) -> int:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {
+        "p50": percentile(0.5),
+        "p90": percentile(0.9),
+        "p99": percentile(0.99),
+        "max": ordered[-1],
+        "mean": sum(ordered) / len(ordered),
+    }
+
+
+def run(size: int, keystrokes: typing.Optional[typing.List[Keystroke]], keystroke_count: int, seed: int,
+        trace_memory: bool=True) -> dict:
+    """Benchmark one configuration size. If no keystrokes are given, a stream is generated."""
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    build_start = time.perf_counter()
+    folders = generate_folders(size, seed)
+    app = StubApp()
+    config_manager = SyntheticConfigManager(app, folders)
+    build_seconds = time.perf_counter() - build_start
+    config_bytes = tracemalloc.get_traced_memory()[0] if trace_memory else None
+    tracemalloc.stop()
+
+    if keystrokes is None:
+        abbreviations = [abbreviation for item in config_manager.allItems for abbreviation in item.abbreviations]
+        keystrokes = generate_stream(abbreviations, keystroke_count, seed)
+
+    service = create_service(config_manager, app)
+    replay(service, keystrokes[:len(keystrokes) // 10])
+    gc.collect()
+    timings = replay(service, keystrokes)
+    mediator = service.mediator  # type: StubMediator
+    result = {
+        "phrases": len(config_manager.allItems),
+        "folders": len(config_manager.allFolders),
+        "keystrokes": len(keystrokes),
+        "build_seconds": build_seconds,
+        "latency_ns": percentiles(timings),
+        "expanded_characters": mediator.sent_characters,
+        "menus": app.menus,
+        "window_cache": {
+            "hits": config_manager.windowFilterCache.hits,
+            "misses": config_manager.windowFilterCache.misses,
+        },
+    }
+
+    if trace_memory:
+        service = create_service(config_manager, app)
+        gc.collect()
+        blocks_before = sys.getallocatedblocks()
+        tracemalloc.start()
+        traced_before = tracemalloc.get_traced_memory()[0]
+        replay(service, keystrokes)
+        traced_after, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        gc.collect()
+        blocks_after = sys.getallocatedblocks()
+        result["memory"] = {
+            "config_bytes": config_bytes,
+            "retained_bytes_per_keystroke": (traced_after - traced_before) / len(keystrokes),
+            "retained_blocks_per_keystroke": (blocks_after - blocks_before) / len(keystrokes),
+            "replay_peak_bytes": traced_peak - traced_before,
+        }
+    # ru_maxrss is given in KiB on Linux.
+    result["max_rss_kib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def parse_args(argv: typing.List[str]=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the abbreviation and hotkey matching of AutoKey.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Numbers of phrases in the generated configurations")
+    parser.add_argument("--keystrokes", type=int, default=DEFAULT_KEYSTROKES,
+                        help="Length of the generated keystroke stream")
+    parser.add_argument("--stream", help="Replay the recorded keystroke stream in this JSON file")
+    parser.add_argument("--seed", type=int, default=0, help="Seed used to generate configurations and streams")
+    parser.add_argument("--no-memory", dest="trace_memory", action="store_false",
+                        help="Skip the memory measurements, they need a second replay")
+    parser.add_argument("--output", help="Write the results to this file instead of standard output")
+    return parser.parse_args(argv)
+
+
+def main(argv: typing.List[str]=None) -> dict:
+    args = parse_args(argv)
+    keystrokes = load_stream(args.stream) if args.stream else None
+    results = {
+        "benchmark": "matching",
+        "autokey_version": autokey.common.VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "stream": args.stream,
+        "results": [
+            run(size, keystrokes, args.keystrokes, args.seed, args.trace_memory) for size in sorted(args.sizes)
+        ],
+    }
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+    return results
+
+
+if __name__ == "__main__":
+    main()
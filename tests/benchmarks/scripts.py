@@ -0,0 +1,132 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark of the per-invocation overhead of running user scripts.
+
+A script doing nothing is run through ScriptRunner.execute_script() (synchronously, without the worker pool) and
+through ScriptRunner.run_subscript(), like engine.run_script() does. As the script itself takes no time, the measured
+time is the overhead of AutoKey: preparing the script namespace, looking up the compiled code and executing it. The
+scripting API objects use a stub IoMediator, so nothing is sent to the X server.
+
+Reported per entry point: the per-invocation latency percentiles, the size of the namespace the script runs in, and
+the hit rate of the compiled code cache.
+
+Usage: PYTHONPATH=lib python -m tests.benchmarks.scripts --runs 20000 --output results.json
+"""
+
+import argparse
+import json
+import platform
+import time
+import types
+import typing
+from unittest.mock import patch
+
+import autokey.common
+import autokey.scripting
+from autokey.model.folder import Folder
+from autokey.model.script import Script
+from autokey.script_cache import CompiledCodeCache
+from autokey.script_processes import ScriptProcessPool
+from autokey.service import ScriptRunner
+from autokey.worker_pool import WorkerPool
+from tests.benchmarks.matching import StubApp, StubMediator, percentiles
+
+DEFAULT_RUNS = 20000
+WARM_UP_RUNS = 100
+# Records the size of the namespace the script runs in. The store survives the run.
+SCRIPT_SOURCE = "store['namespace_size'] = len(globals())"
+
+
+class StubClipboard:
+
+    def __init__(self, app):
+        self.app = app
+
+
+class StubDialog:
+    pass
+
+
+def create_runner() -> ScriptRunner:
+    app = StubApp()
+    app.configManager = types.SimpleNamespace(app=app)
+    # The toolkit dependent API objects need a running application.
+    with patch.object(autokey.scripting, "Clipboard", StubClipboard), \
+            patch.object(autokey.scripting, "Dialog", StubDialog):
+        return ScriptRunner(StubMediator(), app, WorkerPool(1), CompiledCodeCache(), ScriptProcessPool(1, None))
+
+
+def measure(run: typing.Callable[[], typing.Any], runs: int) -> typing.List[int]:
+    for _ in range(WARM_UP_RUNS):
+        run()
+    timings = []
+    clock = time.perf_counter_ns
+    for _ in range(runs):
+        start = clock()
+        run()
+        timings.append(clock() - start)
+    return timings
+
+
+def run_entry_points(runner: ScriptRunner, runs: int) -> typing.List[dict]:
+    script = Script("benchmark", SCRIPT_SOURCE)
+    # Running a script increments the usage count of its folder.
+    script.parent = Folder("benchmark")
+    execute_script = ScriptRunner.execute_script._original
+    entry_points = (
+        ("execute_script", lambda: execute_script(runner, script)),
+        ("run_subscript", lambda: runner.run_subscript(script)),
+    )
+    results = []
+    for name, run in entry_points:
+        runner.compiledScripts.reset_statistics()
+        latency = measure(run, runs)
+        results.append({
+            "entry_point": name,
+            "runs": runs,
+            "latency_ns": percentiles(latency),
+            "namespace_size": script.store.get("namespace_size"),
+            "cache_hit_rate": runner.compiledScripts.statistics()["hit_rate"],
+        })
+    return results
+
+
+def parse_args(argv: typing.List[str]=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the overhead of running AutoKey user scripts.")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Number of measured script runs")
+    parser.add_argument("--output", help="Write the results to this file instead of standard output")
+    return parser.parse_args(argv)
+
+
+def main(argv: typing.List[str]=None) -> dict:
+    args = parse_args(argv)
+    results = {
+        "benchmark": "scripts",
+        "autokey_version": autokey.common.VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": run_entry_points(create_runner(), args.runs),
+    }
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -421,6 +421,57 @@ def test_engine_remove_temporary(create_engine):
         not_(raises(ValueError)), "Doesn't ungrab hotkeys (duplicate hotkey warning received)")
 
 
+def test_engine_batch_activates_phrases_at_the_end(create_engine):
+    engine, folder = create_engine
+    with patch("autokey.model.phrase.Phrase.persist"), \
+            patch.object(engine.configManager, "apply_changes", wraps=engine.configManager.apply_changes) as apply:
+        with engine.batch():
+            first = engine.create_phrase(folder, "Phrase", "ABC", abbreviations="abc", hotkey=(["<ctrl>"], "a"))
+            second = engine.create_phrase(folder, "Phrase2", "DEF", abbreviations="def")
+            assert_that(engine.configManager.allItems, not_(has_item(first)))
+            assert_that(
+                calling(engine.create_phrase).with_args(folder, "Phrase3", "ABC", abbreviations="abc"),
+                raises(ValueError), "Abbreviation of a phrase in the same batch not checked")
+            assert_that(
+                calling(engine.create_phrase).with_args(folder, "Phrase3", "ABC", hotkey=(["<ctrl>"], "a")),
+                raises(ValueError), "Hotkey of a phrase in the same batch not checked")
+        assert_that(apply.call_count, is_(equal_to(1)))
+    assert_that(engine.configManager.allItems, has_items(first, second))
+    assert_that(get_item_with_hotkey(engine, (["<ctrl>"], "a")), is_(first))
+    assert_that(engine.configManager.check_abbreviation_unique("def", None, None), is_(equal_to((False, second))))
+
+
+def test_engine_batch_rolls_back_on_error(create_engine):
+    engine, folder = create_engine
+    hotkey = (["<ctrl>"], "a")
+    original = create_test_hotkey(engine, folder, hotkey)
+    with patch("autokey.model.phrase.Phrase.persist"), patch("autokey.model.phrase.Phrase.remove_data"):
+        with pytest.raises(ValueError):
+            with engine.batch():
+                replacement = engine.create_phrase(folder, "Phrase", "ABC", hotkey=hotkey,
+                                                   replace_existing_hotkey=True)
+                engine.create_phrase(folder, "Phrase2", "ABC", abbreviations=["x", 1337])
+    assert_that(folder.items, not_(has_item(replacement)))
+    assert_that(get_item_with_hotkey(engine, hotkey), is_(original))
+
+
+def test_engine_create_phrases(create_engine):
+    engine, folder = create_engine
+    with patch("autokey.model.phrase.Phrase.persist"):
+        phrases = engine.create_phrases(
+            {"folder": folder, "name": "Phrase{}".format(i), "contents": "ABC", "abbreviations": "abbr{}".format(i)}
+            for i in range(50)
+        )
+        assert_that(engine.configManager.allItems, has_items(*phrases))
+        assert_that(
+            calling(engine.create_phrases).with_args([
+                {"folder": folder, "name": "New", "contents": "ABC", "abbreviations": "new"},
+                {"folder": folder, "name": "Duplicate", "contents": "ABC", "abbreviations": "abbr3"},
+            ]),
+            raises(ValueError))
+    assert_that([item.description for item in folder.items], not_(has_item("New")))
+
+
 def test_engine_create_phrase_regex(create_engine):
     import re
     engine, folder = create_engine
@@ -147,3 +147,11 @@ def test_send_keys_send_mode_clipboard(send_mode: Union[Keyboard.SendMode, int],
 
     mock_mediator.paste_string.assert_called_once_with(sent_string, send_mode)
     mock_mediator.interface.finish_send.assert_called_once()
+
+
+def test_send_key_repeat_is_a_single_operation():
+    keyboard = create_keyboard()
+    keyboard.send_key("<backspace>", repeat=200)
+    mock_mediator: MagicMock = keyboard.mediator
+    mock_mediator.send_key.assert_called_once_with("<backspace>", 200)
+    mock_mediator.flush.assert_called_once_with()
@@ -0,0 +1,159 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+import random
+import typing
+from unittest.mock import MagicMock
+
+import pytest
+from hamcrest import *
+
+import autokey.model.folder
+import autokey.model.helpers
+import autokey.model.phrase
+from autokey.configmanager.abbreviation_index import AbbreviationIndex, AbbreviationMatcher
+from autokey.interface import WindowInfo
+
+# "ß" case-folds to "ss", which changes the length of the folded input.
+ALPHABET = "abAB. \tsSß"
+
+
+def create_phrase(abbreviations: typing.List[str], ignore_case: bool, immediate: bool, trigger_inside: bool):
+    phrase = autokey.model.phrase.Phrase("phrase", "content")
+    phrase.add_abbreviations(abbreviations)
+    phrase.ignoreCase = ignore_case
+    phrase.immediate = immediate
+    phrase.triggerInside = trigger_inside
+    phrase.parent = MagicMock()
+    return phrase
+
+
+def generate_phrases(seed: int) -> typing.List[autokey.model.phrase.Phrase]:
+    rng = random.Random(seed)
+    phrases = []
+    for ignore_case, immediate, trigger_inside in itertools.product((False, True), repeat=3):
+        for _ in range(4):
+            abbreviations = ["".join(rng.choice("abAB.sSß") for _ in range(rng.randint(1, 3)))
+                             for _ in range(rng.randint(1, 2))]
+            phrases.append(create_phrase(abbreviations, ignore_case, immediate, trigger_inside))
+    return phrases
+
+
+def generate_buffers(seed: int, count: int = 300):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 8)))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_candidates_contain_all_matching_items(seed: int):
+    phrases = generate_phrases(seed)
+    folder = autokey.model.folder.Folder("folder")
+    folder.add_abbreviation("fo.")
+    index = AbbreviationIndex([folder], phrases)
+    window_info = WindowInfo("", "")
+
+    for buffer in itertools.chain(generate_buffers(seed), ["fo. ", "xfo. "]):
+        expected_items = [phrase for phrase in phrases if phrase.check_input(buffer, window_info)]
+        expected_folders = [folder] if folder.check_input(buffer, window_info) else []
+        folders, items = index.find_candidates(buffer)
+        assert_that(
+            [item for item in items if item.check_input(buffer, window_info)],
+            is_(equal_to(expected_items)),
+            "Index missed matching items for buffer {!r}".format(buffer)
+        )
+        assert_that(
+            [f for f in folders if f.check_input(buffer, window_info)],
+            is_(equal_to(expected_folders)),
+        )
+
+
+def test_items_without_abbreviation_mode_are_not_indexed():
+    phrase = create_phrase(["abc"], False, True, False)
+    phrase.set_modes([autokey.model.helpers.TriggerMode.HOTKEY])
+    index = AbbreviationIndex([], [phrase])
+    assert_that(index.find_candidates("abc"), is_(equal_to(([], []))))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_streaming_matcher_follows_input_with_backspace(seed: int):
+    rng = random.Random(seed)
+    index = AbbreviationIndex([], generate_phrases(seed))
+    matcher = AbbreviationMatcher(index)
+    buffer = []
+    for _ in range(500):
+        if buffer and rng.random() < 0.2:
+            buffer.pop()
+            matcher.pop()
+        else:
+            char = rng.choice(ALPHABET)
+            buffer.append(char)
+            matcher.push(char)
+        assert_that(matcher.candidates(), is_(equal_to(index.find_candidates("".join(buffer)))))
+    assert_that(matcher.step_count, is_(greater_than(0)))
+    assert_that(matcher.max_step_ns, is_(greater_than_or_equal_to(matcher.last_step_ns)))
+
+
+def test_live_prefixes():
+    index = AbbreviationIndex([], [
+        create_phrase(["abc", "abd"], False, False, False),
+        create_phrase(["BX"], True, False, False),
+    ])
+    matcher = AbbreviationMatcher(index)
+    for char in "xab":
+        matcher.push(char)
+    assert_that(matcher.live_prefixes, is_(equal_to({"ab", "b"})))
+    matcher.pop()
+    assert_that(matcher.live_prefixes, is_(equal_to({"a"})))
+    matcher.clear()
+    assert_that(matcher.live_prefixes, is_(empty()))
+
+
+def test_set_index_replays_buffer():
+    phrase = create_phrase(["ab"], False, True, False)
+    matcher = AbbreviationMatcher(AbbreviationIndex([], []))
+    for char in "ab":
+        matcher.push(char)
+    assert_that(matcher.candidates(), is_(equal_to(([], []))))
+    matcher.set_index(AbbreviationIndex([], [phrase]), "ab")
+    assert_that(matcher.candidates(), is_(equal_to(([], [phrase]))))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_with_changes_equals_rebuilt_index_and_keeps_original(seed: int):
+    rng = random.Random(seed)
+    phrases = generate_phrases(seed)
+    original = AbbreviationIndex([], phrases)
+    original_entries = original.entries()
+
+    removed = rng.sample(phrases, 10)
+    remaining = [phrase for phrase in phrases if phrase not in removed]
+    changed = original.with_changes(removed, [])
+    assert_that(changed.entries(), is_(equal_to(AbbreviationIndex([], remaining).entries())))
+    assert_that(original.entries(), is_(equal_to(original_entries)))
+
+    restored = changed.with_changes([], [(phrases.index(phrase), phrase, False) for phrase in removed])
+    assert_that(restored.entries(), is_(equal_to(original_entries)))
+    for buffer in generate_buffers(seed, 50):
+        assert_that(restored.find_candidates(buffer), is_(equal_to(original.find_candidates(buffer))))
+
+
+def test_matcher_keeps_case_folded_input():
+    phrase = create_phrase(["Straße"], ignore_case=True, immediate=False, trigger_inside=False)
+    matcher = AbbreviationMatcher(AbbreviationIndex([], [phrase]))
+    for char in "STRASSE ":
+        matcher.push(char)
+
+    assert_that(matcher.folded_chars(), contains_exactly(*"strasse "))
+    assert_that(matcher.candidates(), is_(equal_to(([], [phrase]))))
@@ -0,0 +1,88 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+from hamcrest import *
+
+from autokey.model.key import Key
+from autokey.model.script import Script
+from tests.benchmarks import injection, matching, scripts
+
+
+def test_matching_benchmark_reports_results(tmp_path):
+    output = tmp_path / "results.json"
+    matching.main(["--sizes", "100", "--keystrokes", "1000", "--output", str(output)])
+
+    results = json.loads(output.read_text())
+    assert_that(results["benchmark"], is_(equal_to("matching")))
+    result, = results["results"]
+    assert_that(result["phrases"], is_(equal_to(100)))
+    assert_that(result["keystrokes"], is_(equal_to(1000)))
+    latency = result["latency_ns"]
+    assert_that(latency, has_entries(p50=greater_than(0), p99=greater_than_or_equal_to(latency["p50"])))
+    assert_that(result["expanded_characters"], is_(greater_than(0)), "No abbreviation was expanded")
+    assert_that(result["memory"], has_key("replay_peak_bytes"))
+
+
+def test_matching_benchmark_loads_recorded_stream(tmp_path):
+    stream = tmp_path / "stream.json"
+    stream.write_text(json.dumps(["a", "<backspace>", {"key": "B", "modifiers": ["<shift>"], "window": ["t", "c"]}]))
+
+    keystrokes = matching.load_stream(str(stream))
+
+    assert_that([keystroke.key for keystroke in keystrokes], contains_exactly("a", Key.BACKSPACE, "B"))
+    assert_that(keystrokes[2].raw_key, is_(equal_to("b")))
+    assert_that(keystrokes[2].window.wm_class, is_(equal_to("c")))
+
+
+def test_injection_benchmark_compares_backends(tmp_path):
+    output = tmp_path / "results.json"
+    injection.main(["--length", "200", "--repeat", "1", "--round-trip-us", "0", "--output", str(output)])
+
+    results = json.loads(output.read_text())
+    assert_that(results["benchmark"], is_(equal_to("injection")))
+    assert_that([result["backend"] for result in results["results"]], contains_exactly(*injection.BACKENDS))
+    for result in results["results"]:
+        assert_that(result, has_entries(characters=200, chars_per_second=greater_than(0), typed_correctly=True))
+    send_event, xtest = results["results"]
+    assert_that(xtest["flushes"], is_(equal_to(1)))
+    assert_that(xtest["round_trips"], is_(less_than(send_event["round_trips"])))
+
+
+def test_scripts_benchmark_reports_overhead(tmp_path):
+    output = tmp_path / "results.json"
+    scripts.main(["--runs", "200", "--output", str(output)])
+
+    results = json.loads(output.read_text())
+    assert_that(results["benchmark"], is_(equal_to("scripts")))
+    assert_that([result["entry_point"] for result in results["results"]],
+                contains_exactly("execute_script", "run_subscript"))
+    for result in results["results"]:
+        assert_that(result, has_entries(runs=200, cache_hit_rate=greater_than(0.99)))
+        assert_that(result["latency_ns"], has_entries(p50=greater_than(0)))
+        # Only the scripting API and a few modules, not the namespace of the service module
+        assert_that(result["namespace_size"], is_(less_than(25)))
+
+
+def test_scripts_keep_the_names_they_used_without_importing_them():
+    runner = scripts.create_runner()
+    script = Script("names", "\n".join((
+        "thread = threading.Thread(target=store.set_value, args=('ran', True))",
+        "thread.start()",
+        "thread.join()",
+        "store['found'] = [name in globals() for name in ('logger', 'KEY_FIND_RE', 'ConfigManager', 'Key')]",
+    )))
+    runner.run_subscript(script)
+
+    assert_that(script.store, has_entries(ran=True, found=[True] * 4))
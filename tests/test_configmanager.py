@@ -26,10 +26,13 @@ from tests.engine_helpers import *
 import autokey.model.folder as akfolder
 from autokey.configmanager.configmanager import ConfigManager
 from autokey.configmanager.configmanager_constants import CONFIG_DEFAULT_FOLDER
+from autokey.configmanager.window_filter_cache import WindowFilterCache
+import autokey.configmanager.configmanager
 import autokey.configmanager.predefined_user_files
 from autokey.service import PhraseRunner
 import autokey.service
 from autokey.scripting import Engine
+from autokey.interface import WindowInfo
 
 # These tests currently use the scripting API to create test phrases.
 # If we can do it a better way, we probably should, to reduce dependencies for
@@ -81,3 +84,132 @@ def test_create_predefined_user_files_my_phrases_folder(create_engine):
     os.makedirs(CONFIG_DEFAULT_FOLDER, exist_ok=True)
     phrases_folder = autokey.configmanager.predefined_user_files.create_my_phrases_folder()
     scripts_folder = autokey.configmanager.predefined_user_files.create_sample_scripts_folder()
+
+def test_window_filter_cache_selects_items_for_window(create_engine):
+    engine, folder = create_engine
+    unfiltered = create_test_hotkey(engine, folder, (["<ctrl>"], "a"))
+    filtered = create_test_hotkey(engine, folder, (["<ctrl>"], "b"), windowFilter="Firefox.*")
+    engine.configManager.config_altered(False)
+    cache = engine.configManager.windowFilterCache
+
+    firefox = cache.get(WindowInfo("Firefox - Start page", "Navigator.firefox"))
+    assert_that(unfiltered in firefox and filtered in firefox)
+    terminal = cache.get(WindowInfo("Terminal", "konsole.konsole"))
+    assert_that(unfiltered in terminal and filtered not in terminal)
+    assert_that(cache.get(WindowInfo("Terminal", "konsole.konsole")), is_(terminal))
+    assert_that(cache.hits, is_(equal_to(1)))
+
+    engine.configManager.config_altered(False)
+    assert_that(engine.configManager.windowFilterCache, is_not(cache))
+
+
+def test_window_filter_cache_is_bounded():
+    cache = WindowFilterCache([], maxsize=2)
+    for title in ("a", "b", "c"):
+        cache.get(WindowInfo(title, ""))
+    cache.get(WindowInfo("a", ""))
+    assert_that(cache.misses, is_(equal_to(4)))
+
+
+def test_hotkey_index_orders_dispatch_by_filter_specificity(create_engine):
+    engine, folder = create_engine
+    unfiltered = create_test_hotkey(engine, folder, (["<ctrl>"], "a"))
+    filtered = create_test_hotkey(engine, folder, (["<ctrl>"], "c"), windowFilter="Firefox.*")
+    # Bypass the uniqueness check of the scripting API
+    filtered.set_hotkey(["<ctrl>"], "a")
+    engine.configManager.config_altered(False)
+    index = engine.configManager.hotkeyIndex
+
+    assert_that(index.dispatch_items(["<ctrl>"], "a"), is_(equal_to([filtered, unfiltered])))
+    assert_that(index.registered(["<ctrl>"], "a")[1], is_(equal_to([unfiltered, filtered])))
+    assert_that(index.dispatch_items(["<ctrl>"], "b"), is_(empty()))
+    # Unsetting a hotkey is visible before the next rebuild.
+    filtered.unset_hotkey()
+    assert_that(index.dispatch_items(["<ctrl>"], "a"), is_(equal_to([unfiltered])))
+
+
+def test_config_altered_publishes_new_snapshot(create_engine):
+    engine, folder = create_engine
+    config_manager = engine.configManager
+    old_snapshot = config_manager.snapshot
+    hotkey_item = create_test_hotkey(engine, folder, (["<ctrl>"], "a"))
+
+    new_snapshot = config_manager.snapshot
+    assert_that(new_snapshot.version, is_(greater_than(old_snapshot.version)))
+    assert_that(new_snapshot.hotkey_index.dispatch_items(["<ctrl>"], "a"), is_(equal_to([hotkey_item])))
+    # Readers holding the previous snapshot keep a consistent, unchanged view.
+    assert_that(old_snapshot.hotkey_index.dispatch_items(["<ctrl>"], "a"), is_(empty()))
+
+
+def test_apply_changes_matches_full_rebuild(create_engine):
+    engine, folder = create_engine
+    config_manager = engine.configManager
+    subfolder = engine.create_folder("sub", parent_folder=folder, temporary=True)
+    with patch("autokey.model.phrase.Phrase.persist"):
+        engine.create_phrase(folder, "first", "1", abbreviations=["ab"])
+        # The new sub folder is unknown, so this falls back to a full rebuild.
+        engine.create_phrase(subfolder, "second", "2", abbreviations=["cd"], temporary=True)
+        version = config_manager.snapshot.version
+        third = engine.create_phrase(folder, "third", "3", abbreviations=["abc"], hotkey=(["<ctrl>"], "t"))
+        engine.create_phrase(subfolder, "fourth", "4", hotkey=(["<ctrl>"], "f"), temporary=True)
+    assert_that(config_manager.snapshot.version, is_(equal_to(version + 2)))
+    assert_that(config_manager.check_index_consistency(), is_(True))
+    # Items of sub folders come first, matching the full rebuild order.
+    assert_that([item.description for item in config_manager.allItems],
+                is_(equal_to(["second", "fourth", "first", "third"])))
+
+    third.add_abbreviation("xyz")
+    third.unset_hotkey()
+    config_manager.apply_changes(updated=[third])
+    assert_that(config_manager.check_index_consistency(), is_(True))
+    assert_that(config_manager.snapshot.abbreviation_index.find_candidates("xyz ")[1], is_(equal_to([third])))
+
+    folder.remove_item(third)
+    config_manager.apply_changes(removed=[third])
+    engine.remove_all_temporary()
+    assert_that(config_manager.check_index_consistency(), is_(True))
+    assert_that(config_manager.allItems, has_length(1))
+
+
+def test_check_index_consistency_rebuilds_on_mismatch(create_engine):
+    engine, folder = create_engine
+    with patch("autokey.model.phrase.Phrase.persist"):
+        phrase = engine.create_phrase(folder, "phrase", "content", abbreviations=["ab"])
+    # Changed without reporting it
+    phrase.add_abbreviation("cd")
+    assert_that(engine.configManager.check_index_consistency(), is_(False))
+    assert_that(engine.configManager.check_index_consistency(), is_(True))
+
+
+def test_remove_all_temporary_detaches_entries_from_their_parents(create_engine):
+    engine, folder = create_engine
+    config_manager = engine.configManager
+    temporary_folder = engine.create_folder("temporary", temporary=True)
+    engine.create_phrase(temporary_folder, "nested", "1", abbreviations=["ne"], temporary=True)
+    for number in range(3):
+        engine.create_phrase(folder, str(number), "2", abbreviations=["t" + str(number)], temporary=True)
+
+    engine.remove_all_temporary()
+
+    assert_that(folder.items, is_(empty()))
+    assert_that(config_manager.folders, not_(has_item(temporary_folder)))
+    assert_that(config_manager.check_index_consistency(), is_(True))
+    assert_that(config_manager.allItems, is_(empty()))
+
+
+def test_apply_changes_saves_and_checks_consistency_when_debugging(create_engine):
+    engine, folder = create_engine
+    config_manager = engine.configManager
+    with patch("autokey.model.phrase.Phrase.persist"):
+        phrase = engine.create_phrase(folder, "phrase", "content", abbreviations=["ab"])
+    phrase.add_abbreviation("cd")
+    logger = autokey.configmanager.configmanager.logger
+
+    with patch("autokey.configmanager.configmanager.save_config") as save_config, \
+            patch.object(logger, "isEnabledFor", return_value=True), \
+            patch.object(ConfigManager, "check_index_consistency") as check_index_consistency:
+        config_manager.apply_changes(updated=[phrase], persistGlobal=True)
+
+    save_config.assert_called_once_with(config_manager)
+    check_index_consistency.assert_called_once_with()
+    assert_that(config_manager.check_index_consistency(), is_(True))
@@ -0,0 +1,490 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+import typing
+from unittest.mock import MagicMock, patch
+
+import pytest
+from hamcrest import *
+
+import autokey.configmanager.configmanager_constants as cm_constants
+from autokey.interface import MAPPING_CHANGE_DEBOUNCE, PRIORITY_BACKGROUND, PRIORITY_INPUT, PRIORITY_OUTPUT, WorkQueue
+from autokey.interface import AbstractClipboard
+from autokey.configmanager.configmanager import ConfigManager
+from autokey.iomediator.constants import SEND_EVENT_BACKEND, XTEST_BACKEND
+from autokey.model.key import Key
+from autokey.model.phrase import SendMode
+from tests.benchmarks import injection
+
+
+def create_interface(backend: str):
+    simulated_display = injection.SimulatedDisplay(injection.RequestRecorder(0, 0))
+    interface = injection.create_interface(simulated_display)
+    with patch.dict(ConfigManager.SETTINGS, {cm_constants.KEYBOARD_BACKEND: backend}):
+        yield interface, simulated_display
+    interface.cancel()
+
+
+@pytest.fixture
+def xtest_interface():
+    yield from create_interface(XTEST_BACKEND)
+
+
+@pytest.fixture(params=[SEND_EVENT_BACKEND, XTEST_BACKEND])
+def any_interface(request):
+    yield from create_interface(request.param)
+
+
+def test_xtest_backend_sends_string_with_single_flush(xtest_interface):
+    interface, simulated_display = xtest_interface
+    recorder = simulated_display.recorder
+    round_trips = []
+    # Both strings are sent to the same window, its window information is only read once.
+    interface.get_window_info()
+    for text in ("Hi", "Hello, World!"):
+        recorder.reset()
+        interface.send_string(text)
+        interface.wait_for_queues()
+        round_trips.append(recorder.round_trips)
+
+    assert_that(recorder.flushes, is_(equal_to(1)))
+    assert_that(round_trips[1], is_(equal_to(round_trips[0])), "Characters were sent waiting for the X server")
+    assert_that(injection.typed_text(simulated_display, recorder.key_events), is_(equal_to("Hello, World!")))
+
+
+def test_injected_key_events_are_not_handled_as_user_input(xtest_interface):
+    interface, simulated_display = xtest_interface
+    interface.send_string("aB")
+    interface.wait_for_queues()
+    handled = []
+    interface.mediator.handle_keypress = lambda key_code, window_info: handled.append(key_code)
+
+    for key_event in simulated_display.recorder.key_events:
+        if key_event.type == injection.X.KeyPress:
+            interface.handle_keypress(key_event.key_code)
+        else:
+            interface.handle_keyrelease(key_event.key_code)
+    # A key typed by the user after the injected ones
+    interface.handle_keypress(simulated_display.keysym_to_keycode(ord("a")))
+    interface.wait_for_queues()
+
+    assert_that(handled, contains_exactly(simulated_display.keysym_to_keycode(ord("a"))))
+
+
+@pytest.mark.parametrize("text", ["plain text", "Mixed Case & symbols: {}!", "caf\u00e9 \u00bd \u00e9t\u00e9"])
+def test_send_string_types_text(any_interface, text):
+    interface, simulated_display = any_interface
+    recorder = simulated_display.recorder
+    recorder.reset()
+    interface.send_string(text)
+    interface.wait_for_queues()
+
+    assert_that(injection.typed_text(simulated_display, recorder.key_events), is_(equal_to(text)))
+
+
+def test_send_string_holds_shift_for_runs_of_shifted_characters(any_interface):
+    interface, simulated_display = any_interface
+    recorder = simulated_display.recorder
+    shift = {simulated_display.keysym_to_keycode(keysym) for keysym in (injection.XK.XK_Shift_L, injection.XK.XK_Shift_R)}
+    recorder.reset()
+    interface.send_string("HELLO WORLD, Hi")
+    interface.wait_for_queues()
+
+    shift_events = [key_event.type for key_event in recorder.key_events if key_event.key_code in shift]
+    assert_that(shift_events, contains_exactly(*[injection.X.KeyPress, injection.X.KeyRelease] * 3))
+    assert_that(len(recorder.key_events), is_(equal_to(2 * len("HELLO WORLD, Hi") + len(shift_events))))
+
+
+def test_missing_characters_reuse_least_recently_used_key_codes():
+    simulated_display = injection.SimulatedDisplay(injection.RequestRecorder(0, 0), spare_keycodes=2)
+    interface = injection.create_interface(simulated_display)
+    recorder = simulated_display.recorder
+    try:
+        sent = []
+        for text in ("日本", "日", "語日", "\U0001f600語\U0001f44d日"):
+            recorder.reset()
+            interface.send_string(text)
+            interface.wait_for_queues()
+            sent.append((injection.typed_text(simulated_display, recorder.key_events), recorder.mapping_changes))
+    finally:
+        interface.cancel()
+
+    assert_that(sent, contains_exactly(
+        ("日本", 1),
+        ("日", 0),
+        # Replaces the binding of the least recently used character only
+        ("語日", 1),
+        # More characters than spare key codes
+        ("\U0001f600語\U0001f44d日", 2),
+    ))
+
+
+def test_only_foreign_keyboard_mapping_changes_rebuild_the_mappings(xtest_interface):
+    interface, simulated_display = xtest_interface
+    with patch.object(interface, "on_keys_changed") as on_keys_changed:
+        interface.send_string("é€")
+        interface.wait_for_queues()
+        # A burst of changes is handled once
+        for first_keycode in (38, 39, 40):
+            simulated_display.post_event(injection.types.SimpleNamespace(
+                type=injection.X.MappingNotify, request=injection.X.MappingKeyboard, first_keycode=first_keycode,
+                count=1))
+        deadline = time.monotonic() + 5
+        while (simulated_display.events or not on_keys_changed.called) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(2 * MAPPING_CHANGE_DEBOUNCE)
+
+    on_keys_changed.assert_called_once_with()
+
+
+def create_hotkey(key: str, modifiers, window_filter: str=None):
+    hotkey = MagicMock(hotKey=key, modifiers=modifiers)
+    hotkey.get_applicable_regex.return_value = window_filter
+    return hotkey
+
+
+def test_hotkeys_are_grabbed_once_in_root_window(xtest_interface):
+    interface, simulated_display = xtest_interface
+    root = simulated_display.root.id
+    filtered = [create_hotkey("a", [Key.CONTROL], "editor"), create_hotkey("a", [Key.CONTROL], "terminal")]
+    unfiltered = create_hotkey("a", [Key.CONTROL])
+    grabs = []
+
+    def grabbed_after(method, item):
+        grabs.clear()
+        method(item)
+        interface.wait_for_queues()
+        return list(grabs)
+
+    with patch.object(injection.SimulatedWindow, "grab_key",
+                      lambda window, key_code, mask, owner_events, pointer_mode, keyboard_mode:
+                      grabs.append(("grab", window.id, keyboard_mode))), \
+            patch.object(injection.SimulatedWindow, "ungrab_key",
+                         lambda window, key_code, mask: grabs.append(("ungrab", window.id))):
+        # One grab, including the NumLock and CapsLock variants, while only window filtered items use the hotkey
+        assert_that(grabbed_after(interface.grab_hotkey, filtered[0]),
+                    only_contains(("grab", root, injection.X.GrabModeSync)))
+        assert_that(grabbed_after(interface.grab_hotkey, filtered[1]), is_(empty()))
+        # An item without a window filter turns it into an asynchronous grab
+        assert_that(grabbed_after(interface.grab_hotkey, unfiltered), contains_exactly(
+            *[("ungrab", root)] * 4, *[("grab", root, injection.X.GrabModeAsync)] * 4))
+        assert_that(grabbed_after(interface.ungrab_hotkey, unfiltered), contains_exactly(
+            *[("ungrab", root)] * 4, *[("grab", root, injection.X.GrabModeSync)] * 4))
+        assert_that(grabbed_after(interface.ungrab_hotkey, filtered[0]), is_(empty()))
+        assert_that(grabbed_after(interface.ungrab_hotkey, filtered[1]), contains_exactly(*[("ungrab", root)] * 4))
+        # Windows created later are not visited
+        grabs.clear()
+        simulated_display.post_event(injection.types.SimpleNamespace(
+            type=injection.X.CreateNotify, window=injection.SimulatedWindow(simulated_display.recorder, 0x300)))
+        time.sleep(0.1)
+        interface.wait_for_queues()
+
+    assert_that(grabs, is_(empty()))
+
+
+@pytest.mark.parametrize("filter_matches, expected_mode", [
+    (True, injection.X.AsyncKeyboard),
+    (False, injection.X.ReplayKeyboard),
+])
+def test_window_filter_of_grabbed_hotkey_is_checked_when_pressed(xtest_interface, filter_matches, expected_mode):
+    interface, simulated_display = xtest_interface
+    hotkey = create_hotkey("a", [Key.CONTROL], "editor")
+    interface.grab_hotkey(hotkey)
+    interface.wait_for_queues()
+    snapshot = MagicMock()
+    snapshot.hotkey_index.dispatch_items.return_value = [hotkey]
+    snapshot.hotkey_index.dispatch_folders.return_value = []
+    snapshot.window_filters.get.return_value = {hotkey} if filter_matches else set()
+    interface.app.configManager.snapshot = snapshot
+    allowed = []
+
+    with patch.object(simulated_display, "allow_events", lambda mode, time_: allowed.append(mode)):
+        # Pressed with CapsLock active
+        simulated_display.post_event(injection.types.SimpleNamespace(
+            type=injection.X.KeyPress, detail=simulated_display.keysym_to_keycode(ord("a")),
+            state=injection.X.ControlMask | injection.X.LockMask, time=1))
+        deadline = time.monotonic() + 5
+        while not allowed and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    assert_that(allowed, contains_exactly(expected_mode))
+    snapshot.hotkey_index.dispatch_items.assert_called_once_with([Key.CONTROL], "a")
+    snapshot.window_filters.get.assert_called_once_with(("", "editor.Editor"))
+
+
+def wait_until(condition, timeout: float=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_window_info_is_cached_until_the_window_changes(xtest_interface):
+    interface, simulated_display = xtest_interface
+    recorder = simulated_display.recorder
+    focus_lookups = []
+    get_input_focus = simulated_display.get_input_focus
+
+    def lookup_requests():
+        recorder.reset()
+        assert_that(interface.get_window_info(), is_(equal_to(("", "editor.Editor"))))
+        return recorder.requests
+
+    with patch.object(simulated_display, "get_input_focus", lambda: focus_lookups.append(1) or get_input_focus()):
+        assert_that(lookup_requests(), is_(greater_than(0)))
+        assert_that(lookup_requests(), is_(equal_to(0)))
+        # The title of the focused window changed
+        simulated_display.post_event(injection.types.SimpleNamespace(
+            type=injection.X.PropertyNotify, window=simulated_display.focus,
+            atom=simulated_display.atoms["_NET_WM_NAME"], state=injection.X.PropertyNewValue))
+        wait_until(lambda: lookup_requests() > 0)
+        assert_that(lookup_requests(), is_(equal_to(0)))
+        assert_that(focus_lookups, has_length(1))
+        # Another window became active
+        simulated_display.post_event(injection.types.SimpleNamespace(
+            type=injection.X.PropertyNotify, window=simulated_display.root,
+            atom=simulated_display.atoms["_NET_ACTIVE_WINDOW"], state=injection.X.PropertyNewValue))
+        wait_until(lambda: lookup_requests() > 0)
+
+    assert_that(focus_lookups, has_length(2))
+
+
+def test_repeated_key_is_sent_with_single_flush(any_interface):
+    interface, simulated_display = any_interface
+    recorder = simulated_display.recorder
+    backspace = simulated_display.keysym_to_keycode(injection.XK.XK_BackSpace)
+    recorder.reset()
+    interface.send_key(Key.BACKSPACE, 200)
+    interface.wait_for_queues()
+
+    assert_that(recorder.key_events, only_contains(has_property("key_code", backspace)))
+    assert_that(recorder.key_events, has_length(400))
+    assert_that(recorder.flushes, is_(equal_to(1)))
+    assert_that(recorder.round_trips, is_(less_than_or_equal_to(1)))
+
+
+def test_keys_are_sent_using_the_keymap_of_the_output_connection(any_interface):
+    interface, simulated_display = any_interface
+    lookups = []
+    for connection in (interface.outputDisplay, interface.localDisplay):
+        connection.keysym_to_keycode = lambda keysym, connection=connection, lookup=connection.keysym_to_keycode: (
+            lookups.append(connection) or lookup(keysym))
+    interface.send_key(Key.BACKSPACE)
+    interface.press_key(Key.SHIFT)
+    interface.release_key(Key.SHIFT)
+    interface.wait_for_queues()
+
+    assert_that(lookups, has_length(3))
+    assert_that(lookups, only_contains(same_instance(interface.outputDisplay)))
+
+
+def test_user_input_is_handled_while_output_is_sent(xtest_interface):
+    interface, simulated_display = xtest_interface
+    handled = []
+    interface.mediator.handle_keypress = lambda key_code, window_info: handled.append(key_code)
+    started, sending = threading.Event(), threading.Event()
+    interface.send_string("Hello")
+    # Stands in for a long running output item, like typing a long phrase
+    interface.outputQueue.put(lambda: started.set() or sending.wait(5))
+    interface.send_string(", World!")
+    started.wait(5)
+
+    interface.handle_keypress(simulated_display.keysym_to_keycode(ord("a")))
+    interface.inputQueue.join()
+    assert_that(handled, contains_exactly(simulated_display.keysym_to_keycode(ord("a"))))
+    assert_that(interface.queue_statistics()["output"], has_entries(depth=1))
+
+    sending.set()
+    interface.wait_for_queues()
+    statistics = interface.queue_statistics()
+    assert_that(injection.typed_text(simulated_display, simulated_display.recorder.key_events),
+                is_(equal_to("Hello, World!")))
+    assert_that(statistics["output"], has_entries(depth=0, items=3, max_depth=is_(greater_than_or_equal_to(2))))
+    assert_that(statistics["input"]["max_run_ns"], is_(greater_than(0)))
+
+
+def block_queue(work_queue: WorkQueue) -> threading.Event:
+    """Keep the thread of the given queue busy, until the returned event is set."""
+    started, release = threading.Event(), threading.Event()
+    work_queue.put(lambda: started.set() or release.wait(5), priority=PRIORITY_INPUT)
+    started.wait(5)
+    return release
+
+
+def test_work_queue_runs_urgent_work_first_and_drops_replaced_work():
+    work_queue = WorkQueue("test")
+    work_queue.start()
+    ran = []
+    release = block_queue(work_queue)
+    work_queue.put(ran.append, "grab", priority=PRIORITY_BACKGROUND)
+    work_queue.put(ran.append, "first regrab", priority=PRIORITY_BACKGROUND, key="regrab")
+    work_queue.put(ran.append, "send", priority=PRIORITY_OUTPUT)
+    work_queue.put(ran.append, "second regrab", priority=PRIORITY_BACKGROUND, key="regrab")
+    work_queue.put(ran.append, "key", priority=PRIORITY_INPUT)
+    work_queue.put(ran.append, "cancelled", key="cancelled")
+    work_queue.cancel("cancelled")
+    release.set()
+    work_queue.join()
+    work_queue.stop()
+
+    assert_that(ran, contains_exactly("key", "send", "grab", "second regrab"))
+    assert_that(work_queue.statistics(), has_entries(items=5, cancelled=2, depth=0))
+
+
+def test_hotkeys_are_not_grabbed_in_windows_destroyed_before(xtest_interface):
+    interface, simulated_display = xtest_interface
+    windows = [injection.SimulatedWindow(simulated_display.recorder, window_id) for window_id in (0x300, 0x301, 0x302)]
+    grabbed = []
+    with patch("autokey.interface.subprocess.check_output", return_value=b"/usr/bin/gnome-shell\n"), \
+            patch.object(injection.SimulatedWindow, "grab_key", lambda window, *args: grabbed.append(window.id)):
+        interface.grab_hotkey(create_hotkey("a", [Key.SUPER]))
+        interface.wait_for_queues()
+        grabbed.clear()
+        release = block_queue(interface.inputQueue)
+        for window in windows:
+            simulated_display.post_event(injection.types.SimpleNamespace(type=injection.X.CreateNotify, window=window))
+        wait_until(lambda: not simulated_display.events)
+        simulated_display.post_event(injection.types.SimpleNamespace(type=injection.X.DestroyNotify, window=windows[1]))
+        wait_until(lambda: not simulated_display.events)
+        time.sleep(0.05)
+        release.set()
+        interface.wait_for_queues()
+
+    # With the NumLock and CapsLock variants
+    assert_that(grabbed, contains_exactly(*[0x300] * 4, *[0x302] * 4))
+
+
+def request_selection(requestor: injection.SimulatedWindow, selection: int, target_property: int) -> bytes:
+    """Paste like an application does: Request the selection content and wait until the owner sent it."""
+    connection = requestor.connection
+    utf8 = connection.intern_atom("UTF8_STRING")
+    requestor.convert_selection(selection, utf8, target_property, injection.X.CurrentTime)
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if connection.pending_events() and connection.next_event().type == injection.X.SelectionNotify:
+            return requestor.properties.pop(target_property).value
+        time.sleep(0.01)
+    raise AssertionError("The selection owner did not answer")
+
+
+class ToolkitClipboard(AbstractClipboard):
+    """Stands in for the Qt or GTK clipboard of AutoKey. A window of its own serves the content set."""
+
+    def __init__(self, connection):
+        self.window = connection.screen().root.create_window(0, 0, 1, 1, 0, 0)
+        self.atoms = {name: connection.intern_atom(name) for name in ("CLIPBOARD", "PRIMARY")}
+        self.contents = []
+
+    def __set(self, selection: str, content: str):
+        self.contents.append(content)
+        self.window.selection_text = content
+        self.window.set_selection_owner(self.atoms[selection], injection.X.CurrentTime)
+
+    text = property(lambda self: self.window.selection_text, lambda self, content: self.__set("CLIPBOARD", content))
+    selection = property(lambda self: self.window.selection_text, lambda self, content: self.__set("PRIMARY", content))
+
+
+def create_clipboard_application(interface, simulated_display, content: typing.Optional[str]):
+    application = injection.SimulatedConnection(simulated_display)
+    clipboard = application.intern_atom("CLIPBOARD")
+    if content is not None:
+        owner = application.screen().root.create_window(0, 0, 1, 1, 0, 0)
+        owner.selection_text = content
+        owner.set_selection_owner(clipboard, injection.X.CurrentTime)
+    requestor = application.screen().root.create_window(0, 0, 1, 1, 0, 0)
+    interface.mediator.send_string = MagicMock()
+    interface.clipboard = ToolkitClipboard(injection.SimulatedConnection(simulated_display))
+    with patch.object(injection.autokey.interface.display, "Display",
+                      lambda: injection.SimulatedConnection(simulated_display)):
+        yield interface, requestor, clipboard
+        interface.wait_for_queues()
+    application.close()
+
+
+@pytest.fixture
+def clipboard_application(xtest_interface):
+    """An application owning the clipboard, and the window it pastes into. Selection owners connect to the display."""
+    yield from create_clipboard_application(*xtest_interface, "previous")
+
+
+@pytest.fixture
+def empty_clipboard_application(xtest_interface):
+    """An application, that pastes into its window. The clipboard has no owner."""
+    yield from create_clipboard_application(*xtest_interface, None)
+
+
+def test_clipboard_is_restored_once_the_pasted_text_was_requested(clipboard_application):
+    interface, requestor, clipboard = clipboard_application
+    target_property = requestor.connection.intern_atom("PASTED")
+    received = []
+    with patch.dict(ConfigManager.SETTINGS, {cm_constants.CLIPBOARD_RESTORE_TIMEOUT: 30}):
+        start = time.monotonic()
+        for text in ("first", "second"):
+            interface.send_string_clipboard(text, SendMode.CB_CTRL_V)
+            interface.outputQueue.join()
+            received.append(request_selection(requestor, clipboard, target_property))
+        interface.wait_for_queues()
+        elapsed = time.monotonic() - start
+
+    assert_that(received, contains_exactly(b"first", b"second"))
+    assert_that(interface.mediator.send_string.call_count, is_(equal_to(2)))
+    interface.mediator.send_string.assert_called_with(SendMode.CB_CTRL_V.value)
+    assert_that(elapsed, is_(less_than(5)), "The restore waited for the fallback timeout")
+    assert_that(request_selection(requestor, clipboard, target_property), is_(equal_to(b"previous")))
+    # Handed back to the toolkit clipboard, which serves it from now on
+    assert_that(interface.clipboard.contents, all_of(not_(empty()), only_contains("previous")))
+    assert_that(requestor.connection.get_selection_owner(clipboard), is_(same_instance(interface.clipboard.window)))
+
+
+def test_clipboard_is_released_after_pasting_if_it_was_empty(empty_clipboard_application):
+    interface, requestor, clipboard = empty_clipboard_application
+    target_property = requestor.connection.intern_atom("PASTED")
+    with patch.dict(ConfigManager.SETTINGS, {cm_constants.CLIPBOARD_RESTORE_TIMEOUT: 30}):
+        interface.send_string_clipboard("pasted", SendMode.CB_CTRL_V)
+        interface.outputQueue.join()
+        received = request_selection(requestor, clipboard, target_property)
+        interface.wait_for_queues()
+
+    assert_that(received, is_(equal_to(b"pasted")))
+    assert_that(interface.clipboard.contents, is_(empty()))
+    assert_that(requestor.connection.get_selection_owner(clipboard), is_(equal_to(injection.X.NONE)))
+
+
+def test_clipboard_is_restored_after_timeout_if_not_requested(clipboard_application):
+    interface, requestor, clipboard = clipboard_application
+    target_property = requestor.connection.intern_atom("PASTED")
+    with patch.dict(ConfigManager.SETTINGS, {cm_constants.CLIPBOARD_RESTORE_TIMEOUT: 0.05}):
+        interface.send_string_clipboard("never pasted", SendMode.CB_CTRL_V)
+        interface.wait_for_queues()
+
+    assert_that(interface.queue_statistics()["clipboard"], has_entries(items=1))
+    assert_that(request_selection(requestor, clipboard, target_property), is_(equal_to(b"previous")))
+
+
+def test_single_key_events_are_flushed_once_the_output_queue_is_idle(any_interface):
+    interface, simulated_display = any_interface
+    recorder = simulated_display.recorder
+    interface.get_window_info()
+    interface.wait_for_queues()
+    recorder.reset()
+    if ConfigManager.SETTINGS[cm_constants.KEYBOARD_BACKEND] == XTEST_BACKEND:
+        interface.fake_keypress("a")
+        interface.wait_for_queues()
+        assert_that(recorder.pending, is_(False))
+    interface.press_key("b")
+    interface.release_key("b")
+    interface.wait_for_queues()
+
+    assert_that(recorder.pending, is_(False))
+    assert_that(recorder.flushes, is_(greater_than_or_equal_to(1)))
@@ -14,11 +14,12 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import typing
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 import pytest
 from hamcrest import *
 
+import autokey.model.abstract_abbreviation
 import autokey.model.helpers
 import autokey.model.phrase
 from autokey.interface import WindowInfo
@@ -309,6 +310,12 @@ def generate_test_cases_for_case_insensitive_rpartition():
     yield "AB", "a", ("", "A", "B")
     yield "ABC", "b", ("A", "B", "C")
     yield "AB", "b", ("A", "B", "")
+    # Case folding changes the length
+    yield "STRASSE", "straße", ("", "STRASSE", "")
+    yield "xStraße!", "STRASSE", ("x", "Straße", "!")
+    # A match must not cover only part of a folded character
+    yield "aßb", "s", ("", "", "aßb")
+    yield "sßb", "s", ("", "s", "ßb")
 
 
 @pytest.mark.parametrize("input_str, match, expected", generate_test_cases_for_case_insensitive_rpartition())
@@ -316,6 +323,52 @@ def test_case_insensitive_rpartition(input_str: str, match: str, expected:typing
     assert_that(autokey.model.phrase.Phrase._case_insensitive_rpartition(input_str, match), is_(equal_to(expected)))
 
 
+def test_case_insensitive_rpartition_uses_given_folded_input():
+    buffer = autokey.model.abstract_abbreviation.InputBuffer("Maße ", ["m", "a", "ss", "e", " "])
+    assert_that(buffer.folded, is_(equal_to("masse ")))
+    assert_that(buffer.folded_rpartition("masse"), is_(equal_to(("", "Maße", " "))))
+
+
+def test_abbreviations_are_case_folded_when_set():
+    phrase = create_phrase(abbreviation="Straße", content="road", ignore_case=True)
+    phrase.add_abbreviation("ABC")
+    phrase.add_abbreviations(["Def"])
+    assert_that(phrase._folded_abbreviations, is_(equal_to({"Straße": "strasse", "ABC": "abc", "Def": "def"})))
+    copied = autokey.model.phrase.Phrase("copy", "")
+    copied.copy_abbreviation(phrase)
+    loaded = autokey.model.phrase.Phrase("loaded", "")
+    autokey.model.abstract_abbreviation.AbstractAbbreviation.load_from_serialized(
+        loaded, autokey.model.abstract_abbreviation.AbstractAbbreviation.get_serializable(phrase))
+
+    folded = phrase._folded_abbreviations
+    assert_that(phrase.match_input("STRASSE ", WindowInfo("", "")), is_(not_none()))
+    # Matching only reads the folded abbreviations.
+    assert_that(phrase._folded_abbreviations, is_(same_instance(folded)))
+    assert_that(copied._folded_abbreviations, is_(equal_to(folded)))
+    assert_that(loaded._folded_abbreviations, is_(equal_to(folded)))
+
+
+def test_ignore_case_backspaces_cover_typed_abbreviation():
+    phrase = create_phrase(abbreviation="straße", content="road", ignore_case=True)
+    expansion = phrase.build_phrase("STRASSE ")
+    assert_that(expansion.backspaces, is_(equal_to(len("STRASSE "))))
+    assert_that(phrase.get_trigger_chars("STRASSE "), is_(equal_to("STRASSE ")))
+
+
+def test_match_input_result_is_reused_by_build_phrase():
+    phrase = create_phrase(abbreviation="tri", content="expansion", ignore_case=True)
+    match = phrase.match_input("a TRI.", WindowInfo("", ""))
+    assert_that(match, is_(equal_to(autokey.model.abstract_abbreviation.AbbreviationMatch("tri", (2, 5), "TRI", "."))))
+
+    with patch.object(phrase, "_partition_input", side_effect=AssertionError("Input searched again")):
+        expansion = phrase.build_phrase("a TRI.", match)
+        trigger_chars = phrase.get_trigger_chars("a TRI.", match)
+    assert_that(expansion.backspaces, is_(equal_to(4)))
+    assert_that(expansion.string, is_(equal_to("expansion.")))
+    assert_that(trigger_chars, is_(equal_to("TRI.")))
+    assert_that(phrase.match_input("a TRIx", WindowInfo("", "")), is_(none()))
+
+
 def generate_test_cases_for_undo_on_backspace():
     """Yields PhraseData, typed_input, undo_enabled, PhraseResult"""
 
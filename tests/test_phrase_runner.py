@@ -13,15 +13,21 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
+import threading
 from unittest.mock import MagicMock, patch
 
 import pytest
 from hamcrest import *
 
+from tests.engine_helpers import *
+
 import autokey.service
 import autokey.model.key
+import autokey.configmanager.configmanager_constants as cm_constants
+from autokey.configmanager.configmanager import ConfigManager
+from autokey.model.key import Key
 from autokey.service import PhraseRunner
-from autokey.model.phrase import Phrase
+from autokey.model.phrase import Phrase, SendMode
 
 
 def _create_phrase_runner(phrase_content: str) -> PhraseRunner:
@@ -87,3 +93,80 @@ def test_can_undo_expansion(content: str, expected: bool):
         is_(equal_to(expected)),
         "can_undo() returned wrong result"
     )
+
+
+def _create_service(config_manager) -> autokey.service.Service:
+    """Create a Service whose phrase and script runners are mocks, so matched items are only recorded."""
+    app = MagicMock()
+    app.configManager = config_manager
+    service = autokey.service.Service(app)
+    service.phraseRunner = MagicMock()
+    service.phraseRunner.can_undo.return_value = False
+    service.scriptRunner = MagicMock()
+    return service
+
+
+def _type(service: autokey.service.Service, keys):
+    for key in keys:
+        service.handle_keypress(key, [], key, ("title", "class"))
+
+
+def test_typed_abbreviations_trigger_their_phrase(create_engine):
+    engine, folder = create_engine
+    with patch("autokey.model.phrase.Phrase.persist"):
+        phrase = engine.create_phrase(folder, "phrase", "out", abbreviations=["btw"])
+        immediate = engine.create_phrase(folder, "immediate", "out", abbreviations=["im"])
+    immediate.immediate = True
+    engine.configManager.config_altered(False)
+    service = _create_service(engine.configManager)
+
+    with patch.dict(ConfigManager.SETTINGS, {cm_constants.SERVICE_RUNNING: True}):
+        # The corrected typo still matches.
+        _type(service, ["x", " ", "b", "t", "q", Key.BACKSPACE, "w", " "])
+        assert_that(service.phraseRunner.execute.call_args[0][:2], is_(equal_to((phrase, "x btw "))))
+        # Immediate abbreviations trigger without a trigger character.
+        _type(service, ["i", "m"])
+
+    assert_that(service.phraseRunner.execute.call_args[0][:2], is_(equal_to((immediate, "im"))))
+    assert_that(service.phraseRunner.execute.call_count, is_(equal_to(2)))
+
+
+def test_keys_typed_while_the_configuration_is_locked_are_matched(create_engine):
+    engine, folder = create_engine
+    with patch("autokey.model.phrase.Phrase.persist"):
+        phrase = engine.create_phrase(folder, "phrase", "out", abbreviations=["btw"])
+    service = _create_service(engine.configManager)
+
+    with patch.dict(ConfigManager.SETTINGS, {cm_constants.SERVICE_RUNNING: True}):
+        # Matching uses the published snapshot, so it does not wait for a rebuild holding the lock.
+        engine.configManager.lock.acquire()
+        try:
+            _type(service, ["b", "t", "w", " "])
+        finally:
+            engine.configManager.lock.release()
+
+    assert_that(service.phraseRunner.execute.call_args[0][:2], is_(equal_to((phrase, "btw "))))
+
+
+def test_phrases_are_expanded_while_all_script_workers_are_busy():
+    app = MagicMock()
+    with patch.dict(ConfigManager.SETTINGS, {cm_constants.WORKER_POOL_SIZE: 1}):
+        service = autokey.service.Service(app)
+    service.mediator = MagicMock()
+    service.scriptRunner = MagicMock()
+    runner = PhraseRunner(service)
+    script_running, release_script = threading.Event(), threading.Event()
+    service.workerPool.submit(lambda: script_running.set() or release_script.wait(30))
+    try:
+        script_running.wait(5)
+        expanded = threading.Event()
+        service.mediator.interface.finish_send.side_effect = expanded.set
+        phrase = _generate_phrase("out")
+        phrase.sendMode = SendMode.KEYBOARD
+        runner.execute(phrase)
+
+        assert_that(expanded.wait(5), is_(True), "The phrase waited for the script")
+        service.mediator.send_string.assert_called_once_with("out")
+    finally:
+        release_script.set()
+        service.shutdown(save=False)
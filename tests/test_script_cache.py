@@ -0,0 +1,93 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+from unittest.mock import patch
+
+from hamcrest import *
+
+from autokey.model.script import Script
+from autokey.script_cache import CompiledCodeCache
+
+
+def run(code) -> dict:
+    scope = {}
+    exec(code, scope)
+    return scope
+
+
+def test_script_is_compiled_again_only_after_its_code_changed():
+    cache = CompiledCodeCache()
+    script = Script("description", "result = 1")
+    with patch("autokey.script_cache.compile", side_effect=compile, create=True) as compile_mock:
+        first = cache.get(script)
+        assert_that(cache.get(script), is_(same_instance(first)))
+        script.code = "result = 2"
+        assert_that(run(cache.get(script))["result"], is_(equal_to(2)))
+
+    assert_that(compile_mock.call_count, is_(equal_to(2)))
+    assert_that(cache.statistics(), has_entries(hits=1, misses=2, entries=1, hit_rate=close_to(1 / 3, 0.001)))
+
+
+def test_script_file_is_not_read_until_it_changed(tmp_path):
+    cache = CompiledCodeCache()
+    path = tmp_path / "script.py"
+    path.write_text("result = 1")
+    cache.get(path)
+    with patch.object(type(path), "read_text", side_effect=AssertionError("Script file read")):
+        cache.get(path)
+
+    path.write_text("result = 22")
+    assert_that(run(cache.get(path))["result"], is_(equal_to(22)))
+    # The file monitor reports changes, also those keeping modification time and size.
+    path.write_text("result = 33")
+    status = path.stat()
+    os.utime(path, ns=(status.st_atime_ns, status.st_mtime_ns))
+    cache.invalidate(str(path))
+    assert_that(run(cache.get(path))["result"], is_(equal_to(33)))
+    assert_that(cache.statistics(), has_entries(hits=1, misses=3))
+
+
+def test_compiled_code_is_persisted(tmp_path):
+    script = Script("description", "result = 'persisted'")
+    script.path = str(tmp_path / "script.py")
+    CompiledCodeCache(str(tmp_path)).get(script)
+    cache = CompiledCodeCache(str(tmp_path))
+
+    with patch("autokey.script_cache.compile", side_effect=AssertionError("Compiled again"), create=True):
+        code = cache.get(script)
+
+    assert_that(run(code)["result"], is_(equal_to("persisted")))
+    assert_that(cache.statistics(), has_entries(misses=1, disk_hits=1))
+
+
+def test_only_the_latest_compiled_code_of_a_script_is_persisted(tmp_path):
+    persist_dir = tmp_path / "compiled"
+    cache = CompiledCodeCache(str(persist_dir))
+    script = Script("description", "result = 1")
+    script.path = str(tmp_path / "script.py")
+    other = Script("other", "result = 'other'")
+    other.path = str(tmp_path / "other.py")
+    cache.get(other)
+    for version in range(2, 5):
+        script.code = "result = {}".format(version)
+        cache.get(script)
+    # Scripts without a file are not written
+    cache.get(Script("temporary", "result = 'temporary'"))
+
+    assert_that(list(persist_dir.iterdir()), has_length(2))
+    restarted = CompiledCodeCache(str(persist_dir))
+    with patch("autokey.script_cache.compile", side_effect=AssertionError("Compiled again"), create=True):
+        assert_that(run(restarted.get(script))["result"], is_(equal_to(4)))
+        assert_that(run(restarted.get(other))["result"], is_(equal_to("other")))
+    assert_that(restarted.statistics(), has_entries(disk_hits=2))
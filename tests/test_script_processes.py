@@ -0,0 +1,127 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from hamcrest import *
+
+import autokey.script_processes
+from autokey.model.store import Store
+from autokey.script_processes import ScriptProcessPool, ScriptProcessError, ScriptTimeoutError
+
+
+class FakeKeyboard:
+
+    def __init__(self):
+        self.sent = []
+
+    def send_keys(self, text: str):
+        self.sent.append(text)
+
+    def wait_for_keypress(self, key: str):
+        raise ValueError("Unknown key {}".format(key))
+
+
+@pytest.fixture
+def pool():
+    pool = ScriptProcessPool(1, 10)
+    yield pool
+    pool.shutdown()
+
+
+def test_api_calls_and_store_are_served_by_the_autokey_process(pool):
+    keyboard = FakeKeyboard()
+    store = Store(text="hello")
+    source = "\n".join((
+        "keyboard.send_keys(store['text'].upper())",
+        "store['file'] = __file__",
+        "store.set_value('keys', sorted(store))",
+        "try:",
+        "    keyboard.wait_for_keypress('<unknown>')",
+        "except ValueError as e:",
+        "    store['error'] = str(e)",
+        "thread = threading.Thread(target=store.set_value, args=('thread', KEY_FIND_RE.pattern != ''))",
+        "thread.start()",
+        "thread.join()",
+    ))
+
+    pool.run({"keyboard": keyboard, "store": store}, source, "script.py", {"__file__": "/scripts/script.py"})
+
+    assert_that(keyboard.sent, contains_exactly("HELLO"))
+    assert_that(store, has_entries(
+        file="/scripts/script.py", keys=["file", "text"], error="Unknown key <unknown>", thread=True))
+
+
+def test_workers_are_reused_and_errors_reported(pool):
+    store = Store()
+    for _ in range(2):
+        pool.run({"store": store}, "import os\nstore['pids'] = store.get('pids', set()) | {os.getpid()}", "script.py")
+
+    with pytest.raises(ScriptProcessError, match="ZeroDivisionError"):
+        pool.run({}, "1 / 0", "failing.py")
+
+    assert_that(store["pids"], has_length(1))
+    assert_that(pool.statistics(), has_entries(workers=1, runs=3))
+
+
+def test_runaway_script_is_killed_and_its_worker_replaced():
+    pool = ScriptProcessPool(1, 0.5)
+    store = Store()
+    try:
+        with pytest.raises(ScriptTimeoutError):
+            pool.run({}, "while True:\n    pass", "runaway.py")
+        pool.run({"store": store}, "store['ran'] = True", "script.py")
+    finally:
+        pool.shutdown()
+
+    assert_that(store, has_entries(ran=True))
+    assert_that(pool.statistics(), has_entries(workers=0, runs=2, timeouts=1))
+
+
+def test_workers_are_started_without_blocking_the_pool():
+    pool = ScriptProcessPool(1, 0.5)
+    condition = pool._ScriptProcessPool__condition
+    started_by = []
+
+    def acquire(acquired: list):
+        acquired.append(condition.acquire(timeout=1))
+        if acquired[0]:
+            condition.release()
+
+    def start_worker(context):
+        # Another thread can take the condition while the interpreter starts.
+        acquired = []
+        thread = threading.Thread(target=acquire, args=(acquired,))
+        thread.start()
+        thread.join()
+        started_by.append((threading.current_thread(), acquired[0]))
+        return worker_class(context)
+
+    worker_class = autokey.script_processes._Worker
+    try:
+        with patch("autokey.script_processes._Worker", side_effect=start_worker):
+            with pytest.raises(ScriptTimeoutError):
+                pool.run({}, "while True:\n    pass", "runaway.py")
+            deadline = time.monotonic() + 10
+            while pool.statistics()["workers"] == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+    finally:
+        pool.shutdown()
+
+    assert_that(started_by, has_length(2))
+    assert_that(started_by, only_contains(contains_exactly(anything(), True)))
+    # The replacement of the killed worker is started in the background.
+    assert_that(started_by[1][0], is_not(same_instance(threading.current_thread())))
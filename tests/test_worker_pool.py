@@ -0,0 +1,147 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from hamcrest import *
+
+from autokey.service import pooled
+from autokey.worker_pool import WorkerPool
+
+
+class Recorder:
+    """Records the start and end of runs. Runs block until released."""
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.started = threading.Semaphore(0)
+        self.release = threading.Event()
+
+    def run(self, name: str):
+        with self.lock:
+            self.events.append(("start", name))
+        self.started.release()
+        self.release.wait(5)
+        with self.lock:
+            self.events.append(("end", name))
+
+
+def wait_for_idle(pool: WorkerPool, timeout: float=5):
+    deadline = time.monotonic() + timeout
+    while (pool.depth or pool.running) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(2)
+    yield pool
+    pool.shutdown()
+
+
+def test_runs_of_a_lane_run_in_order_one_at_a_time(pool):
+    recorder = Recorder()
+    recorder.release.set()
+    for number in range(20):
+        pool.submit(recorder.run, (number,), lane="phrases")
+    wait_for_idle(pool)
+
+    assert_that(recorder.events, contains_exactly(*[(event, number) for number in range(20)
+                                                    for event in ("start", "end")]))
+    assert_that(pool.statistics(), has_entries(items=20, max_running=1, depth=0))
+
+
+def test_concurrency_is_limited_by_the_pool_size(pool):
+    recorder = Recorder()
+    for name in ("a", "b", "c"):
+        pool.submit(recorder.run, (name,))
+    assert_that(recorder.started.acquire(timeout=5), is_(True))
+    assert_that(recorder.started.acquire(timeout=5), is_(True))
+    # The third run waits for a free worker.
+    assert_that(recorder.started.acquire(timeout=0.1), is_(False))
+    assert_that(pool.statistics(), has_entries(running=2, depth=1, workers=2))
+
+    recorder.release.set()
+    wait_for_idle(pool)
+    assert_that(pool.statistics(), has_entries(items=3, max_running=2, max_depth=greater_than_or_equal_to(1)))
+
+
+def test_queued_runs_can_be_cancelled(pool):
+    recorder = Recorder()
+    pool.submit(recorder.run, ("first",), lane="script")
+    assert_that(recorder.started.acquire(timeout=5), is_(True))
+    second = pool.submit(recorder.run, ("second",), lane="script")
+    third = pool.submit(recorder.run, ("third",), lane="script")
+    other = pool.submit(recorder.run, ("other",), lane="other script")
+    assert_that(recorder.started.acquire(timeout=5), is_(True))
+
+    assert_that(second.cancel(), is_(True))
+    assert_that(pool.cancel_queued("script"), is_(equal_to(1)))
+    assert_that(other.cancel(), is_(False))
+    recorder.release.set()
+    wait_for_idle(pool)
+
+    assert_that(third.cancelled, is_(True))
+    assert_that(recorder.events, contains_inanyorder(
+        ("start", "first"), ("end", "first"), ("start", "other"), ("end", "other")))
+    assert_that(pool.statistics(), has_entries(items=2, cancelled=2, depth=0))
+
+
+class Runner:
+
+    def __init__(self, pool: WorkerPool):
+        self.workerPool = pool
+        self.ran = []
+
+    @pooled(lambda runner, name, allow_concurrent_runs=False: None if allow_concurrent_runs else name)
+    def execute(self, name: str, allow_concurrent_runs=False):
+        self.ran.append(name)
+
+
+def test_pooled_methods_run_on_the_pool_in_the_lane_of_their_arguments(pool):
+    runner = Runner(pool)
+    runs = [runner.execute("script"), runner.execute("script", allow_concurrent_runs=True)]
+    wait_for_idle(pool)
+
+    assert_that([run.lane for run in runs], contains_exactly("script", None))
+    assert_that(runner.ran, contains_inanyorder("script", "script"))
+    assert_that(Runner.execute._original.__name__, is_(equal_to("execute")))
+
+
+class TimingOutCondition(threading.Condition):
+    """Reports a timeout, even if notified. That happens, if the notification races with the timeout."""
+
+    def wait(self, timeout=None):
+        super().wait(timeout)
+        return False
+
+
+def test_workers_timing_out_while_woken_up_still_take_the_run():
+    pool = WorkerPool(4)
+    pool._WorkerPool__condition = TimingOutCondition()
+    ran = []
+    idle_counts = []
+    with patch("autokey.worker_pool.WORKER_IDLE_TIMEOUT", 0.001):
+        for number in range(300):
+            pool.submit(ran.append, (number,), lane="phrases" if number % 2 else None)
+            idle_counts.append(pool.idle_workers)
+            time.sleep(0.001)
+        wait_for_idle(pool)
+    pool.shutdown()
+
+    assert_that(sorted(ran), is_(equal_to(list(range(300)))))
+    assert_that(min(idle_counts + [pool.idle_workers]), is_(greater_than_or_equal_to(0)))